@@ -0,0 +1,118 @@
+"""
+Throughput of the messages handler: one invocation per update, like behind API Gateway, against the batch mode,
+where the webhook handler queues updates and the batch handler processes them in batches.
+The queue is an in-memory stand-in of an SQS FIFO queue.
+
+The updates are processed offline against the stand-ins from benchmarks/standins.py
+(pip install "moto[dynamodb]"). By default every chat sends /cancel,
+other updates can be replayed from a file with a Telegram update JSON per line.
+
+Usage:
+    python benchmarks/batch_updates.py [--updates 200] [--chats 20] [--batch-size 10]
+        [--updates-file updates.jsonl] [--output results.json]
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+import standins
+
+
+class InMemoryFifoQueue:
+    # Messages are received in the order they were sent, so the order within a group is kept,
+    # and messages with a deduplication id, which was seen already, are dropped like SQS does
+    def __init__(self):
+        self.messages = deque()
+        self.deduplication_ids = set()
+
+    def send_message(self, QueueUrl, MessageBody, MessageGroupId, MessageDeduplicationId):
+        if MessageDeduplicationId not in self.deduplication_ids:
+            self.deduplication_ids.add(MessageDeduplicationId)
+            self.messages.append({"body": MessageBody, "attributes": {"MessageGroupId": MessageGroupId}})
+        return {}
+
+    def receive_batch(self, batch_size):
+        return {"Records": [self.messages.popleft() for _ in range(min(batch_size, len(self.messages)))]}
+
+
+def generate_updates(updates_count, chats_count):
+    chat_ids = itertools.cycle(range(100_000_001, 100_000_001 + chats_count))
+    return [
+        {
+            "update_id": 200_000_000 + index,
+            "message": {
+                "message_id": index,
+                "date": 1760000000,
+                "chat": {"id": chat_id, "type": "private", "username": f"learner{chat_id}"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Learner"},
+                "text": "/cancel",
+                "entities": [{"offset": 0, "length": 7, "type": "bot_command"}],
+            },
+        }
+        for index, chat_id in zip(range(updates_count), chat_ids)
+    ]
+
+
+def run_direct(messages_module, bodies):
+    for body in bodies:
+        messages_module.handler({"body": body}, standins.LambdaContext())
+
+
+def run_batched(messages_module, webhook_module, bodies, batch_size):
+    queue = InMemoryFifoQueue()
+    webhook_module.get_client = lambda service_name: queue
+    for body in bodies:
+        webhook_module.handler({"body": body}, standins.LambdaContext())
+    while queue.messages:
+        messages_module.batch_handler(queue.receive_batch(batch_size), standins.LambdaContext())
+
+
+def measure(function, updates_count):
+    # Unexpected errors are reported to the admins by handle_errors, and the invocation returns as usual
+    errors_before = standins.FakeTelegramHandler.errors_count
+    started_at = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - started_at
+    return {
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(updates_count / elapsed, 1),
+        "errors": standins.FakeTelegramHandler.errors_count - errors_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--updates-file", type=Path)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    if args.updates_file:
+        bodies = [line for line in args.updates_file.read_text().splitlines() if line.strip()]
+    else:
+        bodies = [json.dumps(update) for update in generate_updates(args.updates, args.chats)]
+
+    standins.start()
+    messages_module = standins.load_handler_module("messages")
+    webhook_module = standins.load_handler_module("webhook")
+    results = {
+        "updates": len(bodies),
+        "direct": measure(lambda: run_direct(messages_module, bodies), len(bodies)),
+        "batched": measure(lambda: run_batched(messages_module, webhook_module, bodies, args.batch_size), len(bodies)),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if results["direct"]["errors"] or results["batched"]["errors"]:
+        print("Some updates failed, see the errors sent to the admins in the log", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Cold start benchmark: import time and first invocation latency of every handler,
+each measured in a fresh interpreter like in a new Lambda container.
+
+First invocations talk to the services configured in the environment (TABLE_NAME, AWS credentials,
+TELEGRAM_TOKEN), so they are only measured with --invoke.
+
+Usage:
+    python benchmarks/cold_start.py [--handlers messages polling] [--runs 5] [--invoke] [--output results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+LAYER_DIR = ROOT / "src" / "layers" / "main_layer"
+HANDLERS_DIR = ROOT / "src" / "handlers"
+EVENTS_DIR = ROOT / "events"
+
+HANDLER_EVENTS = {
+    "messages": EVENTS_DIR / "messages_cancel.json",
+    "polling": EVENTS_DIR / "polling.json",
+    "scheduler": EVENTS_DIR / "scheduled.json",
+    "suggestions": EVENTS_DIR / "scheduled.json",
+}
+DEFAULT_ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "TABLE_NAME": "english-pairs-learning-bot",
+    "TELEGRAM_TOKEN": "123456:benchmark",
+    "POWERTOOLS_SERVICE_NAME": "cold-start-benchmark",
+}
+
+# Runs in a fresh interpreter for every measurement
+CHILD_SCRIPT = """
+import json
+import sys
+import time
+
+
+class LambdaContext:
+    function_name = "cold-start-benchmark"
+    invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:cold-start-benchmark"
+
+    @staticmethod
+    def get_remaining_time_in_millis():
+        return 60_000
+
+
+started_at = time.perf_counter()
+import main
+
+result = {"import_ms": (time.perf_counter() - started_at) * 1000, "modules": len(sys.modules)}
+if len(sys.argv) > 1:
+    with open(sys.argv[1]) as event_file:
+        event = json.load(event_file)
+    started_at = time.perf_counter()
+    main.handler(event, LambdaContext())
+    result["first_invocation_ms"] = (time.perf_counter() - started_at) * 1000
+print(json.dumps(result))
+"""
+
+
+def measure_once(handler_name, invoke):
+    environment = {**DEFAULT_ENVIRONMENT, **os.environ}
+    environment["PYTHONPATH"] = os.pathsep.join([str(HANDLERS_DIR / handler_name), str(LAYER_DIR)])
+    command = [sys.executable, "-c", CHILD_SCRIPT]
+    if invoke:
+        command.append(str(HANDLER_EVENTS[handler_name]))
+    completed = subprocess.run(command, env=environment, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(values):
+    return {"median": round(statistics.median(values), 2), "min": round(min(values), 2), "max": round(max(values), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", nargs="+", choices=sorted(HANDLER_EVENTS), default=sorted(HANDLER_EVENTS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--invoke", action="store_true", help="measure first invocation as well")
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    results = {}
+    for handler_name in args.handlers:
+        runs = [measure_once(handler_name, args.invoke) for _ in range(args.runs)]
+        results[handler_name] = {
+            "import_ms": summarize([run["import_ms"] for run in runs]),
+            "modules": runs[-1]["modules"],
+        }
+        if args.invoke:
+            results[handler_name]["first_invocation_ms"] = summarize([run["first_invocation_ms"] for run in runs])
+        print(handler_name, json.dumps(results[handler_name]))
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
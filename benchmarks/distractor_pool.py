@@ -0,0 +1,111 @@
+"""
+Micro-benchmark of quiz options gathering: the legacy random loop over the whole vocabulary
+against the bounded distractors pool. Reading the vocabulary from DynamoDB, which the legacy loop
+needs on every poll, is not included in its timings.
+
+Usage:
+    python benchmarks/distractor_pool.py [--sizes 10 100 1000 10000 50000] [--calls 1000] [--output results.json]
+"""
+import argparse
+import json
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "layers" / "main_layer"))
+
+from distractors import get_pool_slots, pick_options  # noqa: E402
+
+# The legacy loop never finishes when there are not enough unique answers, so it is cut off
+LEGACY_MAX_ATTEMPTS = 100_000
+
+
+def legacy_gather_options(translation_pairs, correct_option, answers_key):
+    options = {correct_option}
+    pairs_count = len(translation_pairs)
+    options_limit = pairs_count if pairs_count < 4 else 4
+    attempts = 0
+    while len(options) < options_limit:
+        attempts += 1
+        if attempts > LEGACY_MAX_ATTEMPTS:
+            return None
+        options.add(random.choice(translation_pairs)[answers_key])
+
+    return list(options)
+
+
+def random_text(min_length=3, max_length=20):
+    text = "".join(random.choices(string.ascii_lowercase + " ", k=random.randint(min_length, max_length)))
+    return text.strip() or "a"
+
+
+def generate_vocabulary(size, duplicates_share):
+    # duplicates_share of pairs get the same native text, like synonyms translated to one word
+    return [
+        {
+            "english_text": f"{random_text()} {index}",
+            "native_text": "спільний переклад" if random.random() < duplicates_share else random_text(),
+        }
+        for index in range(size)
+    ]
+
+
+def measure(function, calls):
+    results = []
+    started_at = time.perf_counter()
+    for _ in range(calls):
+        results.append(function())
+    elapsed = time.perf_counter() - started_at
+    return {
+        "mean_us": round(elapsed / calls * 1_000_000, 2),
+        "unfinished_calls": sum(result is None for result in results),
+    }
+
+
+def run_case(size, duplicates_share, calls):
+    vocabulary = generate_vocabulary(size, duplicates_share)
+    pool = {}
+    for pair in vocabulary:
+        pool.update(get_pool_slots(pair))
+
+    def correct_option():
+        return random.choice(vocabulary)["native_text"]
+
+    return {
+        "size": size,
+        "duplicates_share": duplicates_share,
+        "pool_size": len(pool),
+        "legacy": measure(lambda: legacy_gather_options(vocabulary, correct_option(), "native_text"), calls),
+        "pool": measure(lambda: pick_options(pool, correct_option(), "native_text"), calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1_000, 10_000, 50_000])
+    parser.add_argument("--duplicates-shares", type=float, nargs="+", default=[0.0, 0.99, 1.0])
+    parser.add_argument("--calls", type=int, default=1_000)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'pairs':>7} {'dups':>5} {'pool':>5} {'legacy, us':>11} {'unfinished':>10} {'pool, us':>9}")
+    for size in args.sizes:
+        for duplicates_share in args.duplicates_shares:
+            # The legacy loop burns the whole attempts limit on every unfinished call
+            calls = args.calls if duplicates_share < 1 else max(1, args.calls // 100)
+            result = run_case(size, duplicates_share, calls)
+            results.append(result)
+            print(
+                f"{size:>7} {duplicates_share:>5} {result['pool_size']:>5} {result['legacy']['mean_us']:>11} "
+                f"{result['legacy']['unfinished_calls']:>10} {result['pool']['mean_us']:>9}"
+            )
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
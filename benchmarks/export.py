@@ -0,0 +1,96 @@
+"""
+Time and peak memory of /export at a large vocabulary, for every export format:
+the serialization alone over generated items, and the whole export handler against the offline stand-ins
+from benchmarks/standins.py (pip install "moto[dynamodb]"), where pairs are paged from DynamoDB
+and the file is uploaded to the fake Bot API.
+
+Usage:
+    python benchmarks/export.py [--pairs 50000] [--serialize-only] [--output results.json]
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+from pathlib import Path
+from tempfile import SpooledTemporaryFile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import standins  # noqa: E402
+
+
+def iter_items(pairs_count):
+    # The way boto3 returns the items projected to EXPORT_FIELDS
+    return (
+        {
+            "english_text": f"word {index}",
+            "native_text": f"слово {index}",
+            "polls_count": Decimal(index % 11),
+            "correct_answers": Decimal(index % 7),
+            "wrong_answers": Decimal(index % 3),
+            "created_at": f"2024-01-01T00:00:00.{index:06d}",
+        }
+        for index in range(pairs_count)
+    )
+
+
+def measure(function) -> dict:
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - started_at
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": round(elapsed, 3), "peak_memory_mb": round(peak_memory / 1024 / 1024, 2), **(result or {})}
+
+
+def serialize(export_module, pairs_count, export_format) -> dict:
+    with SpooledTemporaryFile(max_size=export_module.SPOOL_MAX_SIZE) as export_file:
+        export_module.write_export(iter_items(pairs_count), export_file, export_format)
+        return {"compressed_kb": round(export_file.tell() / 1024, 1)}
+
+
+def export(export_module, user_chat_id, export_format):
+    export_module.handler({"user_chat_id": user_chat_id, "format": export_format}, standins.LambdaContext())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=50000)
+    parser.add_argument("--serialize-only", action="store_true", help="without the stand-ins")
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    results = {}
+    if args.serialize_only:
+        export_module = standins.load_handler_module("vocabulary_export")
+        for export_format in export_module.EXPORT_FORMATS:
+            results[f"serialize_{export_format}"] = measure(lambda: serialize(export_module, args.pairs, export_format))
+            print(export_format, json.dumps(results[f"serialize_{export_format}"]))
+    else:
+        mock, server = standins.start()
+        try:
+            from handlers import seed_user
+
+            export_module = standins.load_handler_module("vocabulary_export")
+            user_chat_id = seed_user(args.pairs)
+            for export_format in export_module.EXPORT_FORMATS:
+                results[f"serialize_{export_format}"] = measure(
+                    lambda: serialize(export_module, args.pairs, export_format)
+                )
+                results[f"handler_{export_format}"] = measure(
+                    lambda: export(export_module, user_chat_id, export_format)
+                )
+                print(export_format, json.dumps(results[f"handler_{export_format}"]))
+        finally:
+            server.shutdown()
+            mock.stop()
+
+    if args.output:
+        args.output.write_text(json.dumps({"pairs": args.pairs, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
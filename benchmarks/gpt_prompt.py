@@ -0,0 +1,102 @@
+"""
+Prompt size and latency of GPT suggestions at several vocabulary sizes: the legacy prompt with every learnt pair
+against the token-budgeted context. Tokens are estimated the same way as in the layer.
+
+Without --live only the prompt building is timed. With --live the prompts are sent to OpenAI (OPENAI_API_KEY
+has to be set), so end-to-end latency is measured as well. Legacy prompts above --max-live-tokens are not sent.
+
+Usage:
+    python benchmarks/gpt_prompt.py [--sizes 10 100 1000 10000 50000] [--budget 300] [--live] [--output results.json]
+"""
+import argparse
+import json
+import random
+import statistics
+import string
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "layers" / "main_layer"))
+
+import gpt  # noqa: E402
+from pairset import PairSet  # noqa: E402
+
+
+def random_text(min_length=3, max_length=16):
+    text = "".join(random.choices(string.ascii_lowercase + " ", k=random.randint(min_length, max_length)))
+    return text.strip() or "a"
+
+
+def generate_vocabulary(size):
+    return [
+        {
+            "english_text": f"{random_text()} {index}",
+            "native_text": random_text(),
+            "ease": str(round(random.uniform(1.3, 3.0), 2)),
+            "correct_answers": random.randint(0, 10),
+            "wrong_answers": random.randint(0, 5),
+        }
+        for index in range(size)
+    ]
+
+
+def build_legacy_prompt(learnt_pairs):
+    return (
+        "Generate 5 words/phrases in English with translation to Ukrainian "
+        "in json format with array of 2 strings to learn for a person "
+        f"who last learned words/phrases: {gpt.format_pairs_for_prompt(learnt_pairs)}."
+    )
+
+
+def measure(build_prompt, learnt_pairs, runs, live, max_live_tokens):
+    build_times = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        prompt = build_prompt(learnt_pairs)
+        build_times.append((time.perf_counter() - started_at) * 1000)
+    result = {"prompt_tokens": gpt.estimate_tokens(prompt), "build_ms": round(statistics.median(build_times), 3)}
+    if live and result["prompt_tokens"] <= max_live_tokens:
+        started_at = time.perf_counter()
+        try:
+            gpt.complete(prompt)
+        except Exception as e:
+            result["error"] = repr(e)
+        result["end_to_end_ms"] = round((time.perf_counter() - started_at) * 1000 + result["build_ms"], 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 50000])
+    parser.add_argument("--budget", type=int, default=gpt.PROMPT_CONTEXT_TOKENS)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--live", action="store_true", help="send the prompts to OpenAI")
+    parser.add_argument("--max-live-tokens", type=int, default=6000)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    if args.live and not gpt.OPENAI_API_KEY:
+        parser.error("OPENAI_API_KEY is not set")
+
+    results = {}
+    for size in args.sizes:
+        vocabulary = generate_vocabulary(size)
+        results[size] = {
+            "legacy": measure(build_legacy_prompt, vocabulary, args.runs, args.live, args.max_live_tokens),
+            "budgeted": measure(
+                lambda learnt_pairs: gpt.build_suggestion_prompt(PairSet.from_items(learnt_pairs), args.budget),
+                vocabulary,
+                args.runs,
+                args.live,
+                args.max_live_tokens,
+            ),
+        }
+        print(size, json.dumps(results[size]))
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
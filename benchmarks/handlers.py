@@ -0,0 +1,448 @@
+"""
+Latency, DynamoDB requests, peak memory and Telegram requests per invocation of the handlers,
+measured offline against the stand-ins from benchmarks/standins.py (pip install "moto[dynamodb]").
+
+Every scenario is an invocation of a handler with a prepared state: the polling handler for a user,
+the messages handler for every command and every answer to a current action, poll and callback query,
+and the suggestions handler for all users. Scenarios are repeated for every vocabulary size,
+the suggestions handler for every number of users.
+
+Usage:
+    python benchmarks/handlers.py [--vocabulary-sizes 10 1000 10000] [--users-counts 1 100 1000]
+        [--iterations 20] [--scenarios polling list_pairs ...] [--translate-delay 0.05]
+        [--openai-delay 0.5] [--output results.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# The directory of the script is on sys.path already, it isn't put in front of the layer again,
+# when the module is imported by the other benchmarks
+import standins
+
+MAX_VOCABULARY_SIZE = 50_000
+MAX_USERS_COUNT = 100_000
+# Vocabularies of the users, who get suggestions, are read whole, so they are kept small
+SUGGESTIONS_VOCABULARY_SIZE = 20
+FIRST_CREATED_AT = datetime(2024, 1, 1)
+
+# The polling handler asks an open question instead of every fifth quiz on average
+QUIZ_POLL_ATTEMPTS = 50
+
+update_ids = itertools.count(300_000_000)
+user_chat_ids = itertools.count(100_000_001)
+polling_module = None
+# (user_chat_id, iteration) -> id of the quiz poll sent to the user for the iteration
+quiz_poll_ids = {}
+
+
+def get_created_at(index):
+    return (FIRST_CREATED_AT + timedelta(seconds=index)).isoformat()
+
+
+def get_pair_item(user_chat_id, index, now):
+    from helpers import format_timestamp
+
+    english_text, native_text = f"word {index}", f"слово {index}"
+    created_at = get_created_at(index)
+    # Some pairs are overdue, the rest are due later, like in a vocabulary in use
+    due_at = format_timestamp(now + timedelta(hours=index % 48 - 24))
+    return {
+        "pk": f"USER#{user_chat_id}",
+        "sk": f"TRANSLATION_PAIR#{english_text}",
+        "user_chat_id": user_chat_id,
+        "english_text": english_text,
+        "native_text": native_text,
+        "polls_count": index % 7,
+        "gsi1pk": f"USER#{user_chat_id}",
+        "gsi1sk": f"TRANSLATION_PAIR#{created_at}",
+        "gsi2pk": f"USER#{user_chat_id}",
+        "gsi2sk": f"TRANSLATION_PAIR#{due_at}",
+        "created_at": created_at,
+        "due_at": due_at,
+        "active": True,
+    }
+
+
+def seed_user(vocabulary_size, user_chat_id=None) -> int:
+    from aws import dynamodb as dynamodb_operations
+    from clients import get_table
+    from distractors import get_pool_slots
+    from helpers import format_timestamp
+
+    user_chat_id = user_chat_id or next(user_chat_ids)
+    now = datetime.now(timezone.utc)
+    dynamodb_operations.create_user(user_chat_id, f"learner{user_chat_id}", format_timestamp(now))
+    pool_slots = {}
+    with get_table().batch_writer() as batch:
+        for index in range(vocabulary_size):
+            pair = get_pair_item(user_chat_id, index, now)
+            batch.put_item(Item=pair)
+            pool_slots.update(get_pool_slots(pair))
+    if pool_slots:
+        dynamodb_operations.add_distractors(user_chat_id, pool_slots)
+    get_table().put_item(
+        Item={
+            "pk": f"USER#{user_chat_id}",
+            "sk": "STATS",
+            "pairs_count": vocabulary_size,
+            "polls_count": 0,
+            "correct_answers": 0,
+            "wrong_answers": 0,
+        }
+    )
+    return user_chat_id
+
+
+def message_body(user_chat_id, text):
+    message = {
+        "message_id": next(update_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_chat_id, "type": "private", "username": f"learner{user_chat_id}"},
+        "from": {"id": user_chat_id, "is_bot": False, "first_name": "Learner"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"offset": 0, "length": len(text.split(" ")[0]), "type": "bot_command"}]
+    return json.dumps({"update_id": next(update_ids), "message": message})
+
+
+def poll_body(poll_id, poll_type, voted_option_ids, options_count=4, correct_option_id=None):
+    poll = {
+        "id": poll_id,
+        "question": "?",
+        "options": [
+            {"text": f"option {index}", "voter_count": int(index in voted_option_ids)} for index in range(options_count)
+        ],
+        "total_voter_count": 1,
+        "is_closed": False,
+        "is_anonymous": True,
+        "type": poll_type,
+        "allows_multiple_answers": poll_type == "regular",
+        "correct_option_id": correct_option_id,
+    }
+    return json.dumps({"update_id": next(update_ids), "poll": poll})
+
+
+def callback_query_body(user_chat_id, data):
+    callback_query = {
+        "id": str(next(update_ids)),
+        "from": {"id": user_chat_id, "is_bot": False, "first_name": "Learner"},
+        "chat_instance": str(user_chat_id),
+        "data": data,
+        "message": {
+            "message_id": next(update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_chat_id, "type": "private"},
+            "text": "pairs",
+        },
+    }
+    return json.dumps({"update_id": next(update_ids), "callback_query": callback_query})
+
+
+def with_action(action_type, **action):
+    # Sets the current action of the user, the one left by the previous iteration is dropped
+    def setup(user_chat_id, iteration, vocabulary_size):
+        from aws import dynamodb as dynamodb_operations
+
+        dynamodb_operations.delete_current_action(user_chat_id)
+        if action_type:
+            dynamodb_operations.create_current_action(user_chat_id, action_type, **action)
+
+    return setup
+
+
+def without_action(user_chat_id, iteration, vocabulary_size):
+    with_action(None)(user_chat_id, iteration, vocabulary_size)
+
+
+def restore_pair_to_delete(user_chat_id, iteration, vocabulary_size):
+    from clients import get_table
+
+    with_action("TRANSLATION_PAIR_DELETING")(user_chat_id, iteration, vocabulary_size)
+    get_table().put_item(Item=get_pair_item(user_chat_id, iteration % vocabulary_size, datetime.now(timezone.utc)))
+
+
+def list_poll_ids(user_chat_id) -> set:
+    from boto3.dynamodb.conditions import Key
+
+    from aws import dynamodb as dynamodb_operations
+    from clients import get_table
+
+    return {
+        item["gsi1sk"].split("#", 1)[1]
+        for item in dynamodb_operations.iter_items(
+            get_table().query,
+            IndexName="gsi1",
+            KeyConditionExpression=Key("gsi1pk").eq(f"USER#{user_chat_id}") & Key("gsi1sk").begins_with("POLL#"),
+        )
+    }
+
+
+def create_quiz_poll(user_chat_id, iteration, vocabulary_size) -> str:
+    # Polls are sent by the polling handler, the way the users get them. It asks an open question
+    # instead of a part of the quizzes, so it is invoked till a new poll is stored.
+    global polling_module
+    polling_module = polling_module or standins.load_handler_module("polling")
+    poll_ids = list_poll_ids(user_chat_id)
+    for _ in range(QUIZ_POLL_ATTEMPTS):
+        without_action(user_chat_id, iteration, vocabulary_size)
+        # The polling scheduler passes chat ids as strings
+        polling_module.handler({"user_chat_id": str(user_chat_id)}, standins.LambdaContext())
+        if new_poll_ids := list_poll_ids(user_chat_id) - poll_ids:
+            quiz_poll_ids[(user_chat_id, iteration)] = new_poll_ids.pop()
+            return quiz_poll_ids[(user_chat_id, iteration)]
+    raise RuntimeError(f"The polling handler didn't store a quiz poll for user {user_chat_id}")
+
+
+def create_suggestion(user_chat_id, iteration, vocabulary_size):
+    from aws import dynamodb as dynamodb_operations
+
+    new_words = [(f"suggested word {iteration} {index}", f"запропоноване слово {index}") for index in range(5)]
+    # The suggestions handler stores chat ids as strings
+    dynamodb_operations.create_suggestion(str(user_chat_id), f"suggestion-{user_chat_id}-{iteration}", new_words)
+
+
+# name -> (setup of the state, body of the update)
+MESSAGES_SCENARIOS = {
+    "start": (without_action, lambda user_chat_id, iteration, size: message_body(user_chat_id, "/start")),
+    "add_pair": (without_action, lambda user_chat_id, iteration, size: message_body(user_chat_id, "/add_pair")),
+    "add_pair_english": (
+        with_action("TRANSLATION_PAIR_CREATING"),
+        lambda user_chat_id, iteration, size: message_body(user_chat_id, f"new word {iteration}"),
+    ),
+    "add_pair_translation": (
+        lambda user_chat_id, iteration, size: with_action(
+            "TRANSLATION_PAIR_CREATING", english_text=f"added word {iteration}", native_text="додане слово"
+        )(user_chat_id, iteration, size),
+        lambda user_chat_id, iteration, size: message_body(user_chat_id, "+"),
+    ),
+    "delete_pair": (without_action, lambda user_chat_id, iteration, size: message_body(user_chat_id, "/delete_pair")),
+    "delete_pair_english": (
+        restore_pair_to_delete,
+        lambda user_chat_id, iteration, size: message_body(user_chat_id, f"word {iteration % size}"),
+    ),
+    "list_pairs": (without_action, lambda user_chat_id, iteration, size: message_body(user_chat_id, "/list_pairs")),
+    "list_pairs_next_page": (
+        without_action,
+        lambda user_chat_id, iteration, size: callback_query_body(
+            user_chat_id, f"pairs:n:{get_created_at(max(size - 15, 0))}"
+        ),
+    ),
+    "cancel": (
+        with_action("TRANSLATION_PAIR_CREATING"),
+        lambda user_chat_id, iteration, size: message_body(user_chat_id, "/cancel"),
+    ),
+    "set_polling_rate": (
+        without_action,
+        lambda user_chat_id, iteration, size: message_body(user_chat_id, "/set_polling_rate_in_minutes"),
+    ),
+    "polling_rate_update": (
+        with_action("POLLING_RATE_UPDATE", time_units="minutes"),
+        lambda user_chat_id, iteration, size: message_body(user_chat_id, "30"),
+    ),
+    "set_timezone": (without_action, lambda user_chat_id, iteration, size: message_body(user_chat_id, "/set_timezone")),
+    "timezone_update": (
+        with_action("TIMEZONE_UPDATE"),
+        lambda user_chat_id, iteration, size: message_body(user_chat_id, "Europe/Kyiv"),
+    ),
+    "notify_users_not_admin": (
+        without_action,
+        lambda user_chat_id, iteration, size: message_body(user_chat_id, "/notify_users Hello"),
+    ),
+    "open_question_answer": (
+        with_action("OPEN_QUESTION", question="word 1", answer="слово 1", english_text="word 1"),
+        lambda user_chat_id, iteration, size: message_body(user_chat_id, "слово 1"),
+    ),
+    "quiz_answer": (
+        create_quiz_poll,
+        lambda user_chat_id, iteration, size: poll_body(
+            quiz_poll_ids[(user_chat_id, iteration)], "quiz", {0}, correct_option_id=0
+        ),
+    ),
+    "suggestion_answer": (
+        create_suggestion,
+        lambda user_chat_id, iteration, size: poll_body(f"suggestion-{user_chat_id}-{iteration}", "regular", {0, 2}, 5),
+    ),
+}
+
+
+class DynamoDBRequestsCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, **_):
+        self.count += 1
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def measure(invoke, setup, iterations, requests_counter) -> dict:
+    latencies = []
+    dynamodb_requests = telegram_requests = 0
+    # Unexpected errors are reported to the admins by handle_errors, and the invocation returns as usual
+    errors_before = standins.FakeTelegramHandler.errors_count
+    for iteration in range(iterations):
+        setup(iteration)
+        requests_before = requests_counter.count, standins.FakeTelegramHandler.requests_count
+        started_at = time.perf_counter()
+        invoke(iteration)
+        latencies.append(time.perf_counter() - started_at)
+        dynamodb_requests += requests_counter.count - requests_before[0]
+        telegram_requests += standins.FakeTelegramHandler.requests_count - requests_before[1]
+
+    # Memory is traced in a separate invocation, as tracing slows the code down
+    setup(iterations)
+    tracemalloc.start()
+    invoke(iterations)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "iterations": iterations,
+        "errors": standins.FakeTelegramHandler.errors_count - errors_before,
+        **{
+            f"{name}_ms": round(value * 1000, 2)
+            for name, value in (
+                ("p50", percentile(latencies, 0.5)),
+                ("p90", percentile(latencies, 0.9)),
+                ("p99", percentile(latencies, 0.99)),
+                ("max", max(latencies)),
+            )
+        },
+        "dynamodb_requests": round(dynamodb_requests / iterations, 2),
+        "telegram_requests": round(telegram_requests / iterations, 2),
+        "peak_memory_kb": round(peak_memory / 1024, 1),
+    }
+
+
+def run_messages_scenarios(scenarios, vocabulary_size, iterations, requests_counter):
+    messages_module = standins.load_handler_module("messages")
+    user_chat_id = seed_user(vocabulary_size)
+    results = []
+    for name in scenarios:
+        setup, get_body = MESSAGES_SCENARIOS[name]
+        result = measure(
+            lambda iteration: messages_module.handler(
+                {"body": get_body(user_chat_id, iteration, vocabulary_size)}, standins.LambdaContext()
+            ),
+            lambda iteration: setup(user_chat_id, iteration, vocabulary_size),
+            iterations,
+            requests_counter,
+        )
+        results.append({"scenario": name, "vocabulary_size": vocabulary_size, **result})
+        print(json.dumps(results[-1]))
+    return results
+
+
+def run_polling_scenario(vocabulary_size, iterations, requests_counter):
+    polling_module = standins.load_handler_module("polling")
+    user_chat_id = seed_user(vocabulary_size)
+    result = measure(
+        lambda iteration: polling_module.handler({"user_chat_id": user_chat_id}, standins.LambdaContext()),
+        lambda iteration: without_action(user_chat_id, iteration, vocabulary_size),
+        iterations,
+        requests_counter,
+    )
+    result = {"scenario": "polling", "vocabulary_size": vocabulary_size, **result}
+    print(json.dumps(result))
+    return result
+
+
+def run_suggestions_scenario(users_counts, iterations, requests_counter):
+    # The rate limit of GPT requests would make the stand-in the bottleneck
+    os.environ.setdefault("GPT_REQUESTS_PER_MINUTE", "1000000")
+    suggestions_module = standins.load_handler_module("suggestions")
+    results = []
+    seeded_users_count = 0
+    for users_count in sorted(users_counts):
+        # Users are added up to the next count, the table keeps the ones seeded for the previous counts
+        for _ in range(users_count - seeded_users_count):
+            seed_user(SUGGESTIONS_VOCABULARY_SIZE)
+        seeded_users_count = users_count
+        result = measure(
+            lambda iteration: suggestions_module.handler({}, standins.LambdaContext()),
+            lambda iteration: None,
+            iterations,
+            requests_counter,
+        )
+        results.append({"scenario": "suggestions", "users_count": users_count, **result})
+        print(json.dumps(results[-1]))
+    return results
+
+
+def get_environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=standins.ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": sys.version.split()[0], "platform": platform.platform()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vocabulary-sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--users-counts", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=["polling", *MESSAGES_SCENARIOS, "suggestions"], help="all by default"
+    )
+    parser.add_argument("--suggestions-iterations", type=int, default=3)
+    parser.add_argument("--translate-delay", type=float, default=0.0, help="seconds")
+    parser.add_argument("--openai-delay", type=float, default=0.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+    if max(args.vocabulary_sizes) > MAX_VOCABULARY_SIZE or max(args.users_counts) > MAX_USERS_COUNT:
+        parser.error(f"vocabulary sizes are limited by {MAX_VOCABULARY_SIZE}, users counts by {MAX_USERS_COUNT}")
+
+    random.seed(args.seed)
+    mock, server = standins.start(args.translate_delay, args.openai_delay)
+    from clients import get_table
+
+    requests_counter = DynamoDBRequestsCounter()
+    get_table().meta.client.meta.events.register("before-call.dynamodb", requests_counter)
+
+    scenarios = args.scenarios or ["polling", *MESSAGES_SCENARIOS, "suggestions"]
+    messages_scenarios = [name for name in scenarios if name in MESSAGES_SCENARIOS]
+    results = []
+    try:
+        for vocabulary_size in args.vocabulary_sizes:
+            if "polling" in scenarios:
+                results.append(run_polling_scenario(vocabulary_size, args.iterations, requests_counter))
+            if messages_scenarios:
+                results += run_messages_scenarios(
+                    messages_scenarios, vocabulary_size, args.iterations, requests_counter
+                )
+        if "suggestions" in scenarios:
+            results += run_suggestions_scenario(args.users_counts, args.suggestions_iterations, requests_counter)
+    finally:
+        server.shutdown()
+        mock.stop()
+
+    if args.output:
+        args.output.write_text(
+            json.dumps({"environment": get_environment(), "arguments": vars(args), "results": results}, default=str)
+        )
+    if failed_results := [result for result in results if result["errors"]]:
+        # Timings of invocations, which crashed, don't tell anything
+        for result in failed_results:
+            print(f"{result['scenario']} failed {result['errors']} times: {json.dumps(result)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Load generator for the messages handler: synthesized or replayed Telegram updates are sent to it
+at a fixed rate by a pool of workers, like concurrent invocations of the webhook Lambda,
+against the offline stand-ins from benchmarks/standins.py (pip install "moto[dynamodb]").
+
+A synthesized workload is a mix of commands, answers to current actions, quiz answers,
+suggestion poll answers and /start of new users, with a share of redelivered duplicates.
+Replayed updates are read from a file with a Telegram update JSON per line, their chats get a seeded
+vocabulary, but polls and suggestions they answer have to be created by the replayed updates themselves.
+
+Throughput, latency from the scheduled send (so queueing is included) and errors are reported in total
+and per kind of update. Errors are unexpected exceptions, which handle_errors reports to the admins.
+
+Usage:
+    python benchmarks/load.py [--updates 2000] [--rate 100] [--concurrency 16] [--users 50]
+        [--vocabulary-size 200] [--mix command=4,answer=2,quiz=3,suggestion=1,start=1]
+        [--duplicates 0.05] [--updates-file updates.jsonl] [--output results.json]
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import standins  # noqa: E402
+from handlers import (  # noqa: E402
+    callback_query_body,
+    create_quiz_poll,
+    create_suggestion,
+    get_created_at,
+    message_body,
+    poll_body,
+    seed_user,
+    user_chat_ids,
+)
+
+COMMANDS = ("/list_pairs", "/add_pair", "/cancel", "/set_timezone", "/delete_pair", "/set_polling_rate_in_hours")
+# Answers to whatever current action the user has at the moment, most of them end up as validation errors
+ANSWERS = ("+", "5", "Europe/Kyiv", "word 1", "слово 1", "some new word")
+DEFAULT_MIX = "command=4,answer=2,quiz=3,suggestion=1,start=1,page=1"
+
+
+def parse_mix(value) -> dict:
+    mix = {}
+    for part in value.split(","):
+        kind, weight = part.split("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def synthesize_updates(updates_count, users, vocabulary_size, mix, duplicates, rng) -> list:
+    # (kind, body) pairs, polls and suggestions, which are answered, are created beforehand
+    kinds, weights = zip(*mix.items())
+    updates = []
+    for index in range(updates_count):
+        if updates and rng.random() < duplicates:
+            kind, body = rng.choice(updates)
+            updates.append((f"{kind}_duplicate", body))
+            continue
+        kind = rng.choices(kinds, weights)[0]
+        user_chat_id = rng.choice(users)
+        if kind == "command":
+            body = message_body(user_chat_id, rng.choice(COMMANDS))
+        elif kind == "answer":
+            body = message_body(user_chat_id, rng.choice(ANSWERS))
+        elif kind == "quiz":
+            poll_id = create_quiz_poll(user_chat_id, index, vocabulary_size)
+            body = poll_body(poll_id, "quiz", {rng.randrange(4)}, correct_option_id=0)
+        elif kind == "suggestion":
+            create_suggestion(user_chat_id, index, vocabulary_size)
+            body = poll_body(f"suggestion-{user_chat_id}-{index}", "regular", {0, 3}, 5)
+        elif kind == "start":
+            body = message_body(next(user_chat_ids), "/start")
+        elif kind == "page":
+            older_than = get_created_at(rng.randrange(max(vocabulary_size, 1)))
+            body = callback_query_body(user_chat_id, f"pairs:n:{older_than}")
+        else:
+            raise ValueError(f"Unknown kind of update: {kind}")
+        updates.append((kind, body))
+    return updates
+
+
+def read_updates(updates_file, vocabulary_size) -> list:
+    updates = []
+    seeded_chat_ids = set()
+    for line in updates_file.read_text().splitlines():
+        if not line.strip():
+            continue
+        update = json.loads(line)
+        kind = next(key for key in update if key != "update_id")
+        chat = (update.get(kind) or {}).get("chat") or (update.get(kind) or {}).get("message", {}).get("chat")
+        if chat and chat["id"] not in seeded_chat_ids:
+            seeded_chat_ids.add(chat["id"])
+            seed_user(vocabulary_size, chat["id"])
+        updates.append((kind, line))
+    return updates
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summarize(latencies, elapsed=None) -> dict:
+    summary = {"updates": len(latencies)}
+    if elapsed:
+        summary["updates_per_second"] = round(len(latencies) / elapsed, 1)
+    if latencies:
+        summary.update(
+            {
+                f"{name}_ms": round(percentile(latencies, fraction) * 1000, 2)
+                for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1))
+            }
+        )
+    return summary
+
+
+def run_load(messages_module, updates, rate, concurrency) -> dict:
+    latencies_by_kind = defaultdict(list)
+    raised_by_kind = defaultdict(int)
+    lock = threading.Lock()
+
+    def send(kind, body, scheduled_at):
+        try:
+            messages_module.handler({"body": body}, standins.LambdaContext())
+        except Exception:
+            # The handler reports its own errors, so these come from the error handling itself
+            with lock:
+                raised_by_kind[kind] += 1
+        latency = time.perf_counter() - scheduled_at
+        with lock:
+            latencies_by_kind[kind].append(latency)
+
+    errors_before = standins.FakeTelegramHandler.errors_count
+    started_at = time.perf_counter()
+    # Open loop: updates are sent on schedule, whether the previous ones are processed or not
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, (kind, body) in enumerate(updates):
+            scheduled_at = started_at + index / rate if rate else time.perf_counter()
+            if (delay := scheduled_at - time.perf_counter()) > 0:
+                time.sleep(delay)
+            executor.submit(send, kind, body, scheduled_at)
+    elapsed = time.perf_counter() - started_at
+
+    errors_count = standins.FakeTelegramHandler.errors_count - errors_before + sum(raised_by_kind.values())
+    return {
+        "seconds": round(elapsed, 3),
+        **summarize([latency for latencies in latencies_by_kind.values() for latency in latencies], elapsed),
+        "errors": errors_count,
+        "error_rate": round(errors_count / max(len(updates), 1), 4),
+        "by_kind": {
+            kind: {**summarize(latencies), "raised": raised_by_kind[kind]}
+            for kind, latencies in sorted(latencies_by_kind.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=100, help="updates per second, 0 to send as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--vocabulary-size", type=int, default=200)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="weights of the kinds of updates")
+    parser.add_argument("--duplicates", type=float, default=0.05, help="share of redelivered updates")
+    parser.add_argument("--updates-file", type=Path)
+    parser.add_argument("--translate-delay", type=float, default=0.05, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    mock, server = standins.start(args.translate_delay)
+    try:
+        messages_module = standins.load_handler_module("messages")
+        if args.updates_file:
+            updates = read_updates(args.updates_file, args.vocabulary_size)
+        else:
+            users = [seed_user(args.vocabulary_size) for _ in range(args.users)]
+            updates = synthesize_updates(args.updates, users, args.vocabulary_size, args.mix, args.duplicates, rng)
+        results = run_load(messages_module, updates, args.rate, args.concurrency)
+    finally:
+        server.shutdown()
+        mock.stop()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps({"arguments": vars(args), "results": results}, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Memory and prompt context sampling time of a vocabulary: the legacy list of boto3 items (dicts with Decimal values)
+against PairSet columns, sampled in pure Python and, when numpy is installed, with numpy.
+
+Usage:
+    python benchmarks/pairset_sampling.py [--sizes 1000 10000 50000 100000] [--budget 300] [--runs 20] [--output results.json]
+"""
+import argparse
+import json
+import random
+import statistics
+import string
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "layers" / "main_layer"))
+
+import gpt  # noqa: E402
+import pairset  # noqa: E402
+
+
+def random_text(min_length=3, max_length=16):
+    text = "".join(random.choices(string.ascii_lowercase + " ", k=random.randint(min_length, max_length)))
+    return text.strip() or "a"
+
+
+def iter_items(size):
+    # The way boto3 returns the items projected to CONTEXT_FIELDS
+    return (
+        {
+            "english_text": f"{random_text()} {index}",
+            "native_text": random_text(),
+            "ease": Decimal(str(round(random.uniform(1.3, 3.0), 2))),
+            "correct_answers": Decimal(random.randint(0, 10)),
+            "wrong_answers": Decimal(random.randint(0, 5)),
+        }
+        for index in range(size)
+    )
+
+
+def legacy_get_context_weight(pair, recency_rank):
+    recency = 1 / (1 + recency_rank / 20)
+    correct_answers = int(pair.get("correct_answers", 0))
+    wrong_answers = int(pair.get("wrong_answers", 0))
+    weakness = (wrong_answers + 1) / (correct_answers + wrong_answers + 2)
+    if "ease" in pair:
+        weakness += max(0.0, 2.5 - float(pair["ease"]))
+    return recency + weakness
+
+
+def legacy_select_prompt_context(learnt_pairs, token_budget):
+    sampling_keys = [
+        random.random() ** (1 / legacy_get_context_weight(pair, recency_rank))
+        for recency_rank, pair in enumerate(learnt_pairs)
+    ]
+    selected_pairs = []
+    tokens_left = token_budget
+    for pair_index in sorted(range(len(learnt_pairs)), key=sampling_keys.__getitem__, reverse=True):
+        pair_tokens = gpt.estimate_tokens(gpt.format_pairs_for_prompt([learnt_pairs[pair_index]]))
+        if pair_tokens <= tokens_left:
+            selected_pairs.append(learnt_pairs[pair_index])
+            tokens_left -= pair_tokens
+        if tokens_left < gpt.CHARS_PER_TOKEN:
+            break
+    return selected_pairs
+
+
+def measure_memory(build) -> float:
+    # Memory held by the vocabulary, the items it is built from are freed by then
+    tracemalloc.start()
+    vocabulary = build()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del vocabulary
+    return round(memory / 1024 / 1024, 2)
+
+
+def measure_time(function, runs) -> float:
+    times = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - started_at) * 1000)
+    return round(statistics.median(times), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000, 100000])
+    parser.add_argument("--budget", type=int, default=gpt.PROMPT_CONTEXT_TOKENS)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    numpy_module = pairset.numpy
+    results = {}
+    for size in args.sizes:
+        random.seed(size)
+        legacy_mb = measure_memory(lambda: list(iter_items(size)))
+        random.seed(size)
+        pairset_mb = measure_memory(lambda: pairset.PairSet.from_items(iter_items(size)))
+        random.seed(size)
+        items = list(iter_items(size))
+        result = {
+            "legacy_mb": legacy_mb,
+            "pairset_mb": pairset_mb,
+            "legacy_sample_ms": measure_time(lambda: legacy_select_prompt_context(items, args.budget), args.runs),
+        }
+        pair_set = pairset.PairSet.from_items(items)
+        pairset.numpy = None
+        result["pairset_sample_ms"] = measure_time(lambda: gpt.select_prompt_context(pair_set, args.budget), args.runs)
+        if numpy_module is not None:
+            pairset.numpy = numpy_module
+            result["pairset_numpy_sample_ms"] = measure_time(
+                lambda: gpt.select_prompt_context(pair_set, args.budget), args.runs
+            )
+        results[size] = result
+        print(size, json.dumps(result))
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Local stand-ins of the services used by the handlers, so they can be benchmarked offline:
+DynamoDB is mocked by moto (pip install "moto[dynamodb]"), Telegram Bot API is a fake HTTP server
+on localhost, Translate and OpenAI are replaced by stubs with a configurable delay.
+
+Only the benchmarks import it, the handlers and the layer know nothing about it.
+"""
+import importlib.util
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src" / "layers" / "main_layer"))
+
+TABLE_NAME = "english-pairs-learning-bot-benchmark"
+TELEGRAM_TOKEN = "123456:benchmark"
+ADMIN_ID = "1"
+
+
+class LambdaContext:
+    function_name = "benchmark"
+    invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:benchmark"
+
+    @staticmethod
+    def get_remaining_time_in_millis():
+        return 15 * 60 * 1000
+
+
+def load_handler_module(handler_name):
+    # Every handler module is called main, so they are loaded under their own names
+    spec = importlib.util.spec_from_file_location(
+        f"{handler_name}_main", ROOT / "src" / "handlers" / handler_name / "main.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    # Answers Bot API methods with the smallest results, which python-telegram-bot can parse
+    message_ids = itertools.count(1)
+    poll_ids = itertools.count(1)
+    requests_count = 0
+    # Unexpected errors of the handlers are reported to the admins by handle_errors
+    errors_count = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        # Files are uploaded as multipart/form-data, their content is not needed
+        data = json.loads(body or b"{}") if "json" in self.headers.get("Content-Type", "json") else {}
+        with self.lock:
+            FakeTelegramHandler.requests_count += 1
+            if method == "sendMessage" and str(data.get("text", "")).startswith("Error happened"):
+                FakeTelegramHandler.errors_count += 1
+        body = json.dumps({"ok": True, "result": self.get_result(method, data)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_result(self, method, data):
+        if method in ("answerCallbackQuery", "setWebhook"):
+            return True
+        message = {
+            "message_id": data.get("message_id") or next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+        }
+        if method == "sendPoll":
+            options = json.loads(data["options"]) if isinstance(data["options"], str) else data["options"]
+            message["poll"] = {
+                "id": str(next(self.poll_ids)),
+                "question": data["question"],
+                "options": [{"text": option, "voter_count": 0} for option in options],
+                "total_voter_count": 0,
+                "is_closed": False,
+                "is_anonymous": True,
+                "type": data.get("type", "regular"),
+                "allows_multiple_answers": bool(data.get("allows_multiple_answers")),
+                "correct_option_id": data.get("correct_option_id"),
+            }
+        else:
+            message["text"] = data.get("text", "")
+        return message
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_telegram():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTelegramHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{server.server_address[1]}/bot"
+    return server
+
+
+def start_dynamodb():
+    try:
+        from moto import mock_aws as mock_dynamodb
+    except ImportError:
+        # moto < 5
+        from moto import mock_dynamodb
+
+    from moto.dynamodb.responses import DynamoHandler
+
+    mock = mock_dynamodb()
+    mock.start()
+    import boto3
+
+    # moto is not thread safe: a transaction copies the tables, while concurrent invocations write to them.
+    # Requests are served one at a time, like by a single threaded local server.
+    lock = threading.Lock()
+    call_action = DynamoHandler.call_action
+
+    def call_action_serialized(self):
+        with lock:
+            return call_action(self)
+
+    DynamoHandler.call_action = call_action_serialized
+
+    boto3.client("dynamodb").create_table(
+        TableName=TABLE_NAME,
+        BillingMode="PAY_PER_REQUEST",
+        AttributeDefinitions=[
+            {"AttributeName": name, "AttributeType": "S"}
+            for name in ("pk", "sk", "gsi1pk", "gsi1sk", "gsi2pk", "gsi2sk")
+        ],
+        KeySchema=[{"AttributeName": "pk", "KeyType": "HASH"}, {"AttributeName": "sk", "KeyType": "RANGE"}],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": index_name,
+                "KeySchema": [
+                    {"AttributeName": f"{index_name}pk", "KeyType": "HASH"},
+                    {"AttributeName": f"{index_name}sk", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+            for index_name in ("gsi1", "gsi2")
+        ],
+    )
+    return mock
+
+
+def stub_translate(delay=0.0):
+    from aws import translate
+
+    def request_translation(text, from_lang, to_lang):
+        time.sleep(delay)
+        return f"переклад {text}".capitalize()
+
+    translate.request_translation = request_translation
+
+
+def stub_openai(delay=0.0):
+    import gpt
+
+    def complete(prompt):
+        time.sleep(delay)
+        generated_pairs = [[f"suggested word {index}", f"запропоноване слово {index}"] for index in range(7)]
+        if "For every person" in prompt:
+            people_count = prompt.count("\nPerson ")
+            return json.dumps({str(number): generated_pairs for number in range(1, people_count + 1)})
+        return json.dumps(generated_pairs)
+
+    gpt.complete = complete
+
+
+def start(translate_delay=0.0, openai_delay=0.0):
+    # The environment is set before any module of the layer reads it
+    os.environ.update(
+        {
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+            "TABLE_NAME": TABLE_NAME,
+            "TELEGRAM_TOKEN": TELEGRAM_TOKEN,
+            "ADMIN_IDS": ADMIN_ID,
+            "OPENAI_API_KEY": "benchmark",
+            "POWERTOOLS_METRICS_NAMESPACE": "Benchmark",
+            "TELEMETRY_SAMPLE_RATE": os.getenv("TELEMETRY_SAMPLE_RATE", "0"),
+            # Legacy polling rules are looked up for the function, when the polling schedule changes
+            "POLLING_LAMBDA_ARN": LambdaContext.invoked_function_arn,
+        }
+    )
+    mock = start_dynamodb()
+    server = start_fake_telegram()
+    stub_translate(translate_delay)
+    stub_openai(openai_delay)
+    return mock, server
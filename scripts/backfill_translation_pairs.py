@@ -0,0 +1,83 @@
+"""
+Brings translation pair items written by older versions of the bot to the current layout
+and recalculates the per-user totals (STATS items) from them.
+
+Usage:
+    TABLE_NAME=... python scripts/backfill_translation_pairs.py
+"""
+import argparse
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "layers" / "main_layer"))
+
+from boto3.dynamodb.conditions import Attr  # noqa: E402
+
+from aws import dynamodb as dynamodb_operations  # noqa: E402
+from clients import get_table  # noqa: E402
+from distractors import get_pool_slots  # noqa: E402
+
+STATS_COUNTERS = ("polls_count", "correct_answers", "wrong_answers")
+
+
+def backfill_pair(pair):
+    key = {"pk": pair["pk"], "sk": pair["sk"]}
+    if not pair.get("active", True):
+        get_table().update_item(
+            Key=key, **dynamodb_operations.update_expression_kwargs(remove=("gsi1pk", "gsi1sk", "gsi2pk", "gsi2sk"))
+        )
+        return
+    # Active pairs are listed newest first through gsi1 and queued for spaced repetition through gsi2.
+    # Pairs that were never reviewed are due since their creation (created_at is a naive UTC timestamp).
+    due_at = pair.get("due_at") or f"{pair['created_at'][:19]}+00:00"
+    get_table().update_item(
+        Key=key,
+        **dynamodb_operations.update_expression_kwargs(
+            set_values={
+                "gsi1pk": f"USER#{pair['user_chat_id']}",
+                "gsi1sk": f"TRANSLATION_PAIR#{pair['created_at']}",
+                "gsi2pk": f"USER#{pair['user_chat_id']}",
+                "gsi2sk": f"TRANSLATION_PAIR#{due_at}",
+                "due_at": due_at,
+                "active": True,
+            }
+        ),
+    )
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+
+    pairs_count = 0
+    distractor_pools = defaultdict(dict)
+    users_stats = defaultdict(lambda: dict.fromkeys(("pairs_count", *STATS_COUNTERS), 0))
+    for pair in dynamodb_operations.iter_items(
+        get_table().scan, FilterExpression=Attr("sk").begins_with("TRANSLATION_PAIR#")
+    ):
+        backfill_pair(pair)
+        distractor_pools[pair["user_chat_id"]].update(get_pool_slots(pair))
+        user_stats = users_stats[pair["user_chat_id"]]
+        user_stats["pairs_count"] += int(pair.get("active", True))
+        for counter in STATS_COUNTERS:
+            user_stats[counter] += int(pair.get(counter, 0))
+        pairs_count += 1
+
+    # Pools are bounded, so each of them is written with a single update
+    for user_chat_id, pool_slots in distractor_pools.items():
+        dynamodb_operations.add_distractors(user_chat_id, pool_slots)
+    for user_chat_id, user_stats in users_stats.items():
+        get_table().update_item(
+            Key={"pk": f"USER#{user_chat_id}", "sk": "STATS"},
+            **dynamodb_operations.update_expression_kwargs(set_values=user_stats),
+        )
+        # Due pairs and distractors cached by warm polling containers are stale now
+        get_table().update_item(
+            Key={"pk": f"USER#{user_chat_id}", "sk": f"USER#{user_chat_id}"},
+            **dynamodb_operations.update_expression_kwargs(add_values={"pairs_version": 1}),
+        )
+    print(f"Backfilled {pairs_count} translation pairs of {len(distractor_pools)} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Moves users from their own EventBridge polling rules to the polling scheduler.
+
+Usage:
+    TABLE_NAME=... python scripts/migrate_polling_rules.py <polling lambda arn>
+"""
+import argparse
+import re
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "layers" / "main_layer"))
+
+from aws import dynamodb as dynamodb_operations  # noqa: E402
+from aws.events_bridge import get_rule  # noqa: E402
+from helpers import TIME_UNITS_IN_SECONDS, format_timestamp, get_next_poll_at, get_polling_rule_name  # noqa: E402
+from users import remove_legacy_polling_rule  # noqa: E402
+
+RATE_EXPRESSION_REGEX = re.compile(r"^rate\((\d+) (minute|hour|day)s?\)$")
+
+
+def migrate_user(user, polling_lambda_arn, now):
+    user_chat_id = str(user["user_chat_id"])
+    if not (rule := get_rule(get_polling_rule_name(user_chat_id))):
+        return False
+    if not (match := RATE_EXPRESSION_REGEX.match(rule.get("ScheduleExpression", ""))):
+        print(f"Skipping user {user_chat_id}: unexpected schedule {rule.get('ScheduleExpression')}")
+        return False
+
+    user["polling_interval"] = int(match.group(1)) * TIME_UNITS_IN_SECONDS[match.group(2)]
+    dynamodb_operations.update_polling_schedule(
+        user_chat_id,
+        format_timestamp(get_next_poll_at(user, now)),
+        polling_interval=user["polling_interval"],
+    )
+    remove_legacy_polling_rule(user_chat_id, polling_lambda_arn)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("polling_lambda_arn")
+    args = parser.parse_args()
+
+    now = datetime.now(timezone.utc)
+    migrated_count = sum(migrate_user(user, args.polling_lambda_arn, now) for user in dynamodb_operations.list_users())
+    print(f"Migrated {migrated_count} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Moves users from the single "USER" gsi1 partition and the single "POLLING_SCHEDULE" gsi2 partition
+to the sharded USERS#<shard> and POLLING_SCHEDULE#<shard> ones. With --from-shards users are moved
+from shards of a previous USER_SHARDS value, when the number of shards is changed.
+
+Both layouts are read while READ_LEGACY_USER_KEYS is "true" (the default), so the bot keeps working
+during the migration. Every key is updated only if it still has the old value, so users updated
+by the bot meanwhile are left as they are. Once the migration is done, set READ_LEGACY_USER_KEYS to "false".
+
+Usage:
+    TABLE_NAME=... python scripts/shard_user_keys.py [--from-shards 4] [--page-size 100] [--workers 8] [--dry-run]
+"""
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "layers" / "main_layer"))
+
+from boto3.dynamodb.conditions import Attr, Key  # noqa: E402
+
+from aws import dynamodb as dynamodb_operations  # noqa: E402
+from clients import get_table  # noqa: E402
+
+# (index, key attribute, legacy key, shards prefix)
+INDEX_KEYS = (
+    ("gsi1", "gsi1pk", dynamodb_operations.LEGACY_USERS_KEY, "USERS"),
+    ("gsi2", "gsi2pk", dynamodb_operations.LEGACY_POLLING_SCHEDULE_KEY, "POLLING_SCHEDULE"),
+)
+
+
+def get_old_keys(legacy_key, prefix, from_shards):
+    if not from_shards:
+        return [legacy_key]
+    return [f"{prefix}#{shard}" for shard in range(from_shards)]
+
+
+def iter_user_pages(index_name, key_attribute, old_key, page_size):
+    for response in dynamodb_operations.paginate(
+        get_table().query,
+        IndexName=index_name,
+        KeyConditionExpression=Key(key_attribute).eq(old_key),
+        ProjectionExpression=f"pk, sk, user_chat_id, {key_attribute}",
+        Limit=page_size,
+    ):
+        yield response["Items"]
+
+
+def get_new_key(user, prefix):
+    return f"{prefix}#{dynamodb_operations.get_user_shard(user['user_chat_id'])}"
+
+
+def move_user(user, key_attribute, prefix) -> bool:
+    if user[key_attribute] == (new_key := get_new_key(user, prefix)):
+        return False
+    try:
+        get_table().update_item(
+            Key={"pk": user["pk"], "sk": user["sk"]},
+            # The bot could have moved the user already, or the user could have been deleted
+            ConditionExpression=Attr(key_attribute).eq(user[key_attribute]),
+            **dynamodb_operations.update_expression_kwargs(set_values={key_attribute: new_key}),
+        )
+    except get_table().meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from-shards", type=int, help="the previous USER_SHARDS value")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for index_name, key_attribute, legacy_key, prefix in INDEX_KEYS:
+            read_count = moved_count = 0
+            for old_key in get_old_keys(legacy_key, prefix, args.from_shards):
+                # A query goes on from the last read key even if that user has been moved already
+                for users in iter_user_pages(index_name, key_attribute, old_key, args.page_size):
+                    read_count += len(users)
+                    if args.dry_run:
+                        moved_count += sum(user[key_attribute] != get_new_key(user, prefix) for user in users)
+                    else:
+                        moved_count += sum(executor.map(lambda user: move_user(user, key_attribute, prefix), users))
+                    print(f"{index_name}: read {read_count} users from {old_key}, moved {moved_count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Cleans up polls and suggestions, which were written before they got an expiry time, and expired ones,
+which TTL of the table hasn't deleted yet. The table is scanned page by page.
+
+By default polls and suggestions without expires_at get one, --grace-hours from now, so recent ones
+can still be answered and TTL deletes the rest. With --delete they are deleted right away in batches.
+
+Usage:
+    TABLE_NAME=... python scripts/sweep_expired_items.py [--grace-hours 24] [--delete] [--page-size 500] [--dry-run]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "layers" / "main_layer"))
+
+from boto3.dynamodb.conditions import Attr  # noqa: E402
+
+from aws import dynamodb as dynamodb_operations  # noqa: E402
+from clients import get_table  # noqa: E402
+
+
+def iter_item_pages(page_size):
+    for response in dynamodb_operations.paginate(
+        get_table().scan,
+        FilterExpression=Attr("pk").begins_with("POLL#") | Attr("pk").begins_with("SUGGESTION#"),
+        ProjectionExpression="pk, sk, expires_at",
+        Limit=page_size,
+    ):
+        yield response["Items"]
+
+
+def set_expiry(key, expires_at):
+    try:
+        get_table().update_item(
+            Key=key,
+            # The item could have been answered and deleted since the scan
+            ConditionExpression=Attr("pk").exists(),
+            **dynamodb_operations.update_expression_kwargs(set_if_not_exists={"expires_at": expires_at}),
+        )
+    except get_table().meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grace-hours", type=float, default=24)
+    parser.add_argument("--delete", action="store_true", help="delete items without expires_at right away")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    now = time.time()
+    expires_at = int(now + args.grace_hours * 60 * 60)
+    scanned_count = expired_count = deleted_count = 0
+    for items in iter_item_pages(args.page_size):
+        scanned_count += len(items)
+        keys_to_delete = []
+        for item in items:
+            key = {"pk": item["pk"], "sk": item["sk"]}
+            if "expires_at" in item:
+                # Already expired, but not deleted by TTL yet
+                if item["expires_at"] <= now:
+                    keys_to_delete.append(key)
+            elif args.delete:
+                keys_to_delete.append(key)
+            else:
+                expired_count += 1
+                if not args.dry_run:
+                    set_expiry(key, expires_at)
+        deleted_count += len(keys_to_delete)
+        if keys_to_delete and not args.dry_run:
+            with get_table().batch_writer() as batch:
+                for key in keys_to_delete:
+                    batch.delete_item(Key=key)
+        print(f"Scanned {scanned_count}, expiry set for {expired_count}, deleted {deleted_count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Seeds the shared translation cache with frequent words, one word or phrase per line of the file.
+
+Usage:
+    TABLE_NAME=... python scripts/warm_translation_cache.py words.txt [--from-lang en] [--to-lang uk]
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "layers" / "main_layer"))
+
+from aws.translate import warm_up_translation_cache  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("words_file", type=Path)
+    parser.add_argument("--from-lang", default="en")
+    parser.add_argument("--to-lang", default="uk")
+    parser.add_argument("--max-workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with args.words_file.open(encoding="utf-8") as words_file:
+        translated_count = warm_up_translation_cache(
+            (line.strip() for line in words_file), args.from_lang, args.to_lang, max_workers=args.max_workers
+        )
+    print(f"Translated and cached {translated_count} new texts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_lambda_powertools import Logger
+from telegram.error import RetryAfter, TelegramError, Unauthorized
+
+from aws import dynamodb as dynamodb_operations
+from clients import get_client
+from decorators import handle_errors
+from rate_limit import KeyedIntervalLimiter, TokenBucket
+from tg import send_message
+from users import request_users_removal
+
+POLLING_LAMBDA_ARN = os.getenv("POLLING_LAMBDA_ARN")
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "16"))
+# Telegram allows about 30 messages per second overall and 1 message per second to the same chat
+GLOBAL_MESSAGES_PER_SECOND = int(os.getenv("GLOBAL_MESSAGES_PER_SECOND", "25"))
+CHAT_MESSAGE_INTERVAL = 1
+MAX_SEND_ATTEMPTS = 3
+# Progress is checkpointed after every page of users
+USERS_PAGE_SIZE = 100
+# Continue in a new invocation, when there is not enough time left to send one more page
+RESUME_MARGIN_MS = 60 * 1000
+
+logger = Logger()
+global_limiter = TokenBucket(rate=GLOBAL_MESSAGES_PER_SECOND)
+chat_limiter = KeyedIntervalLimiter(min_interval=CHAT_MESSAGE_INTERVAL)
+
+
+def send_to_user(user_chat_id, message) -> str:
+    for _ in range(MAX_SEND_ATTEMPTS):
+        chat_limiter.acquire(user_chat_id)
+        global_limiter.acquire()
+        try:
+            send_message(user_chat_id, text=message, disable_markdown=True)
+            return "sent"
+        except RetryAfter as e:
+            logger.warning(f"Flood control exceeded, retrying in {e.retry_after} seconds")
+            global_limiter.pause(e.retry_after)
+        except Unauthorized:
+            logger.error(f"user {user_chat_id} has blocked bot")
+            return "blocked"
+        except TelegramError:
+            logger.exception(f"Failed to send broadcast message to user {user_chat_id}")
+            return "failed"
+    return "failed"
+
+
+def resume_later(broadcast_id, context):
+    get_client("lambda").invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps({"broadcast_id": broadcast_id}),
+    )
+
+
+@handle_errors
+def handler(event, context):
+    broadcast_id = event["broadcast_id"]
+    broadcast = dynamodb_operations.get_broadcast(broadcast_id)
+    if broadcast.get("status") != "IN_PROGRESS":
+        return
+
+    message = broadcast["message"]
+    with ThreadPoolExecutor(max_workers=SEND_CONCURRENCY) as executor:
+        for users, cursor in dynamodb_operations.iter_user_pages(broadcast.get("cursor"), USERS_PAGE_SIZE):
+            user_chat_ids = [str(user["user_chat_id"]) for user in users]
+            results = list(executor.map(lambda user_chat_id: send_to_user(user_chat_id, message), user_chat_ids))
+            blocked_user_chat_ids = [
+                user_chat_id for user_chat_id, result in zip(user_chat_ids, results) if result == "blocked"
+            ]
+            if blocked_user_chat_ids:
+                request_users_removal(blocked_user_chat_ids, POLLING_LAMBDA_ARN)
+            dynamodb_operations.checkpoint_broadcast(
+                broadcast_id, cursor, sent_count=results.count("sent"), blocked_count=len(blocked_user_chat_ids)
+            )
+            if cursor and context.get_remaining_time_in_millis() < RESUME_MARGIN_MS:
+                logger.info({"broadcast_id": broadcast_id, "resumed_from": cursor})
+                resume_later(broadcast_id, context)
+                return
+
+    broadcast = dynamodb_operations.get_broadcast(broadcast_id)
+    logger.info(broadcast)
+    send_message(
+        str(broadcast["user_chat_id"]),
+        text=f"Розсилку завершено: надіслано {broadcast['sent_count']}, заблокували бота {broadcast['blocked_count']}",
+    )
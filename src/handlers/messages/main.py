@@ -1,22 +1,24 @@
 import json
 import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
 from http import HTTPStatus
-from contextlib import suppress
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 import telegram
 from aws_lambda_powertools import Logger
-from boto3 import client
 from telegram import Update
-from telegram.error import Unauthorized
 
 from aws import dynamodb as dynamodb_operations
-from aws.events_bridge import put_event, put_targets, get_rule
 from aws.translate import translate_text
 from decorators import handle_errors
 from exceptions import ProcessMessageError
-from helpers import get_polling_rule_name
-from tg import Chat, bot, send_message, ADMIN_IDS
-from users import remove_user
+from helpers import TIME_UNITS_IN_SECONDS, format_timestamp, get_next_poll_at
+import spaced_repetition
+from clients import get_bot, get_client
+from tg import Chat, edit_message, send_message, ADMIN_IDS
+from users import remove_legacy_polling_rule
+from telemetry import add_count
 
 ASK_FOR_ENGLISH = "Надішли мені текст фрази або слова **англійською**"
 ASK_FOR_RATE = (
@@ -31,81 +33,147 @@ HELLO_MESSAGE_UK = (
     r"за допомогою команд /set\_polling\_rate\_in\_minutes або /set\_polling\_rate\_in\_hours."
     "\n\nКоли ти розумієш, що вже добре вивчив якесь своє слово/фразу, "
     r"ти можеш виключити її з опитувань за допомогою команди /delete\_pair."
+    "\n\nЯ не надсилаю опитування вночі. Щоб я знав, коли у тебе ніч, "
+    r"вкажи свій часовий пояс за допомогою команди /set\_timezone."
     "\n\n"
     r"Ти також можеш переглянути всі свої слова/фрази за допомогою команди /list\_pairs."
     "\n\nБудь ласка, насолоджуйся і ставай розумнішим з кожним днем!"
     "\nЯкщо ти виявив, що щось зламано або просто хочеш запропонувати якісь покращення, "
     "будь ласка, зв'яжись зі мною, автором, @ZenCrazyCat"
 )
+ASK_FOR_TIMEZONE = "Надішли мені назву свого часового поясу, наприклад Europe/Kyiv"
+ASK_FOR_IMPORT = (
+    "Надішли мені файл CSV або TSV, у кожному рядку якого англійська фраза/слово і переклад, "
+    "наприклад _apple,яблуко_. Якщо перекладу немає, я перекладу сам"
+)
 EN_UK_SPLITTER = f"\n\n{'~' * 25}\n\n"
 TIP_LENGTH_MULTIPLIER = 1.7
 POLLING_LAMBDA_ARN = os.getenv("POLLING_LAMBDA_ARN")
+BROADCAST_LAMBDA_ARN = os.getenv("BROADCAST_LAMBDA_ARN")
+IMPORT_LAMBDA_ARN = os.getenv("IMPORT_LAMBDA_ARN")
+EXPORT_LAMBDA_ARN = os.getenv("EXPORT_LAMBDA_ARN")
+# Limit of files, which bots can download
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+# Keeps a page far below the message length limit of Telegram
+PAIRS_PAGE_SIZE = 15
+# Days shown by /stats
+STATS_DAYS = 7
 
 logger = Logger()
-lambda_client = client("lambda")
-
-
-def list_translation_pairs_text(user_chat_id):
-    translation_pairs = dynamodb_operations.list_translation_pairs(user_chat_id)
-    result_text = f"Count: {len(translation_pairs)}\n\n"
-    for pair in translation_pairs:
-        correct_answers = pair.get("correct_answers", 0)
-        wrong_answers = pair.get("wrong_answers", 0)
-        all_answers = correct_answers + wrong_answers
-        correct_percentage = 0 if all_answers == 0 else correct_answers * 100 / all_answers
-        result_text += (
-            f"**{pair['english_text']} - {pair['native_text']}**\n"
-            f"_(polled {pair.get('polls_count', 0)} times - "
-            f"{correct_answers}✅ {wrong_answers}⛔ - {int(round(correct_percentage, 0))}%)_\n\n"
-        )
 
-    return result_text
 
+def format_answers_stats(stats):
+    correct_answers = stats.get("correct_answers", 0)
+    wrong_answers = stats.get("wrong_answers", 0)
+    all_answers = correct_answers + wrong_answers
+    correct_percentage = 0 if all_answers == 0 else correct_answers * 100 / all_answers
+    return (
+        f"polled {stats.get('polls_count', 0)} times - "
+        f"{correct_answers}✅ {wrong_answers}⛔ - {int(round(correct_percentage, 0))}%"
+    )
 
-def setup_polling(user_chat_id, time_amount, time_units):
-    rule_name = get_polling_rule_name(user_chat_id)
-    rule_arn = put_event(rule_name, f"rate({time_amount} {time_units})")
-    put_targets(
-        rule_name,
-        [
-            {
-                "Arn": POLLING_LAMBDA_ARN,
-                "Id": "POLLING_LAMBDA",
-                "Input": json.dumps({"user_chat_id": user_chat_id}),
-            }
-        ],
+
+def list_translation_pairs_page(user_chat_id, older_than=None, newer_than=None) -> tuple:
+    # Only one page of pairs is read, the header comes from the totals kept by the writes
+    translation_pairs, has_more = dynamodb_operations.list_translation_pairs_page(
+        user_chat_id, PAIRS_PAGE_SIZE, older_than=older_than, newer_than=newer_than
     )
-    with suppress(lambda_client.exceptions.ResourceConflictException):
-        lambda_client.add_permission(
-            FunctionName=POLLING_LAMBDA_ARN,
-            StatementId=f"PERIODIC_{user_chat_id}_POLLING_PERMISSION",
-            Action="lambda:InvokeFunction",
-            Principal="events.amazonaws.com",
-            SourceArn=rule_arn,
+    stats = dynamodb_operations.get_user_stats(user_chat_id)
+    result_text = f"Count: {stats.get('pairs_count', 0)} _({format_answers_stats(stats)})_\n"
+    # Answers of the day come from the rollup of the table stream
+    today = datetime.now(timezone.utc).date().isoformat()
+    if today_rollup := dynamodb_operations.get_daily_rollup(user_chat_id, today):
+        result_text += f"Today: _({format_answers_stats(today_rollup)})_\n"
+    result_text += "\n" + "".join(
+        f"**{pair['english_text']} - {pair['native_text']}**\n_({format_answers_stats(pair)})_\n\n"
+        for pair in translation_pairs
+    )
+
+    buttons = []
+    if translation_pairs and (has_more if newer_than else older_than):
+        buttons.append(
+            telegram.InlineKeyboardButton("⬅️", callback_data=f"pairs:p:{translation_pairs[0]['created_at']}")
+        )
+    if translation_pairs and (newer_than or has_more):
+        buttons.append(
+            telegram.InlineKeyboardButton("➡️", callback_data=f"pairs:n:{translation_pairs[-1]['created_at']}")
         )
+    return result_text, telegram.InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def format_daily_stats(last_day) -> str:
+    # Totals of all users by days, summed from their daily rollups
+    lines = []
+    for days_ago in range(STATS_DAYS):
+        day = (last_day - timedelta(days=days_ago)).isoformat()
+        totals, users_count = defaultdict(int), 0
+        for rollup in dynamodb_operations.list_daily_rollups(day):
+            users_count += 1
+            for field in dynamodb_operations.ROLLUP_COUNTERS:
+                totals[field] += int(rollup.get(field, 0))
+        lines.append(f"{day}: {users_count} users, {format_answers_stats(totals)}")
+    return "\n".join(lines)
+
+
+def start_vocabulary_import(user_chat_id, document):
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        raise ProcessMessageError(message="Файл завеликий, я можу імпортувати файли до 20 МБ")
+    # A redelivered document finds the action finished already, so the import is started once
+    if not dynamodb_operations.finish_current_action(user_chat_id, "VOCABULARY_IMPORTING"):
+        raise ProcessMessageError(message=r"Щоб імпортувати фрази/слова з файлу, використай команду /import")
+    # Pairs are imported by the import worker, so the webhook isn't held open for large files
+    get_client("lambda").invoke(
+        FunctionName=IMPORT_LAMBDA_ARN,
+        InvocationType="Event",
+        Payload=json.dumps({"user_chat_id": user_chat_id, "file_id": document.file_id}),
+    )
+    send_message(user_chat_id, text="Імпорт розпочато. Я повідомлю, коли він завершиться")
+
+
+def setup_polling(user_chat_id, current_action_type=None, **schedule_settings):
+    user = {**dynamodb_operations.get_user(user_chat_id), **schedule_settings}
+    next_poll_at = get_next_poll_at(user, datetime.now(timezone.utc))
+    dynamodb_operations.update_polling_schedule(
+        user_chat_id, format_timestamp(next_poll_at), current_action_type, **schedule_settings
+    )
+    remove_legacy_polling_rule(user_chat_id, POLLING_LAMBDA_ARN)
 
 
 @handle_errors
 def handler(event, _):
     logger.info(event)
-    update = Update.de_json(json.loads(event.get("body")), bot)
+    update = Update.de_json(json.loads(event.get("body")), get_bot())
     if poll := update.poll:
         if poll.type == telegram.Poll.QUIZ:
-            saved_poll_info = dynamodb_operations.get_poll(poll.id)
+            # Telegram can deliver the same answer more than once, the poll is counted only by the first delivery
+            saved_poll_info = dynamodb_operations.delete_poll(poll.id)
             if not saved_poll_info:
+                logger.info({"answered_or_expired_poll": poll.id})
                 return {"statusCode": HTTPStatus.OK}
 
             answered_correctly = bool(poll.options[poll.correct_option_id]["voter_count"])
             pair_stats_field_to_increment = "correct_answers" if answered_correctly else "wrong_answers"
-            dynamodb_operations.increment_translation_pair_fields(
+            review = spaced_repetition.review(
+                saved_poll_info,
+                (
+                    spaced_repetition.QUIZ_CORRECT_QUALITY
+                    if answered_correctly
+                    else spaced_repetition.WRONG_ANSWER_QUALITY
+                ),
+                datetime.now(timezone.utc),
+            )
+            dynamodb_operations.review_translation_pair(
                 saved_poll_info["user_chat_id"],
                 saved_poll_info["english_text"],
+                review,
                 **{pair_stats_field_to_increment: 1},
             )
-            dynamodb_operations.delete_poll(poll.id)
             return {"statusCode": HTTPStatus.OK}
 
-        suggestion_info = dynamodb_operations.get_suggestion(poll.id)
+        if not (suggestion_info := dynamodb_operations.get_suggestion(poll.id)):
+            # A late answer to an expired suggestion, there is no user to tell about it in a poll update
+            logger.info({"expired_suggestion": poll.id})
+            return {"statusCode": HTTPStatus.OK}
         suggested_pairs = suggestion_info["new_words"]
         for index, option in enumerate(poll.options):
             if option.voter_count:
@@ -121,16 +189,30 @@ def handler(event, _):
         )
         return {"statusCode": HTTPStatus.OK}
 
+    if callback_query := update.callback_query:
+        event["user_chat_id"] = user_chat_id = callback_query.message.chat.id
+        # Navigation through /list_pairs pages: "pairs:n:<created_at>" for the next one, "pairs:p:..." for the previous
+        prefix, direction, created_at = callback_query.data.split(":", 2)
+        if prefix == "pairs":
+            text, reply_markup = list_translation_pairs_page(
+                user_chat_id, **{"older_than" if direction == "n" else "newer_than": created_at}
+            )
+            edit_message(user_chat_id, callback_query.message.message_id, text, reply_markup)
+        get_bot().answerCallbackQuery(callback_query.id)
+        return {"statusCode": HTTPStatus.OK}
+
     if not update.message:
         return {"statusCode": HTTPStatus.OK}
     chat = Chat(tg_update_obj=update)
     event["user_chat_id"] = user_chat_id = chat.id
+    if document := update.message.document:
+        start_vocabulary_import(user_chat_id, document)
+        return {"statusCode": HTTPStatus.OK}
     text = chat.text.strip()
     if text.startswith("/start"):
         chat.send_message(text=HELLO_MESSAGE_UK)
-        dynamodb_operations.create_user(user_chat_id, chat.username)
-        if not get_rule(get_polling_rule_name(user_chat_id)):
-            setup_polling(user_chat_id, time_amount=1, time_units="hour")
+        next_poll_at = get_next_poll_at({}, datetime.now(timezone.utc))
+        dynamodb_operations.create_user(user_chat_id, chat.username, format_timestamp(next_poll_at))
     elif text.startswith("/add_pair"):
         dynamodb_operations.create_current_action(user_chat_id, "TRANSLATION_PAIR_CREATING")
         chat.send_message(text=ASK_FOR_ENGLISH)
@@ -138,7 +220,8 @@ def handler(event, _):
         dynamodb_operations.create_current_action(user_chat_id, "TRANSLATION_PAIR_DELETING")
         chat.send_message(text=f"{ASK_FOR_ENGLISH}, що ти вже вивчив, і хотів би видалити")
     elif text.startswith("/list_pairs"):
-        chat.send_message(text=list_translation_pairs_text(user_chat_id))
+        text, reply_markup = list_translation_pairs_page(user_chat_id)
+        chat.send_message(text=text, reply_markup=reply_markup)
     elif text.startswith("/cancel"):
         if dynamodb_operations.delete_current_action(user_chat_id):
             chat.send_message(text="Операція відмінена")
@@ -148,6 +231,25 @@ def handler(event, _):
         time_units = text.split(" ")[0].split("/set_polling_rate_in_")[-1]
         dynamodb_operations.create_current_action(user_chat_id, "POLLING_RATE_UPDATE", time_units=time_units)
         chat.send_message(text=f"{ASK_FOR_RATE} in {time_units}")
+    elif text.startswith("/import"):
+        dynamodb_operations.create_current_action(user_chat_id, "VOCABULARY_IMPORTING")
+        chat.send_message(text=ASK_FOR_IMPORT)
+    elif text.startswith("/export"):
+        # "/export" for CSV, "/export jsonl" for JSON Lines. The file is built by the export worker.
+        export_format = text.split(" ")[-1].lower() if " " in text else "csv"
+        get_client("lambda").invoke(
+            FunctionName=EXPORT_LAMBDA_ARN,
+            InvocationType="Event",
+            Payload=json.dumps({"user_chat_id": user_chat_id, "format": export_format}),
+        )
+        chat.send_message(text="Готую файл зі словником, я надішлю його, щойно він буде готовий")
+    elif text.startswith("/set_timezone"):
+        dynamodb_operations.create_current_action(user_chat_id, "TIMEZONE_UPDATE")
+        chat.send_message(text=ASK_FOR_TIMEZONE)
+    elif text.startswith("/stats"):
+        if str(user_chat_id) not in ADMIN_IDS:
+            raise ProcessMessageError(message="Вибачте, але ви не адміністратор")
+        chat.send_message(text=format_daily_stats(datetime.now(timezone.utc).date()))
     elif text.startswith("/notify_users"):
         command_and_message = text.split("/notify_users ")
         message = command_and_message[-1]
@@ -158,12 +260,14 @@ def handler(event, _):
                 message="Ви не передали жодного повідомлення користувачам. Зробіть це після команди та пробілу"
             )
 
-        for user in dynamodb_operations.list_users():
-            try:
-                send_message(str(user["user_chat_id"]), text=message, disable_markdown=True)
-            except Unauthorized:
-                logger.error(f"user {user_chat_id} has blocked bot")
-                remove_user(str(user["user_chat_id"]), POLLING_LAMBDA_ARN)
+        # Messages are sent by the broadcast worker, so the webhook isn't held open for all users
+        if dynamodb_operations.create_broadcast(update.update_id, user_chat_id, message):
+            get_client("lambda").invoke(
+                FunctionName=BROADCAST_LAMBDA_ARN,
+                InvocationType="Event",
+                Payload=json.dumps({"broadcast_id": update.update_id}),
+            )
+            chat.send_message(text="Розсилку розпочато. Я повідомлю, коли вона завершиться")
     else:
         # Data from customer for some current operation (action)
         if not (current_action := dynamodb_operations.get_current_action(user_chat_id)):
@@ -173,9 +277,14 @@ def handler(event, _):
         current_action_type = current_action["action_type"]
         if current_action_type == "TRANSLATION_PAIR_CREATING":
             if english_text := current_action.get("english_text"):
-                dynamodb_operations.create_translation_pair(
-                    user_chat_id, english_text, native_text=current_action.get("native_text") if text == "+" else text
-                )
+                if not dynamodb_operations.create_translation_pair(
+                    user_chat_id,
+                    english_text,
+                    native_text=current_action.get("native_text") if text == "+" else text,
+                    current_action_type=current_action_type,
+                ):
+                    dynamodb_operations.delete_current_action(user_chat_id)
+                    raise ProcessMessageError(message="Ця фраза/слово вже є у твоєму словнику")
                 chat.send_message(text="Нову фразу/слово додано! Буду радий допомогти тобі вивчити це.")
             else:
                 suggested_translation = translate_text(text)
@@ -208,19 +317,36 @@ def handler(event, _):
             if time_amount == "1":
                 # 'hours' -> 'hour', 'minutes' -> 'minute'
                 time_units = time_units[:-1]
-            setup_polling(user_chat_id, time_amount, time_units)
-            dynamodb_operations.delete_current_action(user_chat_id)
+            setup_polling(
+                user_chat_id,
+                current_action_type,
+                polling_interval=int(time_amount) * TIME_UNITS_IN_SECONDS[time_units.rstrip("s")],
+            )
             chat.send_message(text=f"Okay, I will poll you every {time_amount} {time_units}")
+        elif current_action_type == "TIMEZONE_UPDATE":
+            # Markdown cleaning above would break names like America/New_York
+            timezone_name = chat.text.strip()
+            try:
+                ZoneInfo(timezone_name)
+            except (ZoneInfoNotFoundError, ValueError):
+                raise ProcessMessageError(
+                    message="Невідомий часовий пояс. Спробуйте ще раз або скасуйте операцію (/cancel)"
+                )
+            setup_polling(user_chat_id, current_action_type, timezone=timezone_name)
+            send_message(user_chat_id, text=f"Okay, your timezone is {timezone_name} now", disable_markdown=True)
+        elif current_action_type == "VOCABULARY_IMPORTING":
+            raise ProcessMessageError(message=f"{ASK_FOR_IMPORT}, або скасуй операцію (/cancel)")
         elif current_action_type == "OPEN_QUESTION":
             full_answer = current_action["answer"].lower()
             possible_answers = {
                 full_answer,
                 *[answer.strip().replace("(", "").replace(")", "") for answer in full_answer.split(",")],
             }
-            if text.lower() in possible_answers:
+            answered_correctly = text.lower() in possible_answers
+            mistakes_count = None
+            if answered_correctly:
                 pair_stats_field_to_increment = "correct_answers"
                 message_to_send = "Correct ✅ Good job!"
-                dynamodb_operations.delete_current_action(user_chat_id)
             else:
                 pair_stats_field_to_increment = "wrong_answers"
                 message_to_send = "Вибачте, це неправильна відповідь ⛔ Будь ласка, спробуйте ще раз. "
@@ -229,13 +355,69 @@ def handler(event, _):
                     "\n\nНевеличка підказка: "
                     f"_'{full_answer[:mistakes_count]}{'*' * (len(full_answer) - mistakes_count)}'_"
                 )
-                dynamodb_operations.update_current_action(user_chat_id, translation_tip_length=mistakes_count)
 
-            dynamodb_operations.increment_translation_pair_fields(
+            review = None
+            if "translation_tip_length" not in current_action:
+                # Only the first attempt tells how well the pair is remembered
+                review = spaced_repetition.review(
+                    current_action,
+                    (
+                        spaced_repetition.OPEN_QUESTION_CORRECT_QUALITY
+                        if answered_correctly
+                        else spaced_repetition.WRONG_ANSWER_QUALITY
+                    ),
+                    datetime.now(timezone.utc),
+                )
+            # Stats, spaced repetition state and the question itself are updated at once
+            if dynamodb_operations.answer_open_question(
                 user_chat_id,
                 current_action["english_text"],
+                review,
+                translation_tip_length=mistakes_count,
                 **{pair_stats_field_to_increment: 1},
-            )
-            chat.send_message(message_to_send)
+            ):
+                chat.send_message(message_to_send)
 
     return {"statusCode": HTTPStatus.OK}
+
+
+def batch_handler(event, context):
+    # Updates queued by the webhook handler. The FIFO queue keeps updates of a chat in order within the batch,
+    # and they are processed in that order in one unit of work, so reads and writes are shared by the batch.
+    records_by_chat = defaultdict(list)
+    for record in event["Records"]:
+        records_by_chat[record["attributes"]["MessageGroupId"]].append(record)
+
+    # {chat group id: write groups buffered by the updates of the chat}
+    chat_writes = {}
+    failed_update_ids = []
+    current_unit_of_work = None
+    try:
+        with dynamodb_operations.unit_of_work() as current_unit_of_work:
+            for chat_group_id, records in records_by_chat.items():
+                writes_count = len(current_unit_of_work.pending_writes)
+                for record in records:
+                    handler({"body": record["body"]}, context)
+                chat_writes[chat_group_id] = current_unit_of_work.pending_writes[writes_count:]
+    except Exception:
+        if not current_unit_of_work:
+            # No update is handled before the unit of work starts, so the whole batch is retried
+            raise
+        # Replies are sent already, so the updates are not retried because of the buffered writes.
+        # Writes of the other chats are flushed, only the ones of the reported updates are lost.
+        failed_writes = {id(write_group) for write_group in current_unit_of_work.failed_writes}
+        failed_update_ids = [
+            json.loads(record["body"])["update_id"]
+            for chat_group_id, records in records_by_chat.items()
+            if any(id(write_group) in failed_writes for write_group in chat_writes.get(chat_group_id, ()))
+            for record in records
+        ]
+        logger.exception({"failed_update_ids": failed_update_ids})
+        add_count("FailedUpdates", len(failed_update_ids))
+    logger.info(
+        {
+            "updates": len(event["Records"]),
+            "failed_updates": len(failed_update_ids),
+            "dynamodb_requests": dict(current_unit_of_work.requests),
+        }
+    )
@@ -1,59 +1,64 @@
 import os
 import random
-from datetime import datetime
+from datetime import datetime, timezone
 from http import HTTPStatus
 
 import telegram
 from aws_lambda_powertools import Logger
-from boto3 import resource
-from telegram import Bot
 
 from decorators import handle_errors
+from exceptions import ProcessMessageError
 from aws import dynamodb as dynamodb_operations
-from helpers import sort_pairs_by_priority
+from cache import LRUCache
+from clients import get_bot
+from distractors import pick_options
+from spaced_repetition import REVIEW_STATE_FIELDS, get_review_state, postpone
 from tg import send_message
 
 logger = Logger()
-table = resource("dynamodb").Table(os.getenv("TABLE_NAME"))
-
-bot = Bot(token=os.getenv("TELEGRAM_TOKEN"))
-
-POOL_SIZES_DISTRIBUTION = (
-    *(5 for _ in range(7)),
-    *(8 for _ in range(6)),
-    *(12 for _ in range(5)),
-    *(15 for _ in range(4)),
-    *(20 for _ in range(3)),
-    *(25 for _ in range(3)),
-    *(30 for _ in range(1)),
-)
-BOOLEANS = (True, False)
-
-
-def select_pair_to_poll(translation_pairs):
-    pool_size = random.choice(POOL_SIZES_DISTRIBUTION)
-    return random.choice(sort_pairs_by_priority(translation_pairs)[:pool_size])
 
+BOOLEANS = (True, False)
+# The pair to poll is picked randomly among that many most overdue pairs
+DUE_PAIRS_LIMIT = 5
+POLLING_PROJECTION = ("english_text", "native_text", *REVIEW_STATE_FIELDS)
+# Entries are bounded by DUE_PAIRS_LIMIT pairs and the distractors pool, so their count caps the memory
+polling_cache = LRUCache(max_size=int(os.getenv("POLLING_CACHE_SIZE", "1024")))
+
+
+def get_polling_state(user_chat_id) -> dict:
+    # Due pairs and distractors of a user change only with the writes, which bump pairs_version of the user,
+    # so a warm container reads only the user item, while the user doesn't answer or change the vocabulary
+    pairs_version = dynamodb_operations.get_user(user_chat_id).get("pairs_version", 0)
+    polling_state = polling_cache.get(user_chat_id)
+    # Polled pairs are dropped from the cache, so it's read again, when too few are left for a quiz
+    if (
+        not polling_state
+        or polling_state["pairs_version"] != pairs_version
+        or len(polling_state["due_translation_pairs"]) < 2
+    ):
+        polling_state = {
+            "pairs_version": pairs_version,
+            "due_translation_pairs": dynamodb_operations.list_due_translation_pairs(
+                user_chat_id, limit=DUE_PAIRS_LIMIT, projection=POLLING_PROJECTION
+            ),
+            # Open questions don't need distractors, so they are read by the first quiz
+            "distractors": None,
+        }
+        polling_cache.set(user_chat_id, polling_state)
+    return polling_state
 
-def gather_options(translation_pairs, correct_option, answers_key) -> list:
-    options = {correct_option}
-    pairs_count = len(translation_pairs)
-    options_limit = pairs_count if pairs_count < 4 else 4
-    while len(options) < options_limit:
-        options.add(random.choice(translation_pairs)[answers_key])
 
-    return list(options)
+def select_pair_to_poll(due_translation_pairs):
+    return random.choice(due_translation_pairs)
 
 
 @handle_errors
 def handler(event, _):
-    if 22 < datetime.now().hour or datetime.now().hour < 7:
-        # We don't bother users at night
-        return {"statusCode": HTTPStatus.OK}
-
+    # Quiet hours are respected by the polling scheduler, so the user is never bothered at night
     user_chat_id = event["user_chat_id"]
-    translation_pairs = dynamodb_operations.list_translation_pairs(user_chat_id)
-    translation_pairs_number = len(translation_pairs)
+    polling_state = get_polling_state(user_chat_id)
+    due_translation_pairs = polling_state["due_translation_pairs"]
+    translation_pairs_number = len(due_translation_pairs)
     if translation_pairs_number < 2:
         send_message(
             user_chat_id=user_chat_id,
@@ -69,41 +74,60 @@ def handler(event, _):
     if random.choice(BOOLEANS):
         question_key, answers_key = answers_key, question_key
 
-    pair_to_poll = select_pair_to_poll(translation_pairs)
+    pair_to_poll = select_pair_to_poll(due_translation_pairs)
 
     question = pair_to_poll[question_key]
     answer = pair_to_poll[answers_key]
 
     if random.random() < 0.2:
         # Open translation question.
-        current_action = dynamodb_operations.get_current_action(user_chat_id)
-        if current_action and current_action["action_type"] == "OPEN_QUESTION":
+        try:
+            dynamodb_operations.create_current_action(
+                user_chat_id,
+                "OPEN_QUESTION",
+                question=question,
+                answer=answer,
+                english_text=pair_to_poll["english_text"],
+                **get_review_state(pair_to_poll),
+            )
+        except ProcessMessageError:
+            # The current action is read only when there is one
+            current_action = dynamodb_operations.get_current_action(user_chat_id)
+            if not current_action or current_action["action_type"] != "OPEN_QUESTION":
+                raise
             send_message(
                 user_chat_id=user_chat_id,
                 text=f"Reminder: Send me the translation for _'{current_action['question']}'_",
             )
             return {"statusCode": HTTPStatus.OK}
 
-        dynamodb_operations.create_current_action(
-            user_chat_id,
-            "OPEN_QUESTION",
-            question=question,
-            answer=answer,
-            english_text=pair_to_poll["english_text"],
-        )
         send_message(user_chat_id=user_chat_id, text=f"Send me the translation for _'{question}'_")
         return {"statusCode": HTTPStatus.OK}
 
-    options = gather_options(translation_pairs, answer, answers_key)
-
-    poll_id = bot.sendPoll(
+    if polling_state["distractors"] is None:
+        polling_state["distractors"] = dynamodb_operations.get_distractors(user_chat_id)
+    options = pick_options(
+        polling_state["distractors"],
+        answer,
+        answers_key,
+        # Pools of users, who haven't been backfilled yet, could be empty
+        extra_candidates=[pair[answers_key] for pair in due_translation_pairs],
+    )
+
+    poll_id = get_bot().sendPoll(
         chat_id=user_chat_id,
         question=question,
         options=options,
         type=telegram.Poll.QUIZ,
         correct_option_id=options.index(answer),
     )["poll"]["id"]
-    dynamodb_operations.create_poll(user_chat_id, poll_id, pair_to_poll["english_text"])
-    dynamodb_operations.increment_translation_pair_fields(user_chat_id, pair_to_poll["english_text"], polls_count=1)
+    dynamodb_operations.create_poll(
+        user_chat_id, poll_id, pair_to_poll["english_text"], **get_review_state(pair_to_poll)
+    )
+    dynamodb_operations.postpone_translation_pair(
+        user_chat_id, pair_to_poll["english_text"], postpone(datetime.now(timezone.utc)), polls_count=1
+    )
+    # The rest of the cached pairs are still the most overdue ones
+    due_translation_pairs.remove(pair_to_poll)
 
     return {"statusCode": HTTPStatus.OK}
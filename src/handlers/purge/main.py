@@ -0,0 +1,13 @@
+from aws_lambda_powertools import Logger
+
+from decorators import handle_errors
+from users import remove_users
+
+logger = Logger()
+
+
+@handle_errors
+def handler(event, _):
+    user_chat_ids = event["user_chat_ids"]
+    remove_users(user_chat_ids, event["polling_lambda_arn"])
+    logger.info({"removed_users": user_chat_ids})
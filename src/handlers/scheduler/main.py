@@ -0,0 +1,45 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from aws_lambda_powertools import Logger
+
+from aws import dynamodb as dynamodb_operations
+from clients import get_client
+from decorators import handle_errors
+from helpers import format_timestamp, get_next_poll_at
+
+POLLING_LAMBDA_ARN = os.getenv("POLLING_LAMBDA_ARN")
+DISPATCH_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", "16"))
+
+logger = Logger()
+
+
+def dispatch_poll(user, now) -> bool:
+    user_chat_id = str(user["user_chat_id"])
+    try:
+        next_poll_at = format_timestamp(get_next_poll_at(user, now))
+        if not dynamodb_operations.reschedule_poll(user_chat_id, user["next_poll_at"], next_poll_at):
+            return False
+        get_client("lambda").invoke(
+            FunctionName=POLLING_LAMBDA_ARN,
+            InvocationType="Event",
+            Payload=json.dumps({"user_chat_id": user_chat_id}),
+        )
+    except Exception:
+        # One broken user must not stop polls of the others
+        logger.exception(f"Failed to dispatch poll for user {user_chat_id}")
+        return False
+    return True
+
+
+@handle_errors
+def handler(_, __):
+    now = datetime.now(timezone.utc)
+    dispatched_count = 0
+    with ThreadPoolExecutor(max_workers=DISPATCH_CONCURRENCY) as executor:
+        for due_users in dynamodb_operations.list_users_due_for_poll(format_timestamp(now)):
+            dispatched_count += sum(executor.map(lambda user: dispatch_poll(user, now), due_users))
+
+    logger.info({"dispatched_polls": dispatched_count})
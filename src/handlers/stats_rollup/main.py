@@ -0,0 +1,92 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from aws_lambda_powertools import Logger
+
+from aws import dynamodb as dynamodb_operations
+
+WRITE_CONCURRENCY = int(os.getenv("WRITE_CONCURRENCY", "8"))
+# Sequence numbers of the stream have up to 40 digits, padded ones can be compared as strings
+SEQUENCE_NUMBER_LENGTH = 40
+
+logger = Logger()
+
+
+def get_counters_change(record) -> dict:
+    old_image, new_image = (record["dynamodb"].get(image, {}) for image in ("OldImage", "NewImage"))
+    change = {}
+    for field in dynamodb_operations.ROLLUP_COUNTERS:
+        if delta := int(new_image.get(field, {}).get("N", 0)) - int(old_image.get(field, {}).get("N", 0)):
+            change[field] = delta
+    return change
+
+
+def is_pair_replaced(record) -> bool:
+    # A deleted pair is added again by a put of a new item, whose counters start from zero
+    old_image, new_image = (record["dynamodb"].get(image, {}) for image in ("OldImage", "NewImage"))
+    return old_image.get("active") == {"BOOL": False} or old_image.get("created_at") != new_image.get("created_at")
+
+
+def group_changes(records) -> dict:
+    # {(user_chat_id, english_text, day): [(sequence_number, counters), ...]} in the order of the records
+    pair_changes = defaultdict(list)
+    seen_sequence_numbers = set()
+    for record in records:
+        keys = record["dynamodb"]["Keys"]
+        if record["eventName"] != "MODIFY" or not keys["sk"]["S"].startswith("TRANSLATION_PAIR#"):
+            continue
+        if is_pair_replaced(record) or not (counters := get_counters_change(record)):
+            continue
+        user_chat_id = keys["pk"]["S"].split("#", 1)[1]
+        english_text = keys["sk"]["S"].split("#", 1)[1]
+        changed_at = datetime.fromtimestamp(record["dynamodb"]["ApproximateCreationDateTime"], timezone.utc)
+        sequence_number = record["dynamodb"]["SequenceNumber"].zfill(SEQUENCE_NUMBER_LENGTH)
+        if sequence_number in seen_sequence_numbers:
+            continue
+        seen_sequence_numbers.add(sequence_number)
+        pair_changes[(user_chat_id, english_text, changed_at.date().isoformat())].append((sequence_number, counters))
+    return pair_changes
+
+
+def add_to_rollup(add, *args) -> str:
+    # Returns the first sequence number of the changes, if they are not added
+    try:
+        add(*args)
+    except Exception:
+        logger.exception(f"Failed to add changes to the rollup {args[:-1]}")
+        return args[-1][0][0]
+    return ""
+
+
+def handler(event, _):
+    # Changes of the pair counters are summed by users and days and by pairs and days,
+    # so every rollup is written once for the whole batch of stream records
+    pair_changes = group_changes(event["Records"])
+    daily_changes = defaultdict(list)
+    for (user_chat_id, _, day), changes in pair_changes.items():
+        daily_changes[(user_chat_id, day)].extend(changes)
+
+    with ThreadPoolExecutor(max_workers=WRITE_CONCURRENCY) as executor:
+        futures = [
+            executor.submit(add_to_rollup, dynamodb_operations.add_to_pair_rollup, *pair_key, changes)
+            for pair_key, changes in pair_changes.items()
+        ] + [
+            executor.submit(add_to_rollup, dynamodb_operations.add_to_daily_rollup, *daily_key, sorted(changes))
+            for daily_key, changes in daily_changes.items()
+        ]
+        failed_sequence_numbers = [future.result() for future in futures if future.result()]
+
+    logger.info(
+        {
+            "stream_records": len(event["Records"]),
+            "pair_rollups": len(pair_changes),
+            "daily_rollups": len(daily_changes),
+            "failed_rollups": len(failed_sequence_numbers),
+        }
+    )
+    # The stream is retried from the earliest failed change, rollups skip the changes, which they have already
+    if failed_sequence_numbers:
+        return {"batchItemFailures": [{"itemIdentifier": min(failed_sequence_numbers).lstrip("0")}]}
+    return {"batchItemFailures": []}
@@ -1,29 +1,40 @@
+import json
 import os
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from aws_lambda_powertools import Logger
-from boto3 import resource
-from telegram import Bot
 
-from aws.dynamodb import list_translation_pairs
+from aws.dynamodb import iter_translation_pairs
+from clients import get_bot, get_client
 from decorators import handle_errors
 from aws import dynamodb as dynamodb_operations
-from exceptions import GptResponseFormatError
-from gpt import suggest_new_pairs, OPENAI_API_KEY
+from gpt import suggest_new_pairs, suggest_new_pairs_for_users, CONTEXT_FIELDS, OPENAI_API_KEY
+from pairset import PairSet
+from rate_limit import TokenBucket
 
 logger = Logger()
-table = resource("dynamodb").Table(os.getenv("TABLE_NAME"))
-
-bot = Bot(token=os.getenv("TELEGRAM_TOKEN"))
 
 SUGGESTION_TEXT = (
     "Привіт. У мене є кілька нових слів для тебе.\n"
     "Можеш вибрати ті, які хотілось би вивчити, і я додам їх до твого словнику."
 )
+USERS_PAGE_SIZE = 50
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "8"))
+GPT_CONCURRENCY = int(os.getenv("GPT_CONCURRENCY", "4"))
+GPT_REQUESTS_PER_MINUTE = int(os.getenv("GPT_REQUESTS_PER_MINUTE", "60"))
+# More than one user in a single GPT request saves requests, but makes the answers less reliable
+USERS_PER_GPT_REQUEST = int(os.getenv("USERS_PER_GPT_REQUEST", "1"))
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "8"))
+# Continue in a new invocation, when there is not enough time left to process one more page of users
+RESUME_MARGIN_MS = 3 * 60 * 1000
+# Telegram doesn't send polls with fewer options
+MIN_POLL_OPTIONS = 2
+
+gpt_limiter = TokenBucket(rate=GPT_REQUESTS_PER_MINUTE / 60, capacity=GPT_CONCURRENCY)
 
 
 def send_suggestion(user_chat_id, new_translations):
-    poll_id = bot.sendPoll(
+    poll_id = get_bot().sendPoll(
         chat_id=user_chat_id,
         question=SUGGESTION_TEXT,
         options=[f"{word} - {translation}" for word, translation in new_translations],
@@ -32,29 +43,83 @@ def send_suggestion(user_chat_id, new_translations):
     dynamodb_operations.create_suggestion(user_chat_id, poll_id, new_translations)
 
 
-def generate_and_send_suggestion(user_chat_id, existing_pairs):
+def load_vocabulary(user):
+    user_chat_id = str(user["user_chat_id"])
+    # The whole vocabulary is read, as suggestions are checked against it, but only a part of it goes to the prompt.
+    # Pages are packed into columns as they come, so items of the whole vocabulary are never held at once.
+    return user_chat_id, PairSet.from_items(iter_translation_pairs(user_chat_id, projection=CONTEXT_FIELDS))
+
+
+def generate_suggestions(existing_pairs_by_user) -> dict:
+    gpt_limiter.acquire()
     try:
-        new_translations = suggest_new_pairs(existing_pairs)
-    except GptResponseFormatError:
-        logger.exception("GPT response format error")
+        if len(existing_pairs_by_user) == 1:
+            [(user_chat_id, existing_pairs)] = existing_pairs_by_user.items()
+            return {user_chat_id: suggest_new_pairs(existing_pairs)}
+        return suggest_new_pairs_for_users(existing_pairs_by_user)
+    except Exception:
+        # GptResponseFormatError after all retries or an OpenAI API error, other users still get suggestions
+        logger.exception(f"Failed to generate suggestions for users {list(existing_pairs_by_user)}")
+        return {}
+
+
+def send_suggestion_safely(user_chat_id, new_translations):
+    if len(new_translations) < MIN_POLL_OPTIONS:
+        # All but one of the generated pairs can be known already, the user gets suggestions next time
+        logger.info({"user_chat_id": user_chat_id, "skipped_new_translations": new_translations})
         return
     logger.info({"user_chat_id": user_chat_id, "new_translations": new_translations})
-    send_suggestion(user_chat_id, new_translations)
+    try:
+        send_suggestion(user_chat_id, new_translations)
+    except Exception:
+        logger.exception(f"Failed to send suggestion to user {user_chat_id}")
+
+
+def process_users_page(users, prefetch_executor, gpt_executor, send_executor):
+    # Vocabularies are read concurrently, then GPT requests are sent in bounded parallel,
+    # and every suggestion is sent as soon as its request is completed
+    existing_pairs_by_user = {
+        user_chat_id: existing_pairs
+        for user_chat_id, existing_pairs in prefetch_executor.map(load_vocabulary, users)
+        if existing_pairs
+    }
+    users_pairs = list(existing_pairs_by_user.items())
+    gpt_futures = [
+        gpt_executor.submit(generate_suggestions, dict(users_pairs[i : i + USERS_PER_GPT_REQUEST]))
+        for i in range(0, len(users_pairs), USERS_PER_GPT_REQUEST)
+    ]
+    send_futures = [
+        send_executor.submit(send_suggestion_safely, user_chat_id, new_translations)
+        for gpt_future in as_completed(gpt_futures)
+        for user_chat_id, new_translations in gpt_future.result().items()
+        if new_translations
+    ]
+    for send_future in send_futures:
+        send_future.result()
+
+
+def resume_later(cursor, context):
+    get_client("lambda").invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps({"cursor": cursor}),
+    )
 
 
 @handle_errors
-def handler(_, __):
+def handler(event, context):
     if not OPENAI_API_KEY:
         logger.error("OPENAI_API_KEY is not set")
         return
 
-    with ThreadPoolExecutor() as executor:
-        for user in dynamodb_operations.list_users():
-            user_chat_id = str(user["user_chat_id"])
-            logger.info("Making Suggestion for user ", user_chat_id)
-            if not (existing_pairs := list_translation_pairs(user_chat_id)):
-                logger.info("No existing pairs for user ", user_chat_id)
-                continue
-            executor.submit(generate_and_send_suggestion, user_chat_id, existing_pairs)
+    with ThreadPoolExecutor(max_workers=PREFETCH_CONCURRENCY) as prefetch_executor, ThreadPoolExecutor(
+        max_workers=GPT_CONCURRENCY
+    ) as gpt_executor, ThreadPoolExecutor(max_workers=SEND_CONCURRENCY) as send_executor:
+        for users, cursor in dynamodb_operations.iter_user_pages(event.get("cursor"), USERS_PAGE_SIZE):
+            process_users_page(users, prefetch_executor, gpt_executor, send_executor)
+            if cursor and context.get_remaining_time_in_millis() < RESUME_MARGIN_MS:
+                logger.info({"resumed_from": cursor})
+                resume_later(cursor, context)
+                return
 
     return
@@ -0,0 +1,69 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+from tempfile import SpooledTemporaryFile
+
+from aws_lambda_powertools import Logger
+
+from aws import dynamodb as dynamodb_operations
+from decorators import handle_errors
+from tg import send_document, send_message
+
+logger = Logger()
+
+EXPORT_FIELDS = ("english_text", "native_text", "polls_count", "correct_answers", "wrong_answers", "created_at")
+COUNTER_FIELDS = ("polls_count", "correct_answers", "wrong_answers")
+EXPORT_FORMATS = ("csv", "jsonl")
+# The compressed file is kept in memory up to this size, and in /tmp beyond it
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+def to_export_row(pair) -> dict:
+    return {
+        **{field: pair.get(field, "") for field in EXPORT_FIELDS},
+        # Numbers come from DynamoDB as Decimal
+        **{field: int(pair.get(field, 0)) for field in COUNTER_FIELDS},
+    }
+
+
+def write_export(pairs, fileobj, export_format) -> int:
+    # Pairs are written one by one as the pages are read, so only one page is held in memory
+    pairs_count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as compressed_file, io.TextIOWrapper(
+        compressed_file, encoding="utf-8", newline=""
+    ) as text_file:
+        writer = csv.DictWriter(text_file, fieldnames=EXPORT_FIELDS)
+        if export_format == "csv":
+            writer.writeheader()
+        for pair in pairs:
+            if export_format == "csv":
+                writer.writerow(to_export_row(pair))
+            else:
+                text_file.write(json.dumps(to_export_row(pair), ensure_ascii=False) + "\n")
+            pairs_count += 1
+    return pairs_count
+
+
+@handle_errors
+def handler(event, _):
+    user_chat_id = event["user_chat_id"]
+    export_format = event.get("format") if event.get("format") in EXPORT_FORMATS else EXPORT_FORMATS[0]
+    with SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as export_file:
+        pairs_count = write_export(
+            dynamodb_operations.iter_translation_pairs(user_chat_id, projection=EXPORT_FIELDS),
+            export_file,
+            export_format,
+        )
+        if not pairs_count:
+            send_message(user_chat_id, text=r"Твій словник порожній. Додай фрази/слова за допомогою /add\_pair")
+            return
+        export_file.seek(0)
+        send_document(
+            user_chat_id,
+            export_file,
+            filename=f"vocabulary-{datetime.now(timezone.utc):%Y-%m-%d}.{export_format}.gz",
+            caption=f"Фраз/слів у словнику: {pairs_count}",
+        )
+    logger.info({"user_chat_id": user_chat_id, "exported_pairs": pairs_count, "format": export_format})
@@ -0,0 +1,114 @@
+import csv
+import gzip
+import io
+import itertools
+import os
+from collections import Counter
+
+from aws_lambda_powertools import Logger
+
+from aws import dynamodb as dynamodb_operations
+from aws.translate import normalize_text, translate_text, translate_texts
+from clients import get_bot
+from decorators import handle_errors
+from tg import send_message
+
+logger = Logger()
+
+MAX_IMPORTED_PAIRS = int(os.getenv("MAX_IMPORTED_PAIRS", "50000"))
+# Rows are translated and written by batches, so memory doesn't grow with the file
+ROWS_PER_BATCH = 500
+WRITE_CONCURRENCY = int(os.getenv("WRITE_CONCURRENCY", "4"))
+# Longer texts are not phrases to learn, and they would make pair keys too long
+MAX_TEXT_LENGTH = 200
+HEADER_NAMES = {"english", "english_text", "en", "word", "phrase"}
+
+
+def download_document(file_id):
+    document = io.BytesIO()
+    get_bot().get_file(file_id).download(out=document)
+    document.seek(0)
+    # Files made by /export are gzip compressed
+    if document.getbuffer()[:2] == b"\x1f\x8b":
+        return gzip.GzipFile(fileobj=document)
+    return document
+
+
+def iter_rows(document):
+    # TSV or CSV with "english,translation" rows, the delimiter is guessed by the first line
+    lines = io.TextIOWrapper(document, encoding="utf-8-sig", errors="replace", newline="")
+    first_line = lines.readline()
+    delimiter = "\t" if "\t" in first_line else ";" if ";" in first_line and "," not in first_line else ","
+    for row_number, row in enumerate(csv.reader(itertools.chain([first_line], lines), delimiter=delimiter)):
+        if row_number == 0 and row and row[0].strip().lower() in HEADER_NAMES:
+            continue
+        yield row
+
+
+def clean_text(text) -> str:
+    # The same cleaning as for pairs added one by one, markdown characters would break the messages
+    return " ".join(text.replace("*", "").replace("_", "").replace("`", "").split())
+
+
+def iter_new_pairs(rows, known_texts, report):
+    # (english_text, native_text or None), pairs already in the vocabulary or in the file are skipped
+    for row in rows:
+        english_text = clean_text(row[0]) if row else ""
+        native_text = clean_text(row[1]) if len(row) > 1 else ""
+        if not english_text or len(english_text) > MAX_TEXT_LENGTH or len(native_text) > MAX_TEXT_LENGTH:
+            report["invalid"] += bool(english_text or native_text)
+            continue
+        if english_text.lower() in known_texts:
+            report["known"] += 1
+            continue
+        if report["read"] >= MAX_IMPORTED_PAIRS:
+            report["over_limit"] += 1
+            continue
+        known_texts.add(english_text.lower())
+        report["read"] += 1
+        yield english_text, native_text or None
+
+
+def translate_missing(pairs, report) -> list:
+    missing_texts = [english_text for english_text, native_text in pairs if not native_text]
+    translations = translate_texts(missing_texts) if missing_texts else {}
+    report["translated"] += len(missing_texts)
+    return [
+        (
+            english_text,
+            native_text or translations.get(normalize_text(english_text)) or translate_text(english_text),
+        )
+        for english_text, native_text in pairs
+    ]
+
+
+def format_report(report) -> str:
+    lines = [f"Імпорт завершено. Додано нових фраз/слів: {report['imported']}"]
+    if report["translated"]:
+        lines.append(f"Перекладено автоматично: {report['translated']}")
+    if report["known"]:
+        lines.append(f"Вже були у словнику: {report['known']}")
+    if report["invalid"]:
+        lines.append(f"Пропущено некоректних рядків: {report['invalid']}")
+    if report["over_limit"]:
+        lines.append(f"Не додано через ліміт у {MAX_IMPORTED_PAIRS} фраз/слів за раз: {report['over_limit']}")
+    if failed_count := report["read"] - report["imported"]:
+        lines.append(f"Не вдалося записати: {failed_count}. Спробуй імпортувати файл ще раз пізніше")
+    return "\n".join(lines)
+
+
+@handle_errors
+def handler(event, _):
+    user_chat_id = event["user_chat_id"]
+    report = Counter()
+    known_texts = {
+        pair["english_text"].strip().lower()
+        for pair in dynamodb_operations.iter_translation_pairs(user_chat_id, projection=("english_text",))
+    }
+    new_pairs = iter_new_pairs(iter_rows(download_document(event["file_id"])), known_texts, report)
+    while pairs := list(itertools.islice(new_pairs, ROWS_PER_BATCH)):
+        report["imported"] += dynamodb_operations.import_translation_pairs(
+            user_chat_id, translate_missing(pairs, report), max_workers=WRITE_CONCURRENCY
+        )
+    logger.info({"user_chat_id": user_chat_id, "import_report": dict(report)})
+    send_message(user_chat_id, text=format_report(report), disable_markdown=True)
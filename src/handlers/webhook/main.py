@@ -0,0 +1,32 @@
+import json
+import os
+from http import HTTPStatus
+
+from clients import get_client
+
+UPDATES_QUEUE_URL = os.getenv("UPDATES_QUEUE_URL")
+
+
+def get_update_group_id(update) -> str:
+    # Updates of one chat are processed in order. Quiz answers don't have a chat, so they are grouped by poll.
+    if message := update.get("message") or update.get("edited_message"):
+        return str(message["chat"]["id"])
+    if callback_query := update.get("callback_query"):
+        # Ids of the user and of the private chat with them are the same
+        return str(callback_query["from"]["id"])
+    if poll := update.get("poll"):
+        return f"POLL#{poll['id']}"
+    return f"UPDATE#{update['update_id']}"
+
+
+def handler(event, _):
+    # Telegram only waits for the update to be queued, it is processed by the batch handler of messages
+    update = json.loads(event["body"])
+    get_client("sqs").send_message(
+        QueueUrl=UPDATES_QUEUE_URL,
+        MessageBody=event["body"],
+        MessageGroupId=get_update_group_id(update),
+        # Telegram redelivers an update with the same id, when the webhook didn't answer in time
+        MessageDeduplicationId=str(update["update_id"]),
+    )
+    return {"statusCode": HTTPStatus.OK}
@@ -1,86 +1,565 @@
 import datetime
+import gzip
+import json
 import os
+import queue
+import re
+import threading
 import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import islice
 
-from boto3 import resource
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Attr, ConditionExpressionBuilder, Key
 
+from clients import get_table
+from distractors import get_pool_slots
 from exceptions import ProcessMessageError
+from helpers import format_timestamp
 
-table = resource("dynamodb").Table(os.getenv("TABLE_NAME"))
+# Users and their polling schedule are spread over that many gsi1 and gsi2 partitions,
+# so their writes don't go to a single hot partition. Reads query all of them.
+USER_SHARDS = int(os.getenv("USER_SHARDS", "8"))
+# Keys of the single partition layout are read as well, till scripts/shard_user_keys.py moves the items
+READ_LEGACY_USER_KEYS = os.getenv("READ_LEGACY_USER_KEYS", "true") == "true"
+LEGACY_USERS_KEY = "USER"
+LEGACY_POLLING_SCHEDULE_KEY = "POLLING_SCHEDULE"
+SCATTER_GATHER_CONCURRENCY = 8
+# Counters of translation pairs, which are rolled up by days from the table stream
+ROLLUP_COUNTERS = ("polls_count", "correct_answers", "wrong_answers")
+ROLLUP_TTL = int(os.getenv("ROLLUP_TTL", str(400 * 24 * 60 * 60)))
+ACTION_EXISTS_MESSAGE = "Please, finish current operation or cancel it (/cancel)"
+NO_ACTION_MESSAGE = "Наразі нема жодної активної операції"
+NO_USER_MESSAGE = "Please, start the bot first (/start)"
+# Keeps an archive record far below the 400 KB item size limit even without compression
+DELETED_PAIRS_PER_ARCHIVE = 200
+# Deleted by one batch writer, 4 BatchWriteItem requests
+DELETE_CHUNK_SIZE = 100
+MAX_TRANSACTION_ITEMS = 100
+# Limit of one BatchWriteItem request
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_ATTEMPTS = 6
+BATCH_WRITE_BACKOFF = 0.05
+# Unanswered polls and suggestions are deleted by the TTL of the table after that many seconds
+POLL_TTL = int(os.getenv("POLL_TTL", str(7 * 24 * 60 * 60)))
+SUGGESTION_TTL = int(os.getenv("SUGGESTION_TTL", str(7 * 24 * 60 * 60)))
+READ_OPERATIONS = {"GetItem", "BatchGetItem", "Query", "Scan", "DescribeTable"}
 
 
-def create_current_action(user_chat_id, action_type, **kwargs):
-    if get_current_action(user_chat_id):
-        raise ProcessMessageError(message="Please, finish current operation or cancel it (/cancel)")
-    table.put_item(
-        Item={
-            "pk": f"USER#{user_chat_id}",
-            "sk": "CURRENT_ACTION",
-            "user_chat_id": user_chat_id,
-            "action_type": action_type,
-            **kwargs,
-        }
+class UnitOfWork:
+    # Lives for one invocation: items read by key are fetched once, and writes, whose results are not needed
+    # by the handler, are sent together in the end. Threads started by the handler don't share it.
+    def __init__(self):
+        self.items = {}
+        self.pending_writes = []
+        # Write groups, which were lost because of an error of their own transaction
+        self.failed_writes = []
+        self.requests = Counter()
+
+
+_current_unit_of_work = ContextVar("unit_of_work", default=None)
+
+
+def _count_request(event_name, **_):
+    if current_unit_of_work := _current_unit_of_work.get():
+        operation = event_name.rsplit(".", 1)[-1]
+        current_unit_of_work.requests[operation] += 1
+        if operation not in READ_OPERATIONS:
+            # Any of the items read before could be changed by the write
+            current_unit_of_work.items.clear()
+
+
+@contextmanager
+def unit_of_work():
+    if _current_unit_of_work.get():
+        # Nested units, e.g. single updates of a batch, are parts of the outer one
+        yield None
+        return
+    get_table().meta.client.meta.events.register("before-call.dynamodb", _count_request, unique_id="unit-of-work")
+    current_unit_of_work = UnitOfWork()
+    token = _current_unit_of_work.set(current_unit_of_work)
+    try:
+        yield current_unit_of_work
+    finally:
+        try:
+            # Sent even when the handler failed, like they would be without buffering
+            flush()
+        finally:
+            _current_unit_of_work.reset(token)
+
+
+def _transact_item_key(transact_item):
+    [request] = transact_item.values()
+    key = request.get("Key") or request["Item"]
+    return key["pk"], key["sk"]
+
+
+def flush():
+    current_unit_of_work = _current_unit_of_work.get()
+    if not current_unit_of_work:
+        return
+    write_groups, current_unit_of_work.pending_writes = current_unit_of_work.pending_writes, []
+    # A transaction fails as a whole on other errors, so its groups are written one per transaction then,
+    # and only the groups, which fail on their own, are lost. The first error is raised after the rest is written.
+    errors, single_groups_count = [], 0
+    while write_groups:
+        # A transaction can't have more than one write to the same item
+        transaction_groups, written_keys = [], set()
+        while write_groups:
+            group_keys = {_transact_item_key(transact_item) for transact_item in write_groups[0]}
+            items_count = sum(map(len, transaction_groups)) + len(write_groups[0])
+            if transaction_groups and (
+                single_groups_count or items_count > MAX_TRANSACTION_ITEMS or group_keys & written_keys
+            ):
+                break
+            written_keys |= group_keys
+            transaction_groups.append(write_groups.pop(0))
+        single_groups_count = max(single_groups_count - 1, 0)
+        # Groups, whose conditions failed, are dropped, as they would fail on their own as well
+        while transaction_groups:
+            transact_items = [transact_item for group in transaction_groups for transact_item in group]
+            group_indexes = [index for index, group in enumerate(transaction_groups) for _ in group]
+            try:
+                failed_indexes = _transact_write(*transact_items)
+            except Exception as e:
+                if len(transaction_groups) > 1:
+                    write_groups[:0] = transaction_groups
+                    single_groups_count = len(transaction_groups)
+                else:
+                    current_unit_of_work.failed_writes.extend(transaction_groups)
+                    errors.append(e)
+                break
+            if not failed_indexes:
+                break
+            failed_groups = {group_indexes[index] for index in failed_indexes}
+            transaction_groups = [group for index, group in enumerate(transaction_groups) if index not in failed_groups]
+    if errors:
+        raise errors[0]
+
+
+def _write_later(*transact_items):
+    # The items are written atomically, but not before the end of the unit of work
+    if current_unit_of_work := _current_unit_of_work.get():
+        current_unit_of_work.pending_writes.append(list(transact_items))
+    else:
+        _transact_write(*transact_items)
+
+
+def _get_item(key):
+    current_unit_of_work = _current_unit_of_work.get()
+    if not current_unit_of_work:
+        return get_table().get_item(Key=key).get("Item")
+    identity = (key["pk"], key["sk"])
+    if identity not in current_unit_of_work.items:
+        current_unit_of_work.items[identity] = get_table().get_item(Key=key).get("Item")
+    return current_unit_of_work.items[identity]
+
+
+def update_expression_kwargs(set_values=None, set_if_not_exists=None, add_values=None, remove=()):
+    names, values = {}, {}
+    set_clauses, add_clauses, remove_clauses = [], [], []
+    for attribute, value in (set_values or {}).items():
+        names[f"#{attribute}"], values[f":{attribute}"] = attribute, value
+        set_clauses.append(f"#{attribute} = :{attribute}")
+    for attribute, value in (set_if_not_exists or {}).items():
+        names[f"#{attribute}"], values[f":{attribute}"] = attribute, value
+        set_clauses.append(f"#{attribute} = if_not_exists(#{attribute}, :{attribute})")
+    for attribute, value in (add_values or {}).items():
+        names[f"#{attribute}"], values[f":{attribute}"] = attribute, value
+        add_clauses.append(f"#{attribute} :{attribute}")
+    for attribute in remove:
+        names[f"#{attribute}"] = attribute
+        remove_clauses.append(f"#{attribute}")
+
+    update_expression = " ".join(
+        f"{action} {', '.join(clauses)}"
+        for action, clauses in (("SET", set_clauses), ("ADD", add_clauses), ("REMOVE", remove_clauses))
+        if clauses
     )
+    update_kwargs = {"UpdateExpression": update_expression, "ExpressionAttributeNames": names}
+    if values:
+        update_kwargs["ExpressionAttributeValues"] = values
+    return update_kwargs
+
+
+def condition_kwargs(condition, update_kwargs=None) -> dict:
+    # boto3 converts condition objects only at the top level of a call, not in items of a transaction,
+    # so the expression is built here. Its placeholders get the "condition_" prefix, so they don't clash
+    # with the ones of update_expression_kwargs, which are the names of the attributes.
+    expression = ConditionExpressionBuilder().build_expression(condition)
+
+    def prefixed(placeholder):
+        return f"{placeholder[0]}condition_{placeholder[1:]}"
+
+    names = {**(update_kwargs or {}).get("ExpressionAttributeNames", {})}
+    names.update((prefixed(name), value) for name, value in expression.attribute_name_placeholders.items())
+    values = {**(update_kwargs or {}).get("ExpressionAttributeValues", {})}
+    values.update((prefixed(name), value) for name, value in expression.attribute_value_placeholders.items())
+    kwargs = {
+        **(update_kwargs or {}),
+        "ConditionExpression": re.sub(
+            r"[#:][nv]\d+", lambda match: prefixed(match.group()), expression.condition_expression
+        ),
+        "ExpressionAttributeNames": names,
+    }
+    if values:
+        kwargs["ExpressionAttributeValues"] = values
+    return kwargs
+
+
+def _projection_kwargs(projection):
+    if not projection:
+        return {}
+    return {
+        "ProjectionExpression": ", ".join(f"#{attribute}" for attribute in projection),
+        "ExpressionAttributeNames": {f"#{attribute}": attribute for attribute in projection},
+    }
+
+
+def paginate(operation, **kwargs):
+    # Follows LastEvaluatedKey, so results are not cut off at 1 MB per request
+    while True:
+        response = operation(**kwargs)
+        yield response
+        if not (last_evaluated_key := response.get("LastEvaluatedKey")):
+            return
+        kwargs["ExclusiveStartKey"] = last_evaluated_key
+
+
+def iter_items(operation, limit=None, **kwargs):
+    if limit:
+        # Don't read more items from DynamoDB than will be consumed
+        kwargs["Limit"] = limit
+    items = (item for response in paginate(operation, **kwargs) for item in response["Items"])
+    return islice(items, limit) if limit else items
+
+
+def _transact_write(*transact_items) -> list:
+    # Returns indexes of the items, whose conditions failed. Nothing is written then.
+    client = get_table().meta.client
+    try:
+        client.transact_write_items(TransactItems=list(transact_items))
+    except client.exceptions.TransactionCanceledException as e:
+        failed_indexes = [
+            index
+            for index, reason in enumerate(e.response.get("CancellationReasons", []))
+            if reason.get("Code") == "ConditionalCheckFailed"
+        ]
+        if not failed_indexes:
+            raise
+        return failed_indexes
+    return []
+
+
+def _current_action_key(user_chat_id):
+    return {"pk": f"USER#{user_chat_id}", "sk": "CURRENT_ACTION"}
+
+
+def _finish_current_action(user_chat_id, action_type):
+    # A transition is valid only from the action, which the user is still in
+    return {
+        "Delete": {
+            "TableName": get_table().name,
+            "Key": _current_action_key(user_chat_id),
+            **condition_kwargs(Attr("action_type").eq(action_type)),
+        }
+    }
+
+
+def _update_user_stats(user_chat_id, create=False, **counters):
+    # Totals of the user are kept up to date by the same transactions, which change the pairs.
+    # They fail rather than recreate the totals of a purged user. Only the transactions, which add pairs,
+    # create the totals, as they check, that the user exists, by _bump_pairs_version.
+    update_kwargs = update_expression_kwargs(add_values=counters)
+    return {
+        "Update": {
+            "TableName": get_table().name,
+            "Key": {"pk": f"USER#{user_chat_id}", "sk": "STATS"},
+            **(update_kwargs if create else condition_kwargs(Attr("pk").exists(), update_kwargs)),
+        }
+    }
+
+
+def _bump_pairs_version(user_chat_id):
+    # Tells warm containers, that the cached due pairs and distractors of the user are stale
+    return {
+        "Update": {
+            "TableName": get_table().name,
+            "Key": {"pk": f"USER#{user_chat_id}", "sk": f"USER#{user_chat_id}"},
+            **condition_kwargs(Attr("pk").exists(), update_expression_kwargs(add_values={"pairs_version": 1})),
+        }
+    }
+
+
+def create_current_action(user_chat_id, action_type, **kwargs):
+    try:
+        get_table().put_item(
+            Item={
+                **_current_action_key(user_chat_id),
+                "user_chat_id": user_chat_id,
+                "action_type": action_type,
+                **kwargs,
+            },
+            ConditionExpression=Attr("pk").not_exists(),
+        )
+    except get_table().meta.client.exceptions.ConditionalCheckFailedException:
+        raise ProcessMessageError(message=ACTION_EXISTS_MESSAGE)
 
 
 def update_current_action(user_chat_id, **kwargs):
-    table.update_item(
-        Key={"pk": f"USER#{user_chat_id}", "sk": "CURRENT_ACTION"},
-        AttributeUpdates={k: {"Value": v, "Action": "PUT"} for k, v in kwargs.items()},
-    )
+    try:
+        get_table().update_item(
+            Key=_current_action_key(user_chat_id),
+            ConditionExpression=Attr("pk").exists(),
+            **update_expression_kwargs(set_values=kwargs),
+        )
+    except get_table().meta.client.exceptions.ConditionalCheckFailedException:
+        raise ProcessMessageError(message=NO_ACTION_MESSAGE)
 
 
 def get_current_action(user_chat_id):
-    return table.get_item(Key=({"pk": f"USER#{user_chat_id}", "sk": "CURRENT_ACTION"})).get("Item")
+    return _get_item(_current_action_key(user_chat_id))
 
 
 def delete_current_action(user_chat_id):
-    return table.delete_item(Key={"pk": f"USER#{user_chat_id}", "sk": "CURRENT_ACTION"}, ReturnValues="ALL_OLD").get(
-        "Attributes"
+    return get_table().delete_item(Key=_current_action_key(user_chat_id), ReturnValues="ALL_OLD").get("Attributes")
+
+
+def finish_current_action(user_chat_id, action_type) -> bool:
+    try:
+        get_table().delete_item(
+            Key=_current_action_key(user_chat_id), ConditionExpression=Attr("action_type").eq(action_type)
+        )
+    except get_table().meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def _translation_pair_item(user_chat_id, english_text, native_text, created_at, due_at):
+    return {
+        "pk": f"USER#{user_chat_id}",
+        "sk": f"TRANSLATION_PAIR#{english_text}",
+        "user_chat_id": user_chat_id,
+        "english_text": english_text,
+        "native_text": native_text,
+        "polls_count": 0,
+        "gsi1pk": f"USER#{user_chat_id}",
+        "gsi1sk": f"TRANSLATION_PAIR#{created_at}",
+        "gsi2pk": f"USER#{user_chat_id}",
+        "gsi2sk": f"TRANSLATION_PAIR#{due_at}",
+        "created_at": created_at,
+        "due_at": due_at,
+        "active": True,
+    }
+
+
+def create_translation_pair(user_chat_id, english_text, native_text, current_action_type=None) -> bool:
+    # Returns False for a pair, which is in the vocabulary already
+    created_at = datetime.datetime.now().isoformat()
+    due_at = format_timestamp(datetime.datetime.now(datetime.timezone.utc))
+    transact_items = [
+        {
+            "Put": {
+                "TableName": get_table().name,
+                "Item": _translation_pair_item(user_chat_id, english_text, native_text, created_at, due_at),
+                # A deleted pair can be added again
+                **condition_kwargs(Attr("pk").not_exists() | Attr("active").eq(False)),
+            }
+        },
+        {
+            "Update": {
+                "TableName": get_table().name,
+                "Key": {"pk": f"USER#{user_chat_id}", "sk": "DISTRACTORS"},
+                **update_expression_kwargs(
+                    set_values=get_pool_slots({"english_text": english_text, "native_text": native_text})
+                ),
+            }
+        },
+    ]
+    if current_action_type:
+        transact_items.append(_finish_current_action(user_chat_id, current_action_type))
+    failed_indexes = _transact_write(
+        *transact_items,
+        _update_user_stats(user_chat_id, create=True, pairs_count=1),
+        _bump_pairs_version(user_chat_id),
     )
+    if 0 in failed_indexes:
+        return False
+    if current_action_type and len(transact_items) - 1 in failed_indexes:
+        raise ProcessMessageError(message=NO_ACTION_MESSAGE)
+    # Otherwise the user is purged, so there is no vocabulary to add the pair to
+    return True
 
 
-def create_translation_pair(user_chat_id, english_text, native_text):
-    table.put_item(
-        Item={
-            "pk": f"USER#{user_chat_id}",
-            "sk": f"TRANSLATION_PAIR#{english_text}",
-            "user_chat_id": user_chat_id,
-            "english_text": english_text,
-            "native_text": native_text,
-            "polls_count": 0,
-            "gsi1pk": "TRANSLATION_PAIR",
-            "created_at": datetime.datetime.now().isoformat(),
-            "active": True,
-        }
+def _batch_write(put_items) -> list:
+    # Unprocessed items are retried with an exponential backoff, returns keys of the items left unwritten
+    write_requests = [{"PutRequest": {"Item": item}} for item in put_items]
+    for attempt in range(BATCH_WRITE_ATTEMPTS):
+        if attempt:
+            time.sleep(BATCH_WRITE_BACKOFF * 2**attempt)
+        response = get_table().meta.client.batch_write_item(RequestItems={get_table().name: write_requests})
+        if not (write_requests := response.get("UnprocessedItems", {}).get(get_table().name)):
+            return []
+    return [(request["PutRequest"]["Item"]["pk"], request["PutRequest"]["Item"]["sk"]) for request in write_requests]
+
+
+def import_translation_pairs(user_chat_id, pairs, max_workers=4) -> int:
+    # New pairs are written by parallel BatchWriteItem requests, which can't have conditions,
+    # so the pairs are expected to be checked against the vocabulary beforehand.
+    # Returns the number of written pairs, the totals and the distractors pool are updated for them.
+    now = datetime.datetime.now()
+    due_at = format_timestamp(now.astimezone(datetime.timezone.utc))
+    items = [
+        _translation_pair_item(
+            user_chat_id,
+            english_text,
+            native_text,
+            # Unique creation times keep the order of the imported pairs in the vocabulary listing
+            (now + datetime.timedelta(microseconds=index)).isoformat(timespec="microseconds"),
+            due_at,
+        )
+        for index, (english_text, native_text) in enumerate(pairs)
+    ]
+    chunks = [items[i : i + BATCH_WRITE_SIZE] for i in range(0, len(items), BATCH_WRITE_SIZE)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        unwritten_keys = {key for keys in executor.map(_batch_write, chunks) for key in keys}
+
+    written_items = [item for item in items if (item["pk"], item["sk"]) not in unwritten_keys]
+    if written_items:
+        pool_slots = {}
+        for item in written_items:
+            pool_slots.update(get_pool_slots(item))
+        _transact_write(
+            {
+                "Update": {
+                    "TableName": get_table().name,
+                    "Key": {"pk": f"USER#{user_chat_id}", "sk": "DISTRACTORS"},
+                    **update_expression_kwargs(set_values=pool_slots),
+                }
+            },
+            _update_user_stats(user_chat_id, create=True, pairs_count=len(written_items)),
+            _bump_pairs_version(user_chat_id),
+        )
+    return len(written_items)
+
+
+def add_distractors(user_chat_id, pool_slots):
+    get_table().update_item(
+        Key={"pk": f"USER#{user_chat_id}", "sk": "DISTRACTORS"},
+        **update_expression_kwargs(set_values=pool_slots),
     )
-    delete_current_action(user_chat_id)
+
+
+def get_distractors(user_chat_id):
+    return _get_item({"pk": f"USER#{user_chat_id}", "sk": "DISTRACTORS"}) or {}
 
 
 def increment_translation_pair_fields(user_chat_id, english_text, **kwargs):
-    table.update_item(
-        Key={"pk": f"USER#{user_chat_id}", "sk": f"TRANSLATION_PAIR#{english_text}"},
-        AttributeUpdates={k: {"Value": v, "Action": "ADD"} for k, v in kwargs.items()},
+    _write_later(
+        {
+            "Update": {
+                "TableName": get_table().name,
+                "Key": {"pk": f"USER#{user_chat_id}", "sk": f"TRANSLATION_PAIR#{english_text}"},
+                **condition_kwargs(Attr("pk").exists(), update_expression_kwargs(add_values=kwargs)),
+            }
+        },
+        _update_user_stats(user_chat_id, **kwargs),
     )
 
 
-def create_poll(user_chat_id, poll_id, english_text):
-    table.put_item(
-        Item={
-            "pk": f"POLL#{poll_id}",
-            "sk": f"POLL#{poll_id}",
-            "user_chat_id": user_chat_id,
-            "gsi1pk": f"USER#{user_chat_id}",
-            "gsi1sk": f"POLL#{poll_id}",
-            "answered": False,
-            "english_text": english_text,
+def _review_update_kwargs(user_chat_id, english_text, review, counters):
+    set_values = {**review, "gsi2sk": f"TRANSLATION_PAIR#{review['due_at']}"} if review else {}
+    return {
+        "Key": {"pk": f"USER#{user_chat_id}", "sk": f"TRANSLATION_PAIR#{english_text}"},
+        # The pair could have been deleted together with the user while the answer was on its way
+        **condition_kwargs(Attr("pk").exists(), update_expression_kwargs(set_values=set_values, add_values=counters)),
+    }
+
+
+def review_translation_pair(user_chat_id, english_text, review=None, **kwargs):
+    review_item = {
+        "Update": {"TableName": get_table().name, **_review_update_kwargs(user_chat_id, english_text, review, kwargs)}
+    }
+    transact_items = [review_item, _update_user_stats(user_chat_id, **kwargs)]
+    if review:
+        # A review moves the pair in the due index, while the counters alone are not cached
+        transact_items.append(_bump_pairs_version(user_chat_id))
+    _write_later(*transact_items)
+
+
+def postpone_translation_pair(user_chat_id, english_text, postponement, **kwargs):
+    # Unlike a review, it doesn't bump pairs_version, the poller drops the postponed pair from its cache itself
+    postpone_item = {
+        "Update": {
+            "TableName": get_table().name,
+            **_review_update_kwargs(user_chat_id, english_text, postponement, kwargs),
+        }
+    }
+    _write_later(postpone_item, _update_user_stats(user_chat_id, **kwargs))
+
+
+def answer_open_question(user_chat_id, english_text, review=None, translation_tip_length=None, **kwargs) -> bool:
+    # A correct answer finishes the question, a wrong one only makes the tip longer.
+    # Returns False for an answer to a question, which is already finished, e.g. a redelivered update.
+    if translation_tip_length:
+        action_item = {
+            "Update": {
+                "TableName": get_table().name,
+                "Key": _current_action_key(user_chat_id),
+                **condition_kwargs(
+                    Attr("action_type").eq("OPEN_QUESTION"),
+                    update_expression_kwargs(set_values={"translation_tip_length": translation_tip_length}),
+                ),
+            }
+        }
+    else:
+        action_item = _finish_current_action(user_chat_id, "OPEN_QUESTION")
+    review_item = {
+        "Update": {"TableName": get_table().name, **_review_update_kwargs(user_chat_id, english_text, review, kwargs)}
+    }
+    transact_items = [review_item, action_item, _update_user_stats(user_chat_id, **kwargs)]
+    if review:
+        transact_items.append(_bump_pairs_version(user_chat_id))
+    failed_indexes = _transact_write(*transact_items)
+    if 1 in failed_indexes:
+        return False
+    if failed_indexes:
+        # The pair is deleted, the question is still answered
+        return not _transact_write(action_item)
+    return True
+
+
+def _unless_expired(item) -> dict:
+    # TTL deletes expired items with a delay, so they are checked here as well. Items written before TTL never expire.
+    return item if item and item.get("expires_at", time.time() + 1) > time.time() else {}
+
+
+def create_poll(user_chat_id, poll_id, english_text, **review_state):
+    _write_later(
+        {
+            "Put": {
+                "TableName": get_table().name,
+                "Item": {
+                    "pk": f"POLL#{poll_id}",
+                    "sk": f"POLL#{poll_id}",
+                    "user_chat_id": user_chat_id,
+                    "gsi1pk": f"USER#{user_chat_id}",
+                    "gsi1sk": f"POLL#{poll_id}",
+                    "answered": False,
+                    "english_text": english_text,
+                    "expires_at": int(time.time() + POLL_TTL),
+                    **review_state,
+                },
+            }
         }
     )
 
 
 def create_suggestion(user_chat_id, poll_id, new_words: list[tuple[str, str]]):
-    table.put_item(
+    get_table().put_item(
         Item={
             "pk": f"SUGGESTION#{poll_id}",
             "sk": f"SUGGESTION#{poll_id}",
@@ -88,97 +567,506 @@ def create_suggestion(user_chat_id, poll_id, new_words: list[tuple[str, str]]):
             "gsi1pk": f"USER#{user_chat_id}",
             "gsi1sk": f"SUGGESTION#{poll_id}",
             "new_words": new_words,
+            "expires_at": int(time.time() + SUGGESTION_TTL),
         }
     )
 
 
 def get_poll(poll_id):
-    return table.get_item(Key={"pk": f"POLL#{poll_id}", "sk": f"POLL#{poll_id}"}).get("Item", {})
+    return _get_item({"pk": f"POLL#{poll_id}", "sk": f"POLL#{poll_id}"}) or {}
 
 
 def get_suggestion(poll_id):
-    return table.get_item(Key={"pk": f"SUGGESTION#{poll_id}", "sk": f"SUGGESTION#{poll_id}"}).get("Item", {})
+    return _unless_expired(_get_item({"pk": f"SUGGESTION#{poll_id}", "sk": f"SUGGESTION#{poll_id}"}))
 
 
 def update_poll(poll_id, **kwargs):
-    table.update_item(
+    get_table().update_item(
         Key={"pk": f"POLL#{poll_id}", "sk": f"POLL#{poll_id}"},
         AttributeUpdates={k: {"Value": v, "Action": "PUT"} for k, v in kwargs.items()},
     )
 
 
-def delete_poll(poll_id):
-    table.delete_item(Key={"pk": f"POLL#{poll_id}", "sk": f"POLL#{poll_id}"})
+def delete_poll(poll_id) -> dict:
+    # Only the first of concurrent or redelivered deletes gets the poll back
+    return _unless_expired(
+        get_table()
+        .delete_item(Key={"pk": f"POLL#{poll_id}", "sk": f"POLL#{poll_id}"}, ReturnValues="ALL_OLD")
+        .get("Attributes", {})
+    )
 
 
 def mark_translation_pair_inactive(user_chat_id, english_text) -> bool:
-    key = {"pk": f"USER#{user_chat_id}", "sk": f"TRANSLATION_PAIR#{english_text}"}
-    if not table.get_item(Key=key).get("Item"):
+    failed_indexes = _transact_write(
+        {
+            "Update": {
+                "TableName": get_table().name,
+                "Key": {"pk": f"USER#{user_chat_id}", "sk": f"TRANSLATION_PAIR#{english_text}"},
+                # Inactive pairs are taken out of the vocabulary listing and the spaced repetition queue
+                **condition_kwargs(
+                    Attr("pk").exists() & Attr("active").eq(True),
+                    update_expression_kwargs(
+                        set_values={"active": False}, remove=("gsi1pk", "gsi1sk", "gsi2pk", "gsi2sk")
+                    ),
+                ),
+            }
+        },
+        _finish_current_action(user_chat_id, "TRANSLATION_PAIR_DELETING"),
+        _update_user_stats(user_chat_id, pairs_count=-1),
+        _bump_pairs_version(user_chat_id),
+    )
+    if 0 in failed_indexes:
         return False
-    table.update_item(Key=key, AttributeUpdates={"active": {"Value": False, "Action": "PUT"}})
-    delete_current_action(user_chat_id)
+    if failed_indexes:
+        raise ProcessMessageError(message=NO_ACTION_MESSAGE)
     return True
 
 
-def list_translation_pairs(user_chat_id, limit=None):
-    response = list(
-        reversed(
-            sorted(
-                table.query(
-                    KeyConditionExpression=(
-                        Key("pk").eq(f"USER#{user_chat_id}") & Key("sk").begins_with("TRANSLATION_PAIR#")
-                    ),
-                    FilterExpression=Attr("active").eq(True),
-                )["Items"],
-                key=lambda x: x["created_at"],
+def iter_translation_pairs(user_chat_id, limit=None, projection=None):
+    # Newest pairs first, ordered by gsi1sk = TRANSLATION_PAIR#<created_at>
+    return iter_items(
+        get_table().query,
+        limit=limit,
+        IndexName="gsi1",
+        KeyConditionExpression=(
+            Key("gsi1pk").eq(f"USER#{user_chat_id}") & Key("gsi1sk").begins_with("TRANSLATION_PAIR#")
+        ),
+        ScanIndexForward=False,
+        **_projection_kwargs(projection),
+    )
+
+
+def list_translation_pairs(user_chat_id, limit=None, projection=None):
+    return list(iter_translation_pairs(user_chat_id, limit=limit, projection=projection))
+
+
+def list_translation_pairs_page(user_chat_id, page_size, older_than=None, newer_than=None) -> tuple:
+    # A page of the vocabulary, newest pairs first, next to the pair created at older_than or newer_than.
+    # Returns the pairs and whether there are more of them further in the same direction.
+    if newer_than:
+        sort_key_condition = Key("gsi1sk").between(f"TRANSLATION_PAIR#{newer_than}", "TRANSLATION_PAIR$")
+    else:
+        sort_key_condition = Key("gsi1sk").between(
+            "TRANSLATION_PAIR#", f"TRANSLATION_PAIR#{older_than}" if older_than else "TRANSLATION_PAIR$"
+        )
+    pairs = [
+        pair
+        for pair in iter_items(
+            get_table().query,
+            # The pair at the cursor is found by the inclusive condition as well
+            limit=page_size + 2,
+            IndexName="gsi1",
+            KeyConditionExpression=Key("gsi1pk").eq(f"USER#{user_chat_id}") & sort_key_condition,
+            ScanIndexForward=bool(newer_than),
+        )
+        if pair["created_at"] not in (older_than, newer_than)
+    ]
+    page = pairs[:page_size]
+    return (page[::-1] if newer_than else page), len(pairs) > page_size
+
+
+def get_user_stats(user_chat_id):
+    return _get_item({"pk": f"USER#{user_chat_id}", "sk": "STATS"}) or {}
+
+
+def _add_to_rollup(rollup_user_chat_id, rollup_sk, changes, **attributes) -> bool:
+    # changes are (sequence_number, counters) of stream records in their order. Records are redelivered on retries,
+    # so a rollup keeps the sequence number of the last change added to it, and the changes up to it are skipped.
+    # Returns False, if all the changes were added already.
+    key = {"pk": f"USER#{rollup_user_chat_id}", "sk": rollup_sk}
+    condition = Attr("sequence_number").not_exists() | Attr("sequence_number").lt(changes[0][0])
+    for attempt in range(2):
+        counters = Counter()
+        for _, change_counters in changes:
+            counters.update(change_counters)
+        try:
+            get_table().update_item(
+                Key=key,
+                ConditionExpression=condition,
+                **update_expression_kwargs(
+                    set_values={
+                        "sequence_number": changes[-1][0],
+                        "expires_at": int(time.time()) + ROLLUP_TTL,
+                        **attributes,
+                    },
+                    add_values=dict(counters),
+                ),
             )
+            return True
+        except get_table().meta.client.exceptions.ConditionalCheckFailedException:
+            if attempt:
+                raise
+        # A part of the changes was added by a previous delivery
+        rollup = get_table().get_item(Key=key, ConsistentRead=True).get("Item") or {}
+        if last_sequence_number := rollup.get("sequence_number"):
+            changes = [change for change in changes if change[0] > last_sequence_number]
+            condition = Attr("sequence_number").eq(last_sequence_number)
+        else:
+            condition = Attr("sequence_number").not_exists()
+        if not changes:
+            return False
+
+
+def add_to_daily_rollup(user_chat_id, day, changes) -> bool:
+    return _add_to_rollup(
+        user_chat_id,
+        f"ROLLUP#DAY#{day}",
+        changes,
+        day=day,
+        user_chat_id=user_chat_id,
+        # Rollups of all users for a day are read by /stats
+        gsi1pk=_daily_rollups_key(user_chat_id, day),
+        gsi1sk=f"USER#{user_chat_id}",
+    )
+
+
+def add_to_pair_rollup(user_chat_id, english_text, day, changes) -> bool:
+    # Rollups of a pair are ordered by days, so its progress is read by one query
+    return _add_to_rollup(
+        user_chat_id, f"ROLLUP#PAIR#{english_text}#{day}", changes, day=day, english_text=english_text
+    )
+
+
+def get_daily_rollup(user_chat_id, day):
+    return _get_item({"pk": f"USER#{user_chat_id}", "sk": f"ROLLUP#DAY#{day}"}) or {}
+
+
+def list_daily_rollups(day):
+    return (
+        rollup
+        for rollups in _scatter_gather(
+            _iter_query_pages(IndexName="gsi1", KeyConditionExpression=Key("gsi1pk").eq(shard_key))
+            for shard_key in get_shard_keys(f"DAILY_ROLLUPS#{day}")
         )
+        for rollup in rollups
     )
-    return response[:limit] if limit else response
 
 
-def delete_all_user_items(user_chat_id):
-    deleted_translations_batch = []
-    items = [
-        *table.query(KeyConditionExpression=(Key("pk").eq(f"USER#{user_chat_id}")))["Items"],
-        *table.query(IndexName="gsi1", KeyConditionExpression=(Key("gsi1pk").eq(f"USER#{user_chat_id}")))["Items"],
-    ]
-    with table.batch_writer() as batch:
-        for item in items:
-            if "sk".startswith("DELETED_TRANSLATIONS_BATCH#"):
-                continue
-            if "sk".startswith("TRANSLATION_PAIR#"):
-                deleted_translations_batch.append(item)
-            batch.delete_item(Key={"pk": item["pk"], "sk": item["sk"]})
-
-    if deleted_translations_batch:
-        table.put_item(
-            Item={
-                "pk": f"USER#{user_chat_id}",
-                "sk": f"DELETED_TRANSLATIONS_BATCH#{time.time()}",
-                "user_chat_id": user_chat_id,
-                "gsi1pk": "DELETED_TRANSLATIONS_BATCH",
-                "deleted_translations_batch": items,
-            }
+def list_due_translation_pairs(user_chat_id, limit, projection=None):
+    # The most overdue pairs first, ordered by gsi2sk = TRANSLATION_PAIR#<due_at>
+    return list(
+        iter_items(
+            get_table().query,
+            limit=limit,
+            IndexName="gsi2",
+            KeyConditionExpression=(
+                Key("gsi2pk").eq(f"USER#{user_chat_id}") & Key("gsi2sk").begins_with("TRANSLATION_PAIR#")
+            ),
+            **_projection_kwargs(projection),
         )
+    )
 
 
-def list_users():
-    return table.query(IndexName="gsi1", KeyConditionExpression=(Key("gsi1pk").eq("USER")))["Items"]
+def _iter_user_item_pages(user_chat_id):
+    user_pk = f"USER#{user_chat_id}"
+    for response in paginate(get_table().query, KeyConditionExpression=Key("pk").eq(user_pk)):
+        yield response["Items"]
+    # Polls and suggestions of the user, translation pairs are found by both queries
+    for response in paginate(
+        get_table().query,
+        IndexName="gsi1",
+        KeyConditionExpression=Key("gsi1pk").eq(user_pk),
+        **_projection_kwargs(("pk", "sk")),
+    ):
+        yield [item for item in response["Items"] if item["pk"] != user_pk]
 
 
-def create_user(user_chat_id, username):
-    table.put_item(
+def _put_deleted_pairs_archive(user_chat_id, archive_id, pairs):
+    get_table().put_item(
         Item={
             "pk": f"USER#{user_chat_id}",
-            "sk": f"USER#{user_chat_id}",
-            "gsi1pk": "USER",
-            "gsi1sk": f"USER#{user_chat_id}",
+            "sk": f"DELETED_TRANSLATIONS_BATCH#{archive_id}",
             "user_chat_id": user_chat_id,
-            "username": username,
+            "gsi1pk": "DELETED_TRANSLATIONS_BATCH",
+            "pairs_count": len(pairs),
+            # gzip compressed JSON array of the deleted items
+            "deleted_translations": gzip.compress(json.dumps(pairs, default=str).encode()),
+        }
+    )
+
+
+def _delete_keys(keys):
+    with get_table().batch_writer() as batch:
+        for key in keys:
+            batch.delete_item(Key=key)
+
+
+def delete_all_user_items(user_chat_id, max_workers=4) -> int:
+    # Pages are deleted while the next ones are read. Deleted translation pairs are archived
+    # in chunks, which stay far below the item size limit, and the archives themselves are kept.
+    archived_at = time.time()
+    archives_count = deleted_count = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        delete_futures = []
+        for items in _iter_user_item_pages(user_chat_id):
+            pairs = [item for item in items if item["sk"].startswith("TRANSLATION_PAIR#")]
+            for chunk_start in range(0, len(pairs), DELETED_PAIRS_PER_ARCHIVE):
+                archive_id = f"{archived_at}#{archives_count}"
+                archived_pairs = pairs[chunk_start : chunk_start + DELETED_PAIRS_PER_ARCHIVE]
+                _put_deleted_pairs_archive(user_chat_id, archive_id, archived_pairs)
+                archives_count += 1
+
+            keys = [
+                {"pk": item["pk"], "sk": item["sk"]}
+                for item in items
+                if not item["sk"].startswith("DELETED_TRANSLATIONS_BATCH#")
+            ]
+            delete_futures.extend(
+                executor.submit(_delete_keys, keys[chunk_start : chunk_start + DELETE_CHUNK_SIZE])
+                for chunk_start in range(0, len(keys), DELETE_CHUNK_SIZE)
+            )
+            deleted_count += len(keys)
+        for delete_future in delete_futures:
+            delete_future.result()
+    return deleted_count
+
+
+def get_user_shard(user_chat_id, shards_count=None) -> int:
+    return zlib.crc32(str(user_chat_id).encode()) % (shards_count or USER_SHARDS)
+
+
+def _users_key(user_chat_id):
+    return f"USERS#{get_user_shard(user_chat_id)}"
+
+
+def _daily_rollups_key(user_chat_id, day):
+    return f"DAILY_ROLLUPS#{day}#{get_user_shard(user_chat_id)}"
+
+
+def _polling_schedule_key(user_chat_id):
+    return f"POLLING_SCHEDULE#{get_user_shard(user_chat_id)}"
+
+
+def get_shard_keys(prefix, legacy_key=None, shards_count=None) -> list:
+    shard_keys = [f"{prefix}#{shard}" for shard in range(shards_count or USER_SHARDS)]
+    return [legacy_key, *shard_keys] if legacy_key and READ_LEGACY_USER_KEYS else shard_keys
+
+
+def _scatter_gather(page_iterators):
+    # Pages of all the iterators are read in parallel and yielded as soon as they come.
+    # The queue is bounded, so readers don't run far ahead of the consumer.
+    pages = queue.Queue(maxsize=SCATTER_GATHER_CONCURRENCY * 2)
+    finished = object()
+    stopped = threading.Event()
+
+    def read(page_iterator):
+        try:
+            for page in page_iterator:
+                if stopped.is_set():
+                    break
+                pages.put(page)
+        finally:
+            pages.put(finished)
+
+    with ThreadPoolExecutor(max_workers=SCATTER_GATHER_CONCURRENCY) as executor:
+        futures = [executor.submit(read, page_iterator) for page_iterator in page_iterators]
+        running_count = len(futures)
+        try:
+            while running_count:
+                if (page := pages.get()) is finished:
+                    running_count -= 1
+                else:
+                    yield page
+        finally:
+            # The consumer could stop early, readers blocked on the full queue are released
+            stopped.set()
+            while running_count:
+                running_count -= pages.get() is finished
+    for future in futures:
+        future.result()
+
+
+def _iter_query_pages(**query_kwargs):
+    for response in paginate(get_table().query, **query_kwargs):
+        yield response["Items"]
+
+
+def list_users():
+    return (
+        user
+        for users in _scatter_gather(
+            _iter_query_pages(IndexName="gsi1", KeyConditionExpression=Key("gsi1pk").eq(shard_key))
+            for shard_key in get_shard_keys("USERS", LEGACY_USERS_KEY)
+        )
+        for user in users
+    )
+
+
+def iter_user_pages(start_key=None, page_size=None):
+    # Yields users together with the cursor to continue from after them, so long runs can be resumed.
+    # Shards are read one after another, the cursor tells the shard and the key within it.
+    shard_keys = get_shard_keys("USERS", LEGACY_USERS_KEY)
+    first_shard_index, exclusive_start_key = 0, None
+    # Cursors saved before sharding are keys of the legacy partition
+    if start_key and (shard_key := start_key.get("shard_key") or start_key.get("gsi1pk")) in shard_keys:
+        first_shard_index = shard_keys.index(shard_key)
+        exclusive_start_key = start_key.get("start_key") if "shard_key" in start_key else start_key
+    for shard_index in range(first_shard_index, len(shard_keys)):
+        query_kwargs = {
+            "IndexName": "gsi1",
+            "KeyConditionExpression": Key("gsi1pk").eq(shard_keys[shard_index]),
         }
+        if exclusive_start_key:
+            query_kwargs["ExclusiveStartKey"] = exclusive_start_key
+        if page_size:
+            query_kwargs["Limit"] = page_size
+        for response in paginate(get_table().query, **query_kwargs):
+            if last_evaluated_key := response.get("LastEvaluatedKey"):
+                cursor = {"shard_key": shard_keys[shard_index], "start_key": last_evaluated_key}
+            elif shard_index + 1 < len(shard_keys):
+                cursor = {"shard_key": shard_keys[shard_index + 1], "start_key": None}
+            else:
+                cursor = None
+            yield response["Items"], cursor
+        exclusive_start_key = None
+
+
+def create_user(user_chat_id, username, next_poll_at):
+    # Polling schedule of an already existing user is kept untouched
+    get_table().update_item(
+        Key={"pk": f"USER#{user_chat_id}", "sk": f"USER#{user_chat_id}"},
+        **update_expression_kwargs(
+            set_values={
+                "gsi1pk": _users_key(user_chat_id),
+                "gsi1sk": f"USER#{user_chat_id}",
+                "user_chat_id": user_chat_id,
+                "username": username,
+            },
+            set_if_not_exists={
+                "next_poll_at": next_poll_at,
+                "gsi2pk": _polling_schedule_key(user_chat_id),
+                "gsi2sk": next_poll_at,
+            },
+        ),
     )
 
 
 def get_user(user_chat_id):
-    return table.get_item(Key={"pk": f"USER#{user_chat_id}", "sk": f"USER#{user_chat_id}"}).get("Item") or {}
+    return _get_item({"pk": f"USER#{user_chat_id}", "sk": f"USER#{user_chat_id}"}) or {}
+
+
+def update_polling_schedule(user_chat_id, next_poll_at, current_action_type=None, **schedule_settings):
+    update_kwargs = {
+        "Key": {"pk": f"USER#{user_chat_id}", "sk": f"USER#{user_chat_id}"},
+        **condition_kwargs(
+            Attr("pk").exists(),
+            update_expression_kwargs(
+                set_values={
+                    "next_poll_at": next_poll_at,
+                    "gsi2pk": _polling_schedule_key(user_chat_id),
+                    "gsi2sk": next_poll_at,
+                    **schedule_settings,
+                }
+            ),
+        ),
+    }
+    if not current_action_type:
+        get_table().update_item(**update_kwargs)
+        return
+    failed_indexes = _transact_write(
+        {"Update": {"TableName": get_table().name, **update_kwargs}},
+        _finish_current_action(user_chat_id, current_action_type),
+    )
+    if 0 in failed_indexes:
+        raise ProcessMessageError(message=NO_USER_MESSAGE)
+    if failed_indexes:
+        raise ProcessMessageError(message=NO_ACTION_MESSAGE)
+
+
+def reschedule_poll(user_chat_id, scheduled_poll_at, next_poll_at) -> bool:
+    # Conditional on the previous value, so overlapping ticks never dispatch the same poll twice
+    try:
+        get_table().update_item(
+            Key={"pk": f"USER#{user_chat_id}", "sk": f"USER#{user_chat_id}"},
+            ConditionExpression=Attr("next_poll_at").eq(scheduled_poll_at),
+            **update_expression_kwargs(set_values={"next_poll_at": next_poll_at, "gsi2sk": next_poll_at}),
+        )
+    except get_table().meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def list_users_due_for_poll(now):
+    # All the schedule shards are queried in parallel, pages are yielded in the order they come
+    return _scatter_gather(
+        _iter_query_pages(IndexName="gsi2", KeyConditionExpression=Key("gsi2pk").eq(shard_key) & Key("gsi2sk").lte(now))
+        for shard_key in get_shard_keys("POLLING_SCHEDULE", LEGACY_POLLING_SCHEDULE_KEY)
+    )
+
+
+def create_broadcast(broadcast_id, user_chat_id, message) -> bool:
+    # Telegram redelivers updates, which weren't answered in time, so the same broadcast is created only once
+    try:
+        get_table().put_item(
+            Item={
+                "pk": f"BROADCAST#{broadcast_id}",
+                "sk": f"BROADCAST#{broadcast_id}",
+                "user_chat_id": user_chat_id,
+                "message": message,
+                "status": "IN_PROGRESS",
+                "sent_count": 0,
+                "blocked_count": 0,
+                "created_at": datetime.datetime.now().isoformat(),
+            },
+            ConditionExpression=Attr("pk").not_exists(),
+        )
+    except get_table().meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def get_broadcast(broadcast_id):
+    return (
+        get_table().get_item(Key={"pk": f"BROADCAST#{broadcast_id}", "sk": f"BROADCAST#{broadcast_id}"}).get("Item", {})
+    )
+
+
+def checkpoint_broadcast(broadcast_id, cursor, sent_count, blocked_count):
+    get_table().update_item(
+        Key={"pk": f"BROADCAST#{broadcast_id}", "sk": f"BROADCAST#{broadcast_id}"},
+        **update_expression_kwargs(
+            set_values={"cursor": cursor} if cursor else {"status": "DONE"},
+            add_values={"sent_count": sent_count, "blocked_count": blocked_count},
+            remove=() if cursor else ("cursor",),
+        ),
+    )
+
+
+def _translation_cache_key(text, from_lang, to_lang):
+    return {"pk": f"TRANSLATION#{from_lang}#{to_lang}#{text}", "sk": f"TRANSLATION#{from_lang}#{to_lang}#{text}"}
+
+
+def get_cached_translation(text, from_lang, to_lang):
+    item = get_table().get_item(Key=_translation_cache_key(text, from_lang, to_lang)).get("Item", {})
+    # TTL deletes expired items with a delay, so they are checked here as well
+    if item.get("expires_at", 0) > time.time():
+        return item["translated_text"]
+
+
+def get_cached_translations(texts, from_lang, to_lang) -> dict:
+    texts, translations = list(dict.fromkeys(texts)), {}
+    now = time.time()
+    # BatchGetItem accepts up to 100 keys
+    for i in range(0, len(texts), 100):
+        keys = [_translation_cache_key(text, from_lang, to_lang) for text in texts[i : i + 100]]
+        request_items = {get_table().name: {"Keys": keys}}
+        while request_items:
+            response = get_table().meta.client.batch_get_item(RequestItems=request_items)
+            for item in response["Responses"].get(get_table().name, []):
+                if item.get("expires_at", 0) > now:
+                    translations[item["source_text"]] = item["translated_text"]
+            request_items = response.get("UnprocessedKeys")
+    return translations
+
+
+def put_cached_translations(translations: dict, from_lang, to_lang, expires_at):
+    with get_table().batch_writer(overwrite_by_pkeys=["pk", "sk"]) as batch:
+        for text, translated_text in translations.items():
+            batch.put_item(
+                Item={
+                    **_translation_cache_key(text, from_lang, to_lang),
+                    "source_text": text,
+                    "translated_text": translated_text,
+                    "expires_at": int(expires_at),
+                }
+            )
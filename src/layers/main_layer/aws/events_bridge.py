@@ -1,19 +1,10 @@
 from contextlib import suppress
 
-from boto3 import client
-
-events_client = client("events")
-
-
-def put_event(rule_name, schedule_expression):
-    return events_client.put_rule(Name=rule_name, ScheduleExpression=schedule_expression, State="ENABLED")["RuleArn"]
-
-
-def put_targets(rule_name, targets):
-    events_client.put_targets(Rule=rule_name, Targets=targets)
+from clients import get_client
 
 
 def get_rule(rule_name):
+    events_client = get_client("events")
     try:
         return events_client.describe_rule(Name=rule_name)
     except events_client.exceptions.ResourceNotFoundException:
@@ -21,6 +12,7 @@ def get_rule(rule_name):
 
 
 def delete_rule(rule_name):
+    events_client = get_client("events")
     with suppress(events_client.exceptions.ResourceNotFoundException):
         if targets := events_client.list_targets_by_rule(Rule=rule_name).get("Targets", []):
             events_client.remove_targets(Rule=rule_name, Ids=[target["Id"] for target in targets])
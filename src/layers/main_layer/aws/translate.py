@@ -1,9 +1,80 @@
-from boto3 import client
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-translate_client = client("translate")
+from aws import dynamodb as dynamodb_operations
+from cache import LRUCache
+from clients import get_client
+from telemetry import add_count, timed
 
+TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", str(30 * 24 * 60 * 60)))
+# Longer texts are rarely repeated, and DynamoDB keys are limited in size
+MAX_CACHED_TEXT_LENGTH = 256
 
+memory_cache = LRUCache(max_size=int(os.getenv("TRANSLATION_MEMORY_CACHE_SIZE", "2048")), ttl=TRANSLATION_CACHE_TTL)
+
+
+def normalize_text(text):
+    return " ".join(text.lower().split())
+
+
+def request_translation(text, from_lang, to_lang):
+    return (
+        get_client("translate")
+        .translate_text(Text=text, SourceLanguageCode=from_lang, TargetLanguageCode=to_lang)["TranslatedText"]
+        .capitalize()
+    )
+
+
+@timed("Translation", "translate_text")
 def translate_text(text, from_lang="en", to_lang="uk"):
-    return translate_client.translate_text(Text=text, SourceLanguageCode=from_lang, TargetLanguageCode=to_lang)[
-        "TranslatedText"
-    ].capitalize()
+    normalized_text = normalize_text(text)
+    if len(normalized_text) > MAX_CACHED_TEXT_LENGTH:
+        return request_translation(text, from_lang, to_lang)
+
+    cache_key = (normalized_text, from_lang, to_lang)
+    if translation := memory_cache.get(cache_key):
+        add_count("TranslationCacheHit", tier="memory")
+        return translation
+    if translation := dynamodb_operations.get_cached_translation(normalized_text, from_lang, to_lang):
+        add_count("TranslationCacheHit", tier="dynamodb")
+    else:
+        add_count("TranslationCacheMiss")
+        translation = request_translation(text, from_lang, to_lang)
+        dynamodb_operations.put_cached_translations(
+            {normalized_text: translation}, from_lang, to_lang, expires_at=time.time() + TRANSLATION_CACHE_TTL
+        )
+    memory_cache.set(cache_key, translation)
+    return translation
+
+
+def _translate_missing(texts, from_lang, to_lang, max_workers) -> tuple:
+    # Cached translations are read in batches, only the missing ones are requested, in parallel,
+    # and cached in batches as well. Returns normalized text -> translation for both of them.
+    normalized_texts = {
+        normalized_text
+        for text in texts
+        if (normalized_text := normalize_text(text)) and len(normalized_text) <= MAX_CACHED_TEXT_LENGTH
+    }
+    cached_translations = dynamodb_operations.get_cached_translations(normalized_texts, from_lang, to_lang)
+    missing_texts = [text for text in normalized_texts if text not in cached_translations]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        translations = dict(
+            zip(missing_texts, executor.map(lambda text: request_translation(text, from_lang, to_lang), missing_texts))
+        )
+    dynamodb_operations.put_cached_translations(
+        translations, from_lang, to_lang, expires_at=time.time() + TRANSLATION_CACHE_TTL
+    )
+    return cached_translations, translations
+
+
+def translate_texts(texts, from_lang="en", to_lang="uk", max_workers=8) -> dict:
+    # Texts longer than MAX_CACHED_TEXT_LENGTH are left out, they are translated one by one with translate_text
+    cached_translations, translations = _translate_missing(texts, from_lang, to_lang, max_workers)
+    add_count("TranslationCacheHit", len(cached_translations), tier="dynamodb")
+    add_count("TranslationCacheMiss", len(translations))
+    return {**cached_translations, **translations}
+
+
+def warm_up_translation_cache(texts, from_lang="en", to_lang="uk", max_workers=8) -> int:
+    return len(_translate_missing(texts, from_lang, to_lang, max_workers)[1])
@@ -0,0 +1,34 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    # Lives in the module scope, so it survives between warm invocations of the same container
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if (entry := self._items.get(key)) is None or (self.ttl and entry[1] < time.monotonic()):
+                self._items.pop(key, None)
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl if self.ttl else None)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
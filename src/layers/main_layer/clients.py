@@ -0,0 +1,59 @@
+import os
+from functools import wraps
+from threading import RLock
+
+# Clients are created on first use and shared by all modules, so an invocation only pays for what it uses
+_lock = RLock()
+
+
+def shared(factory):
+    instances = {}
+
+    @wraps(factory)
+    def get_instance(*args):
+        if args not in instances:
+            # boto3 session is not thread safe while creating clients
+            with _lock:
+                if args not in instances:
+                    instances[args] = factory(*args)
+        return instances[args]
+
+    return get_instance
+
+
+@shared
+def get_client(service_name):
+    from boto3 import client
+    from telemetry import instrument_client
+
+    return instrument_client(client(service_name))
+
+
+@shared
+def get_table():
+    from boto3 import resource
+    from telemetry import instrument_client
+
+    table = resource("dynamodb").Table(os.getenv("TABLE_NAME"))
+    instrument_client(table.meta.client)
+    return table
+
+
+@shared
+def get_bot():
+    from telegram import Bot
+    from telegram.utils.request import Request
+    from telemetry import timed
+
+    class TimedRequest(Request):
+        def post(self, url, data, timeout=None):
+            # Every Bot API method is a POST to .../bot<token>/<method>
+            with timed("Telegram", url.rsplit("/", 1)[-1]):
+                return super().post(url, data, timeout=timeout)
+
+    # Connections are pooled for the handlers, which send messages from SEND_CONCURRENCY threads
+    return Bot(
+        token=os.getenv("TELEGRAM_TOKEN"),
+        base_url=os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot"),
+        request=TimedRequest(con_pool_size=int(os.getenv("SEND_CONCURRENCY", "16"))),
+    )
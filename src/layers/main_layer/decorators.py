@@ -3,12 +3,12 @@ import traceback
 from http import HTTPStatus
 
 from aws_lambda_powertools import Logger
-from telegram.error import Unauthorized
 
 from exceptions import ProcessMessageError
-from tg import ADMIN_IDS, send_message
-from users import remove_user
-from aws.dynamodb import get_user
+from tg import ADMIN_IDS, is_bot_blocked, send_message
+from users import request_users_removal
+from aws.dynamodb import get_user, unit_of_work
+from telemetry import MetricUnit, flush_metrics, record, start_invocation
 
 logger = Logger()
 
@@ -17,17 +17,23 @@ POLLING_LAMBDA_ARN = os.getenv("POLLING_LAMBDA_ARN")
 
 def handle_errors(f):
     def wrapper(event, context):
+        current_unit_of_work = None
+        start_invocation()
         try:
-            return f(event, context)
+            # Buffered writes are flushed on the way out, so their errors are handled here as well
+            with unit_of_work() as current_unit_of_work:
+                return f(event, context)
         except ProcessMessageError as e:
             if e.message and (user_chat_id := event.get("user_chat_id")):
                 send_message(user_chat_id=user_chat_id, text=e.message)
-        except Unauthorized:
-            user_chat_id = event.get("user_chat_id")
-            if user_chat_id and user_chat_id not in ADMIN_IDS:
-                logger.error(f"user {user_chat_id} has blocked bot")
-                remove_user(user_chat_id, POLLING_LAMBDA_ARN or context.invoked_function_arn)
-        except Exception:
+        except Exception as e:
+            if is_bot_blocked(e):
+                user_chat_id = event.get("user_chat_id")
+                if user_chat_id and user_chat_id not in ADMIN_IDS:
+                    logger.error(f"user {user_chat_id} has blocked bot")
+                    request_users_removal([user_chat_id], POLLING_LAMBDA_ARN or context.invoked_function_arn)
+                return {"statusCode": HTTPStatus.OK}
+
             logger.exception("Unexpected error.")
             if user_chat_id := event.get("user_chat_id"):
                 send_message(user_chat_id=user_chat_id, text="Sorry, something went wrong.")
@@ -42,6 +48,12 @@ def handle_errors(f):
                     ),
                     disable_markdown=True,
                 )
+        finally:
+            if current_unit_of_work:
+                requests = dict(current_unit_of_work.requests)
+                logger.info({"dynamodb_requests": requests})
+                record("DynamoDB.Requests", MetricUnit.Count, sum(requests.values()))
+            flush_metrics()
 
         return {"statusCode": HTTPStatus.OK}
 
@@ -0,0 +1,65 @@
+import random
+import zlib
+from bisect import bisect_right
+
+ANSWER_KEYS = ("english_text", "native_text")
+OPTIONS_COUNT = 4
+# Every user keeps a bounded pool of possible answers, grouped by their length, so that distractors look
+# similar to the correct option. A text always lands in the same slot, which deduplicates the pool.
+LENGTH_GROUP_BOUNDS = (8, 16)
+SLOTS_PER_GROUP = 32
+SLOT_GROUPS = {
+    answers_key: {
+        f"{answers_key}_{group}_{slot}": group
+        for group in range(len(LENGTH_GROUP_BOUNDS) + 1)
+        for slot in range(SLOTS_PER_GROUP)
+    }
+    for answers_key in ANSWER_KEYS
+}
+
+
+def get_length_group(text) -> int:
+    return bisect_right(LENGTH_GROUP_BOUNDS, len(text))
+
+
+def get_slot_attribute(answers_key, text) -> str:
+    slot = zlib.crc32(text.lower().encode()) % SLOTS_PER_GROUP
+    return f"{answers_key}_{get_length_group(text)}_{slot}"
+
+
+def get_pool_slots(pair) -> dict:
+    return {get_slot_attribute(answers_key, pair[answers_key]): pair[answers_key] for answers_key in ANSWER_KEYS}
+
+
+def group_pool(pool, answers_key) -> list:
+    groups = [set() for _ in range(len(LENGTH_GROUP_BOUNDS) + 1)]
+    slot_groups = SLOT_GROUPS[answers_key]
+    for attribute, text in pool.items():
+        if (group := slot_groups.get(attribute)) is not None:
+            groups[group].add(text)
+    return groups
+
+
+def pick_options(pool, correct_option, answers_key, extra_candidates=(), options_count=OPTIONS_COUNT) -> list:
+    groups = group_pool(pool, answers_key)
+    for text in extra_candidates:
+        groups[get_length_group(text)].add(text)
+
+    options = [correct_option]
+    taken_options = {correct_option.lower()}
+    correct_group = get_length_group(correct_option)
+    # Groups of the closest length are tried first
+    for group in sorted(range(len(groups)), key=lambda group: abs(group - correct_group)):
+        candidates = list(groups[group])
+        # Partial Fisher-Yates shuffle, stops as soon as enough options are taken
+        for index in range(len(candidates)):
+            if len(options) == options_count:
+                break
+            swap_index = random.randrange(index, len(candidates))
+            candidates[index], candidates[swap_index] = candidates[swap_index], candidates[index]
+            if (text := candidates[index]).lower() not in taken_options:
+                options.append(text)
+                taken_options.add(text.lower())
+
+    random.shuffle(options)
+    return options
@@ -4,42 +4,135 @@ from typing import List, Dict
 import re
 
 import backoff
-import openai
 
 from exceptions import GptResponseFormatError
+from pairset import PairSet
+from telemetry import MetricUnit, record, timed
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai.api_key = OPENAI_API_KEY
+# Learnt pairs put into the prompt of one person, so the prompt does not grow with the vocabulary
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "300"))
+CONTEXT_FIELDS = ("english_text", "native_text", "ease", "correct_answers", "wrong_answers")
+# Rough estimate for a mix of English and Ukrainian text, precise enough to keep the prompt bounded
+CHARS_PER_TOKEN = 3
+SUGGESTIONS_COUNT = 5
+# Asked for a few more pairs than sent, as some of them can turn out to be already known
+GENERATED_PAIRS_COUNT = 7
 
 NUM_LIST_REGEX = re.compile(r"^\d+\.\s*")
 
 
-@backoff.on_exception(backoff.expo, GptResponseFormatError, max_tries=3)
-def suggest_new_pairs(learnt_pairs: List[Dict[str, str]]) -> List[tuple]:
-    if not learnt_pairs:
-        return []
-    pairs_for_prompt = "".join([f'{pair["english_text"]} - {pair["native_text"]}; ' for pair in learnt_pairs])
-    response = openai.ChatCompletion.create(
-        model="gpt-4",
-        messages=[
-            {
-                "role": "user",
-                "content": (
-                    "Generate 5 words/phrases in English with translation to Ukrainian "
-                    "in json format with array of 2 strings to learn for a person "
-                    f"who last learned words/phrases: {pairs_for_prompt}."
-                ),
-            }
-        ],
-        temperature=0.25,
+def estimate_tokens(text) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def select_prompt_context(learnt_pairs: PairSet, token_budget=PROMPT_CONTEXT_TOKENS) -> List[Dict[str, str]]:
+    # Heavier pairs are more likely to be picked, but the rest of the vocabulary is still represented.
+    # Every pair takes a few tokens, so no more than token_budget of the sampled pairs are ever needed.
+    selected_pairs = []
+    tokens_left = token_budget
+    for pair_index in learnt_pairs.sample(token_budget):
+        pair = learnt_pairs[pair_index]
+        pair_tokens = estimate_tokens(format_pairs_for_prompt([pair]))
+        if pair_tokens <= tokens_left:
+            selected_pairs.append(pair)
+            tokens_left -= pair_tokens
+        if tokens_left < CHARS_PER_TOKEN:
+            break
+    return selected_pairs
+
+
+def filter_known_pairs(generated_pairs: List[tuple], learnt_pairs: PairSet) -> List[tuple]:
+    known_texts = learnt_pairs.get_known_texts()
+    new_pairs = []
+    for english_text, native_text in generated_pairs:
+        if english_text.strip().lower() not in known_texts:
+            known_texts.add(english_text.strip().lower())
+            new_pairs.append((english_text, native_text))
+    return new_pairs[:SUGGESTIONS_COUNT]
+
+
+def build_suggestion_prompt(learnt_pairs: PairSet, token_budget=PROMPT_CONTEXT_TOKENS) -> str:
+    return (
+        f"Generate {GENERATED_PAIRS_COUNT} words/phrases in English with translation to Ukrainian "
+        "in json format with array of 2 strings to learn for a person "
+        f"who last learned words/phrases: {format_pairs_for_prompt(select_prompt_context(learnt_pairs, token_budget))}."
     )
-    print(response)
-    try:
-        raw_generated_pairs = json.loads(response["choices"][0]["message"]["content"])
-    except (KeyError, IndexError, json.JSONDecodeError):
-        raise GptResponseFormatError()
 
+
+def format_pairs_for_prompt(learnt_pairs: List[Dict[str, str]]) -> str:
+    return "".join([f'{pair["english_text"]} - {pair["native_text"]}; ' for pair in learnt_pairs])
+
+
+def clean_generated_pairs(raw_generated_pairs) -> List[tuple]:
     return [
         (NUM_LIST_REGEX.sub("", pair[0]), NUM_LIST_REGEX.sub("", pair[1]))
         for pair in raw_generated_pairs  # fmt: skip
     ]
+
+
+def record_retry(_):
+    record("OpenAI.Retries", MetricUnit.Count, 1)
+
+
+def complete(prompt) -> str:
+    import openai
+
+    openai.api_key = OPENAI_API_KEY
+    with timed("OpenAI", "ChatCompletion"):
+        response = openai.ChatCompletion.create(
+            model="gpt-4",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.25,
+        )
+    for usage_field in ("prompt_tokens", "completion_tokens"):
+        if usage_field in response.get("usage", {}):
+            record(f"OpenAI.{usage_field}", MetricUnit.Count, response["usage"][usage_field])
+    try:
+        return response["choices"][0]["message"]["content"]
+    except (KeyError, IndexError):
+        raise GptResponseFormatError()
+
+
+@timed("OpenAI", "suggest_new_pairs")
+@backoff.on_exception(backoff.expo, GptResponseFormatError, max_tries=3, on_backoff=record_retry)
+def suggest_new_pairs(learnt_pairs: PairSet) -> List[tuple]:
+    if not learnt_pairs:
+        return []
+    content = complete(build_suggestion_prompt(learnt_pairs))
+    try:
+        return filter_known_pairs(clean_generated_pairs(json.loads(content)), learnt_pairs)
+    except (IndexError, TypeError, json.JSONDecodeError):
+        raise GptResponseFormatError()
+
+
+@timed("OpenAI", "suggest_new_pairs_for_users")
+@backoff.on_exception(backoff.expo, GptResponseFormatError, max_tries=3, on_backoff=record_retry)
+def suggest_new_pairs_for_users(learnt_pairs_by_user: Dict[str, PairSet]) -> Dict[str, List[tuple]]:
+    # Several users in one request, to stay within the requests rate limit of OpenAI.
+    # Users are numbered in the prompt, so their ids are not shared.
+    user_ids = [user_id for user_id, learnt_pairs in learnt_pairs_by_user.items() if learnt_pairs]
+    if not user_ids:
+        return {}
+    people = "".join(
+        f"\nPerson {number} last learned words/phrases: "
+        f"{format_pairs_for_prompt(select_prompt_context(learnt_pairs_by_user[user_id]))}"
+        for number, user_id in enumerate(user_ids, start=1)
+    )
+    content = complete(
+        f"For every person below generate {GENERATED_PAIRS_COUNT} words/phrases in English "
+        "with translation to Ukrainian to learn. "
+        "Answer in json format with an object, which maps the person number to an array of arrays of 2 strings."
+        f"{people}"
+    )
+    try:
+        raw_generated_pairs_by_number = json.loads(content)
+        return {
+            user_id: filter_known_pairs(
+                clean_generated_pairs(raw_generated_pairs_by_number[str(number)]), learnt_pairs_by_user[user_id]
+            )
+            for number, user_id in enumerate(user_ids, start=1)
+            if str(number) in raw_generated_pairs_by_number
+        }
+    except (AttributeError, IndexError, TypeError, json.JSONDecodeError):
+        raise GptResponseFormatError()
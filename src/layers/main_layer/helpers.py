@@ -1,6 +1,39 @@
-def sort_pairs_by_priority(translation_pairs):
-    return sorted(translation_pairs, key=lambda x: x.get("polls_count", 0))
+from datetime import timedelta, timezone
+from zoneinfo import ZoneInfo
+
+TIME_UNITS_IN_SECONDS = {"minute": 60, "hour": 60 * 60, "day": 24 * 60 * 60}
+DEFAULT_POLLING_INTERVAL = TIME_UNITS_IN_SECONDS["hour"]
+DEFAULT_TIMEZONE = "UTC"
+# Users are not polled from 23:00 till 07:00 of their local time
+DEFAULT_QUIET_HOURS_START = 23
+DEFAULT_QUIET_HOURS_END = 7
 
 
 def get_polling_rule_name(user_chat_id):
     return f"{user_chat_id}_POLLING"
+
+
+def format_timestamp(moment):
+    # Fixed width UTC timestamps, so they can be compared as strings in DynamoDB keys
+    return moment.astimezone(timezone.utc).isoformat(timespec="seconds")
+
+
+def is_quiet_hour(hour, quiet_hours_start, quiet_hours_end):
+    if quiet_hours_start <= quiet_hours_end:
+        return quiet_hours_start <= hour < quiet_hours_end
+    return hour >= quiet_hours_start or hour < quiet_hours_end
+
+
+def get_next_poll_at(user, now):
+    next_poll_at = now + timedelta(seconds=int(user.get("polling_interval", DEFAULT_POLLING_INTERVAL)))
+    quiet_hours_start = int(user.get("quiet_hours_start", DEFAULT_QUIET_HOURS_START))
+    quiet_hours_end = int(user.get("quiet_hours_end", DEFAULT_QUIET_HOURS_END))
+    local_next_poll_at = next_poll_at.astimezone(ZoneInfo(user.get("timezone", DEFAULT_TIMEZONE)))
+    if not is_quiet_hour(local_next_poll_at.hour, quiet_hours_start, quiet_hours_end):
+        return next_poll_at
+
+    # Postpone the poll till the user's morning
+    wake_up_at = local_next_poll_at.replace(hour=quiet_hours_end, minute=0, second=0, microsecond=0)
+    if wake_up_at <= local_next_poll_at:
+        wake_up_at += timedelta(days=1)
+    return wake_up_at.astimezone(timezone.utc)
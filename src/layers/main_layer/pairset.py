@@ -0,0 +1,88 @@
+import heapq
+import random
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    # numpy is optional, the same columns are processed in pure Python without it
+    numpy = None
+
+# Pairs without a review state are as easy as new ones in SM-2
+DEFAULT_EASE = 2.5
+RECENCY_RANK_SCALE = 20
+
+
+class PairSet:
+    # Vocabulary of a user in columns, newest pair first: texts in lists and answer stats in typed arrays,
+    # instead of a dict with Decimal values per pair, as boto3 returns them.
+    __slots__ = ("english_texts", "native_texts", "correct_answers", "wrong_answers", "ease")
+
+    def __init__(self):
+        self.english_texts = []
+        self.native_texts = []
+        self.correct_answers = array("I")
+        self.wrong_answers = array("I")
+        self.ease = array("d")
+
+    @classmethod
+    def from_items(cls, items) -> "PairSet":
+        pair_set = cls()
+        for item in items:
+            pair_set.append(item)
+        return pair_set
+
+    def append(self, item):
+        self.english_texts.append(sys.intern(item["english_text"]))
+        self.native_texts.append(sys.intern(item["native_text"]))
+        self.correct_answers.append(int(item.get("correct_answers", 0)))
+        self.wrong_answers.append(int(item.get("wrong_answers", 0)))
+        self.ease.append(float(item.get("ease", DEFAULT_EASE)))
+
+    def __len__(self):
+        return len(self.english_texts)
+
+    def __getitem__(self, index) -> dict:
+        return {
+            "english_text": self.english_texts[index],
+            "native_text": self.native_texts[index],
+            "correct_answers": self.correct_answers[index],
+            "wrong_answers": self.wrong_answers[index],
+            "ease": self.ease[index],
+        }
+
+    def get_known_texts(self) -> set:
+        return {english_text.strip().lower() for english_text in self.english_texts}
+
+    def get_context_weights(self):
+        # Recent pairs show what the person learns now, weak ones show what is still hard for them
+        if numpy is not None:
+            correct_answers = numpy.asarray(self.correct_answers, dtype=float)
+            wrong_answers = numpy.asarray(self.wrong_answers, dtype=float)
+            recency = 1 / (1 + numpy.arange(len(self)) / RECENCY_RANK_SCALE)
+            weakness = (wrong_answers + 1) / (correct_answers + wrong_answers + 2)
+            return recency + weakness + numpy.maximum(0.0, DEFAULT_EASE - numpy.asarray(self.ease))
+        return [
+            1 / (1 + recency_rank / RECENCY_RANK_SCALE)
+            + (wrong_answers + 1) / (correct_answers + wrong_answers + 2)
+            + max(0.0, DEFAULT_EASE - ease)
+            for recency_rank, (correct_answers, wrong_answers, ease) in enumerate(
+                zip(self.correct_answers, self.wrong_answers, self.ease)
+            )
+        ]
+
+    def sample(self, count, rng=random) -> list:
+        # Weighted sampling without replacement (Efraimidis-Spirakis): indexes of the pairs with the largest
+        # random keys u ** (1 / weight), heaviest pairs first. Only these pairs are ordered, the rest are not.
+        count = min(count, len(self))
+        if count <= 0:
+            return []
+        weights = self.get_context_weights()
+        if numpy is not None:
+            # log(u) / weight keeps the order of u ** (1 / weight) without underflows
+            keys = numpy.log(numpy.random.default_rng(rng.getrandbits(64)).random(len(self))) / weights
+            indexes = numpy.argpartition(-keys, count - 1)[:count]
+            return indexes[numpy.argsort(-keys[indexes])].tolist()
+        keys = [rng.random() ** (1 / weight) for weight in weights]
+        return heapq.nlargest(count, range(len(keys)), key=keys.__getitem__)
@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+    def pause(self, seconds):
+        # E.g. the API asked to retry later, so nobody sharing the bucket should call it till then
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+class KeyedIntervalLimiter:
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        # Keys in the order of their last acquire, so the ones, which are allowed again, are evicted from the front
+        self._next_allowed_at = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        with self._lock:
+            now = time.monotonic()
+            while self._next_allowed_at and next(iter(self._next_allowed_at.values())) <= now:
+                self._next_allowed_at.popitem(last=False)
+            allowed_at = max(now, self._next_allowed_at.get(key, now))
+            self._next_allowed_at[key] = allowed_at + self.min_interval
+            self._next_allowed_at.move_to_end(key)
+        if (wait_time := allowed_at - now) > 0:
+            time.sleep(wait_time)
@@ -0,0 +1,57 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from helpers import format_timestamp
+
+# SM-2 algorithm, answer quality is graded from 0 (blackout) to 5 (perfect recall)
+QUIZ_CORRECT_QUALITY = 4
+OPEN_QUESTION_CORRECT_QUALITY = 5
+WRONG_ANSWER_QUALITY = 1
+MIN_CORRECT_QUALITY = 3
+
+DEFAULT_EASE = Decimal("2.5")
+MIN_EASE = Decimal("1.3")
+FIRST_INTERVAL_DAYS = Decimal(1)
+SECOND_INTERVAL_DAYS = Decimal(6)
+# Forgotten pair is asked again after a short break rather than the next day
+RELEARN_DELAY = timedelta(minutes=30)
+# Polled pair is due again after that delay, unless it's answered, so ignored polls don't repeat the same pairs
+UNANSWERED_POLL_DELAY = timedelta(hours=1)
+
+REVIEW_STATE_FIELDS = ("ease", "repetitions", "interval_days")
+
+
+def get_review_state(pair) -> dict:
+    return {field: pair[field] for field in REVIEW_STATE_FIELDS if field in pair}
+
+
+def review(review_state, quality, now) -> dict:
+    ease = Decimal(review_state.get("ease", DEFAULT_EASE))
+    repetitions = int(review_state.get("repetitions", 0))
+    interval_days = Decimal(review_state.get("interval_days", 0))
+
+    quality_gap = 5 - quality
+    ease = max(MIN_EASE, ease + Decimal("0.1") - quality_gap * (Decimal("0.08") + quality_gap * Decimal("0.02")))
+    if quality < MIN_CORRECT_QUALITY:
+        repetitions, interval_days = 0, Decimal(0)
+        due_at = now + RELEARN_DELAY
+    else:
+        if repetitions == 0:
+            interval_days = FIRST_INTERVAL_DAYS
+        elif repetitions == 1:
+            interval_days = SECOND_INTERVAL_DAYS
+        else:
+            interval_days = (interval_days * ease).quantize(Decimal("0.01"))
+        repetitions += 1
+        due_at = now + timedelta(days=float(interval_days))
+
+    return {
+        "ease": ease.quantize(Decimal("0.01")),
+        "repetitions": repetitions,
+        "interval_days": interval_days,
+        "due_at": format_timestamp(due_at),
+    }
+
+
+def postpone(now) -> dict:
+    return {"due_at": format_timestamp(now + UNANSWERED_POLL_DELAY)}
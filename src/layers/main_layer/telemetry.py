@@ -0,0 +1,107 @@
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from threading import RLock
+
+from aws_lambda_powertools.metrics import Metrics, MetricUnit, single_metric
+
+METRICS_NAMESPACE = os.getenv("POWERTOOLS_METRICS_NAMESPACE", "EnglishPairsLearningBot")
+# Share of invocations, which record per-call metrics. 0 switches them off.
+TELEMETRY_SAMPLE_RATE = float(os.getenv("TELEMETRY_SAMPLE_RATE", "1"))
+# Embedded metric format allows up to 100 values of a metric in one log line
+MAX_RECORDS_PER_FLUSH = 100
+CONSUMED_CAPACITY_OPERATIONS = {
+    "GetItem",
+    "PutItem",
+    "UpdateItem",
+    "DeleteItem",
+    "Query",
+    "Scan",
+    "BatchGetItem",
+    "BatchWriteItem",
+    "TransactGetItems",
+    "TransactWriteItems",
+}
+
+metrics = Metrics(namespace=METRICS_NAMESPACE)
+_lock = RLock()
+_sampled = TELEMETRY_SAMPLE_RATE > 0
+_records_count = 0
+
+
+def add_count(name, value=1, **dimensions):
+    with single_metric(name=name, unit=MetricUnit.Count, value=value, namespace=METRICS_NAMESPACE) as metric:
+        for dimension_name, dimension_value in dimensions.items():
+            metric.add_dimension(name=dimension_name, value=str(dimension_value))
+
+
+def start_invocation():
+    global _sampled
+    _sampled = random.random() < TELEMETRY_SAMPLE_RATE
+
+
+def record(name, unit, value):
+    global _records_count
+    if not _sampled:
+        return
+    with _lock:
+        metrics.add_metric(name=name, unit=unit, value=value)
+        _records_count += 1
+        if _records_count >= MAX_RECORDS_PER_FLUSH:
+            flush_metrics()
+
+
+def flush_metrics():
+    global _records_count
+    with _lock:
+        if metrics.metric_set:
+            # The same log line as log_metrics decorator of powertools writes
+            print(json.dumps(metrics.serialize_metric_set(), separators=(",", ":")))
+            metrics.clear_metrics()
+        _records_count = 0
+
+
+@contextmanager
+def timed(dependency, operation):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(f"{dependency}.{operation}.Latency", MetricUnit.Milliseconds, (time.perf_counter() - started_at) * 1000)
+
+
+def _request_consumed_capacity(params, model, **_):
+    if _sampled and model.name in CONSUMED_CAPACITY_OPERATIONS:
+        params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+
+def _start_request(context, **_):
+    context["telemetry_started_at"] = time.perf_counter()
+
+
+def _finish_request(parsed, model, context, **_):
+    if not (started_at := context.get("telemetry_started_at")):
+        return
+    service_id = model.service_model.service_id
+    record(f"{service_id}.{model.name}.Latency", MetricUnit.Milliseconds, (time.perf_counter() - started_at) * 1000)
+    if retry_attempts := parsed.get("ResponseMetadata", {}).get("RetryAttempts"):
+        record(f"{service_id}.{model.name}.Retries", MetricUnit.Count, retry_attempts)
+    if consumed_capacity := parsed.get("ConsumedCapacity"):
+        # A list of tables for batch and transaction operations
+        if isinstance(consumed_capacity, dict):
+            consumed_capacity = [consumed_capacity]
+        capacity_units = sum(table_capacity.get("CapacityUnits", 0) for table_capacity in consumed_capacity)
+        record(f"{service_id}.{model.name}.CapacityUnits", MetricUnit.Count, capacity_units)
+
+
+def instrument_client(client):
+    events = client.meta.events
+    service_name = client.meta.service_model.service_name
+    # A unique id is taken by the first handler registered with it on any event of the client
+    if service_name == "dynamodb":
+        events.register("before-parameter-build.dynamodb", _request_consumed_capacity, unique_id="telemetry-capacity")
+    events.register(f"before-call.{service_name}", _start_request, unique_id="telemetry-start")
+    events.register(f"after-call.{service_name}", _finish_request, unique_id="telemetry-finish")
+    return client
@@ -1,18 +1,40 @@
 import os
+import sys
 
-from telegram import Bot, ParseMode
-
+from clients import get_bot
 
 ADMIN_IDS = os.getenv("ADMIN_IDS", "").split(",")
 
-bot = Bot(token=os.getenv("TELEGRAM_TOKEN"))
 
+def send_message(user_chat_id, text, disable_markdown=False, reply_markup=None):
+    from telegram import ParseMode
 
-def send_message(user_chat_id, text, disable_markdown=False):
-    send_message_kwargs = {"chat_id": user_chat_id, "text": text}
+    send_message_kwargs = {"chat_id": user_chat_id, "text": text, "reply_markup": reply_markup}
     if not disable_markdown:
         send_message_kwargs["parse_mode"] = ParseMode.MARKDOWN
-    bot.sendMessage(**send_message_kwargs)
+    get_bot().sendMessage(**send_message_kwargs)
+
+
+def edit_message(user_chat_id, message_id, text, reply_markup=None):
+    from telegram import ParseMode
+
+    get_bot().editMessageText(
+        chat_id=user_chat_id,
+        message_id=message_id,
+        text=text,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=reply_markup,
+    )
+
+
+def send_document(user_chat_id, document, filename, caption=None):
+    get_bot().sendDocument(chat_id=user_chat_id, document=document, filename=filename, caption=caption)
+
+
+def is_bot_blocked(error) -> bool:
+    # Bot couldn't be blocked if telegram wasn't even imported, so there is no need to import it here
+    telegram_errors = sys.modules.get("telegram.error")
+    return telegram_errors is not None and isinstance(error, telegram_errors.Unauthorized)
 
 
 class Chat:
@@ -21,5 +43,5 @@ class Chat:
         self.text = tg_update_obj.message.text
         self.username = tg_update_obj.message.chat.username
 
-    def send_message(self, text):
-        send_message(user_chat_id=self.id, text=text)
+    def send_message(self, text, reply_markup=None):
+        send_message(user_chat_id=self.id, text=text, reply_markup=reply_markup)
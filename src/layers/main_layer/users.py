@@ -1,22 +1,51 @@
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 
-from boto3 import client
-
 from aws.dynamodb import delete_all_user_items
 from aws.events_bridge import delete_rule
+from clients import get_client
 from helpers import get_polling_rule_name
 
-
-lambda_client = client("lambda")
+PURGE_LAMBDA_ARN = os.getenv("PURGE_LAMBDA_ARN")
 
 
-def remove_user(user_chat_id, polling_lambda_arn):
-    # Delete all resources related to the user
-    delete_all_user_items(user_chat_id)
+def remove_legacy_polling_rule(user_chat_id, polling_lambda_arn):
+    # Users used to be polled by their own EventBridge rule, before the polling scheduler was introduced
+    lambda_client = get_client("lambda")
     with suppress(lambda_client.exceptions.ResourceNotFoundException):
         lambda_client.remove_permission(
             FunctionName=polling_lambda_arn,
             StatementId=f"PERIODIC_{user_chat_id}_POLLING_PERMISSION",
         )
     delete_rule(get_polling_rule_name(user_chat_id))
+
+
+def remove_user(user_chat_id, polling_lambda_arn):
+    # Delete all resources related to the user
+    delete_all_user_items(user_chat_id)
+    remove_legacy_polling_rule(user_chat_id, polling_lambda_arn)
+
+
+def remove_users(user_chat_ids, polling_lambda_arn, max_workers=8):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Consume the results, so errors are not swallowed
+        list(executor.map(lambda user_chat_id: remove_user(user_chat_id, polling_lambda_arn), user_chat_ids))
+
+
+def request_users_removal(user_chat_ids, polling_lambda_arn):
+    # Users are purged by the purge worker, so user-facing handlers are not blocked by it
+    if not PURGE_LAMBDA_ARN:
+        remove_users(user_chat_ids, polling_lambda_arn)
+        return
+    get_client("lambda").invoke(
+        FunctionName=PURGE_LAMBDA_ARN,
+        InvocationType="Event",
+        Payload=json.dumps(
+            {
+                "user_chat_ids": [str(user_chat_id) for user_chat_id in user_chat_ids],
+                "polling_lambda_arn": polling_lambda_arn,
+            }
+        ),
+    )
@@ -0,0 +1,28 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The handlers run against the stand-ins of the benchmarks, which put the layer on sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+
+import standins  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def services():
+    mock, server = standins.start()
+    yield
+    server.shutdown()
+    mock.stop()
+
+
+@pytest.fixture(scope="session")
+def messages_module():
+    return standins.load_handler_module("messages")
+
+
+def get_translation_pair(user_chat_id, english_text) -> dict:
+    from clients import get_table
+
+    return get_table().get_item(Key={"pk": f"USER#{user_chat_id}", "sk": f"TRANSLATION_PAIR#{english_text}"})["Item"]
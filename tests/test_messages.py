@@ -0,0 +1,158 @@
+import json
+
+import pytest
+
+import handlers
+import standins
+from conftest import get_translation_pair
+
+VOCABULARY_SIZE = 10
+
+
+def invoke_counting_requests(messages_module, body) -> dict:
+    from aws import dynamodb as dynamodb_operations
+
+    # The unit of work of the handler is a part of the outer one, so its requests are counted till the flush
+    with dynamodb_operations.unit_of_work() as current_unit_of_work:
+        messages_module.handler({"body": body}, standins.LambdaContext())
+    return dict(current_unit_of_work.requests)
+
+
+def get_user_stats_counters(user_chat_id) -> tuple:
+    from aws import dynamodb as dynamodb_operations
+
+    stats = dynamodb_operations.get_user_stats(user_chat_id)
+    return stats["correct_answers"], stats["wrong_answers"]
+
+
+def test_quiz_answer_is_counted_once(messages_module):
+    from aws import dynamodb as dynamodb_operations
+
+    user_chat_id = handlers.seed_user(VOCABULARY_SIZE)
+    poll_id = handlers.create_quiz_poll(user_chat_id, 0, VOCABULARY_SIZE)
+    english_text = dynamodb_operations.get_poll(poll_id)["english_text"]
+    body = handlers.poll_body(poll_id, "quiz", {1}, correct_option_id=0)
+
+    assert invoke_counting_requests(messages_module, body) == {"DeleteItem": 1, "TransactWriteItems": 1}
+    # Telegram delivers the same answer again
+    assert invoke_counting_requests(messages_module, body) == {"DeleteItem": 1}
+
+    assert get_translation_pair(user_chat_id, english_text)["wrong_answers"] == 1
+    assert get_user_stats_counters(user_chat_id) == (0, 1)
+
+
+def queue_updates(bodies) -> list:
+    from batch_updates import InMemoryFifoQueue
+
+    # Updates go through the webhook handler, so they are grouped like in SQS
+    webhook_module = standins.load_handler_module("webhook")
+    queue = InMemoryFifoQueue()
+    webhook_module.get_client = lambda service_name: queue
+    for body in bodies:
+        webhook_module.handler({"body": body}, standins.LambdaContext())
+    return list(queue.messages)
+
+
+def test_batch_keeps_chat_order_and_coalesces_writes(messages_module):
+    from clients import get_table
+
+    adding_user_chat_id = handlers.seed_user(VOCABULARY_SIZE)
+    quiz_polls = {}
+    for _ in range(2):
+        user_chat_id = handlers.seed_user(VOCABULARY_SIZE)
+        quiz_polls[user_chat_id] = handlers.create_quiz_poll(user_chat_id, 0, VOCABULARY_SIZE)
+    [(first_user_chat_id, first_poll_id), (second_user_chat_id, second_poll_id)] = quiz_polls.items()
+    records = queue_updates(
+        [
+            handlers.message_body(adding_user_chat_id, "/add_pair"),
+            handlers.poll_body(first_poll_id, "quiz", {0}, correct_option_id=0),
+            handlers.message_body(adding_user_chat_id, "apple"),
+            handlers.poll_body(second_poll_id, "quiz", {1}, correct_option_id=0),
+            handlers.message_body(adding_user_chat_id, "+"),
+        ]
+    )
+    transactions_counter = handlers.DynamoDBRequestsCounter()
+    events = get_table().meta.client.meta.events
+    events.register("before-call.dynamodb.TransactWriteItems", transactions_counter, unique_id="test-transactions")
+    try:
+        messages_module.batch_handler({"Records": records}, standins.LambdaContext())
+    finally:
+        events.unregister("before-call.dynamodb.TransactWriteItems", unique_id="test-transactions")
+
+    assert get_translation_pair(adding_user_chat_id, "apple")["native_text"] == "Переклад apple"
+    # The pair is created by its own transaction, both quiz answers are written by one
+    assert transactions_counter.count == 2
+    assert get_user_stats_counters(first_user_chat_id) == (1, 0)
+    assert get_user_stats_counters(second_user_chat_id) == (0, 1)
+
+
+def test_batch_reports_updates_of_failed_writes(messages_module, monkeypatch):
+    from botocore.exceptions import ClientError
+
+    from aws import dynamodb as dynamodb_operations
+
+    quiz_polls = {}
+    for _ in range(2):
+        user_chat_id = handlers.seed_user(VOCABULARY_SIZE)
+        quiz_polls[user_chat_id] = handlers.create_quiz_poll(user_chat_id, 0, VOCABULARY_SIZE)
+    [(written_user_chat_id, written_poll_id), (failed_user_chat_id, failed_poll_id)] = quiz_polls.items()
+    failed_body = handlers.poll_body(failed_poll_id, "quiz", {0}, correct_option_id=0)
+    records = queue_updates([handlers.poll_body(written_poll_id, "quiz", {0}, correct_option_id=0), failed_body])
+
+    transact_write = dynamodb_operations._transact_write
+
+    def transact_write_failing_for_user(*transact_items):
+        if any(
+            f"USER#{failed_user_chat_id}" in json.dumps(transact_item, default=str) for transact_item in transact_items
+        ):
+            raise ClientError({"Error": {"Code": "InternalServerError"}}, "TransactWriteItems")
+        return transact_write(*transact_items)
+
+    monkeypatch.setattr(dynamodb_operations, "_transact_write", transact_write_failing_for_user)
+    failed_updates_counts = []
+    monkeypatch.setattr(messages_module, "add_count", lambda name, value: failed_updates_counts.append(value))
+    messages_module.batch_handler({"Records": records}, standins.LambdaContext())
+
+    assert failed_updates_counts == [1]
+    assert get_user_stats_counters(written_user_chat_id) == (1, 0)
+    assert get_user_stats_counters(failed_user_chat_id) == (0, 0)
+
+
+def test_suggestion_accepted_while_user_is_purged_leaves_no_items(messages_module, monkeypatch):
+    from boto3.dynamodb.conditions import Key
+
+    from aws import dynamodb as dynamodb_operations
+    from clients import get_table
+
+    user_chat_id = handlers.seed_user(VOCABULARY_SIZE)
+    handlers.create_suggestion(user_chat_id, 0, VOCABULARY_SIZE)
+    get_suggestion = dynamodb_operations.get_suggestion
+
+    def get_suggestion_and_purge(poll_id):
+        # The user sends /purge while the answer is being handled
+        suggestion_info = get_suggestion(poll_id)
+        dynamodb_operations.delete_all_user_items(user_chat_id)
+        return suggestion_info
+
+    monkeypatch.setattr(dynamodb_operations, "get_suggestion", get_suggestion_and_purge)
+    body = handlers.poll_body(f"suggestion-{user_chat_id}-0", "regular", {0, 2}, 5)
+    messages_module.handler({"body": body}, standins.LambdaContext())
+
+    items = get_table().query(KeyConditionExpression=Key("pk").eq(f"USER#{user_chat_id}"))["Items"]
+    assert {item["sk"].split("#")[0] for item in items} == {"DELETED_TRANSLATIONS_BATCH"}
+
+
+def test_batch_is_retried_when_unit_of_work_does_not_start(messages_module, monkeypatch):
+    from botocore.exceptions import ClientError
+
+    from aws import dynamodb as dynamodb_operations
+
+    user_chat_id = handlers.seed_user(VOCABULARY_SIZE)
+    records = queue_updates([handlers.message_body(user_chat_id, "/start")])
+
+    def failing_unit_of_work():
+        raise ClientError({"Error": {"Code": "InternalServerError"}}, "GetItem")
+
+    monkeypatch.setattr(dynamodb_operations, "unit_of_work", failing_unit_of_work)
+    with pytest.raises(ClientError):
+        messages_module.batch_handler({"Records": records}, standins.LambdaContext())
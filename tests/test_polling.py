@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+
+import handlers
+import standins
+from conftest import get_translation_pair
+
+VOCABULARY_SIZE = 10
+
+
+def test_quiz_poll_is_stored_and_counted_by_the_answer(messages_module):
+    from aws import dynamodb as dynamodb_operations
+
+    user_chat_id = handlers.seed_user(VOCABULARY_SIZE)
+    poll_id = handlers.create_quiz_poll(user_chat_id, 0, VOCABULARY_SIZE)
+
+    poll = dynamodb_operations.get_poll(poll_id)
+    assert poll["user_chat_id"] == str(user_chat_id)
+    pair_index = int(poll["english_text"].split()[-1])
+    pair = get_translation_pair(user_chat_id, poll["english_text"])
+    assert pair["polls_count"] == pair_index % 7 + 1
+    assert "correct_answers" not in pair
+    assert dynamodb_operations.get_user_stats(user_chat_id)["polls_count"] == 1
+
+    messages_module.handler(
+        {"body": handlers.poll_body(poll_id, "quiz", {0}, correct_option_id=0)}, standins.LambdaContext()
+    )
+
+    assert not dynamodb_operations.get_poll(poll_id)
+    pair = get_translation_pair(user_chat_id, poll["english_text"])
+    assert pair["correct_answers"] == 1
+    assert pair["repetitions"] == 1
+    stats = dynamodb_operations.get_user_stats(user_chat_id)
+    assert (stats["polls_count"], stats["correct_answers"], stats["wrong_answers"]) == (1, 1, 0)
+
+
+def test_polled_pairs_are_postponed_till_they_are_answered():
+    from aws import dynamodb as dynamodb_operations
+    from helpers import format_timestamp
+
+    user_chat_id = handlers.seed_user(VOCABULARY_SIZE)
+    poll_ids = [handlers.create_quiz_poll(user_chat_id, iteration, VOCABULARY_SIZE) for iteration in range(4)]
+    polled_texts = [dynamodb_operations.get_poll(poll_id)["english_text"] for poll_id in poll_ids]
+
+    # Ignored polls don't make the same pairs the most overdue ones
+    assert len(set(polled_texts)) == len(polled_texts)
+    now = format_timestamp(datetime.now(timezone.utc))
+    for english_text in polled_texts:
+        assert get_translation_pair(user_chat_id, english_text)["due_at"] > now
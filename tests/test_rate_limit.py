@@ -0,0 +1,14 @@
+import time
+
+from rate_limit import KeyedIntervalLimiter
+
+
+def test_keys_allowed_again_are_evicted():
+    limiter = KeyedIntervalLimiter(min_interval=0.01)
+    limiter.acquire("first chat")
+    limiter.acquire("second chat")
+    time.sleep(0.02)
+
+    limiter.acquire("third chat")
+
+    assert list(limiter._next_allowed_at) == ["third chat"]
@@ -0,0 +1,107 @@
+import json
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+import handlers
+import standins
+from conftest import get_translation_pair
+
+EVENT_PATH = Path(__file__).resolve().parents[1] / "events" / "stats_rollup.json"
+USER_CHAT_ID = "100000001"
+DAY = "2025-10-09"
+
+
+@pytest.fixture(scope="module")
+def stats_rollup_module():
+    return standins.load_handler_module("stats_rollup")
+
+
+def get_counters(item) -> dict:
+    return {field: item.get(field, 0) for field in ("polls_count", "correct_answers", "wrong_answers")}
+
+
+def get_pair_rollup(english_text, user_chat_id=USER_CHAT_ID, day=DAY) -> dict:
+    from clients import get_table
+
+    return get_table().get_item(Key={"pk": f"USER#{user_chat_id}", "sk": f"ROLLUP#PAIR#{english_text}#{day}"})["Item"]
+
+
+def write_with_stream_record(write, user_chat_id, english_text, sequence_number) -> dict:
+    # Images of the pair are read around the write, like the table stream has them
+    from boto3.dynamodb.types import TypeSerializer
+
+    serializer = TypeSerializer()
+    key = {"pk": f"USER#{user_chat_id}", "sk": f"TRANSLATION_PAIR#{english_text}"}
+    old_item = get_translation_pair(user_chat_id, english_text)
+    write()
+    new_item = get_translation_pair(user_chat_id, english_text)
+    return {
+        "eventName": "MODIFY",
+        "dynamodb": {
+            "ApproximateCreationDateTime": int(time.time()),
+            "Keys": {name: serializer.serialize(value) for name, value in key.items()},
+            "SequenceNumber": str(sequence_number),
+            "OldImage": {name: serializer.serialize(value) for name, value in old_item.items()},
+            "NewImage": {name: serializer.serialize(value) for name, value in new_item.items()},
+        },
+    }
+
+
+def test_stream_records_are_rolled_up_once(stats_rollup_module):
+    from aws import dynamodb as dynamodb_operations
+
+    event = json.loads(EVENT_PATH.read_text())
+    # The recorded batch has a redelivered record already, and the whole batch is delivered again after it
+    for records in (event["Records"], event["Records"], event["Records"][-2:]):
+        assert stats_rollup_module.handler({"Records": records}, standins.LambdaContext()) == {"batchItemFailures": []}
+
+        daily_rollup = dynamodb_operations.get_daily_rollup(USER_CHAT_ID, DAY)
+        assert get_counters(daily_rollup) == {"polls_count": 2, "correct_answers": 1, "wrong_answers": 1}
+        assert get_counters(get_pair_rollup("apple")) == {"polls_count": 1, "correct_answers": 1, "wrong_answers": 0}
+        assert get_counters(get_pair_rollup("run away")) == {
+            "polls_count": 1,
+            "correct_answers": 0,
+            "wrong_answers": 1,
+        }
+
+    assert daily_rollup["user_chat_id"] == USER_CHAT_ID
+    assert [rollup["user_chat_id"] for rollup in dynamodb_operations.list_daily_rollups(DAY)] == [USER_CHAT_ID]
+
+
+def test_pair_added_again_does_not_decrease_rollups(stats_rollup_module):
+    from aws import dynamodb as dynamodb_operations
+
+    user_chat_id = handlers.seed_user(10)
+    # The pair was polled 5 times before
+    english_text = "word 5"
+    handlers.with_action("TRANSLATION_PAIR_DELETING")(user_chat_id, 0, 10)
+    records = [
+        write_with_stream_record(
+            lambda: dynamodb_operations.increment_translation_pair_fields(user_chat_id, english_text, polls_count=1),
+            user_chat_id,
+            english_text,
+            200_000_000_000_000_000_001,
+        ),
+        write_with_stream_record(
+            lambda: dynamodb_operations.mark_translation_pair_inactive(user_chat_id, english_text),
+            user_chat_id,
+            english_text,
+            200_000_000_000_000_000_002,
+        ),
+        write_with_stream_record(
+            lambda: dynamodb_operations.create_translation_pair(user_chat_id, english_text, "слово 5"),
+            user_chat_id,
+            english_text,
+            200_000_000_000_000_000_003,
+        ),
+    ]
+    assert get_translation_pair(user_chat_id, english_text)["polls_count"] == 0
+
+    assert stats_rollup_module.handler({"Records": records}, standins.LambdaContext()) == {"batchItemFailures": []}
+
+    day = datetime.now(timezone.utc).date().isoformat()
+    assert get_counters(dynamodb_operations.get_daily_rollup(user_chat_id, day))["polls_count"] == 1
+    assert get_counters(get_pair_rollup(english_text, user_chat_id, day))["polls_count"] == 1
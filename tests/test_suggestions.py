@@ -0,0 +1,27 @@
+import json
+
+import handlers
+import standins
+
+
+def test_suggestion_with_one_new_pair_is_not_sent(monkeypatch):
+    from boto3.dynamodb.conditions import Key
+
+    import gpt
+    from clients import get_table
+
+    user_chat_id = handlers.seed_user(handlers.SUGGESTIONS_VOCABULARY_SIZE)
+    suggestions_module = standins.load_handler_module("suggestions")
+    # Every vocabulary of the benchmarks has these pairs already
+    generated_pairs = [["word 0", "слово 0"], ["word 1", "слово 1"], ["suggested word", "запропоноване слово"]]
+    monkeypatch.setattr(gpt, "complete", lambda prompt: json.dumps(generated_pairs))
+    requests_count = standins.FakeTelegramHandler.requests_count
+
+    suggestions_module.handler({}, standins.LambdaContext())
+
+    assert standins.FakeTelegramHandler.requests_count == requests_count
+    suggestions = get_table().query(
+        IndexName="gsi1",
+        KeyConditionExpression=Key("gsi1pk").eq(f"USER#{user_chat_id}") & Key("gsi1sk").begins_with("SUGGESTION#"),
+    )["Items"]
+    assert not suggestions
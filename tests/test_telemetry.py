@@ -0,0 +1,19 @@
+import handlers
+
+
+def test_dynamodb_requests_are_recorded(monkeypatch):
+    import telemetry
+    from aws import dynamodb as dynamodb_operations
+
+    user_chat_id = handlers.seed_user(1)
+    # The stand-ins switch off the sampling of the per-call metrics
+    monkeypatch.setattr(telemetry, "_sampled", True)
+    telemetry.metrics.clear_metrics()
+    try:
+        dynamodb_operations.get_user(user_chat_id)
+        recorded_metrics = dict(telemetry.metrics.metric_set)
+    finally:
+        telemetry.metrics.clear_metrics()
+
+    assert "DynamoDB.GetItem.Latency" in recorded_metrics
+    assert "DynamoDB.GetItem.CapacityUnits" in recorded_metrics